@@ -0,0 +1,268 @@
+"""End-to-end latency benchmarks for `rx <cmd>`.
+
+This runs the CLI the way integration_test.sh does (python -m rx
+--rxroot=...), against an in-process fake worker (rx/testing/fake_worker.py)
+that runs commands locally and, if rsync is installed, a local rsync daemon to
+upload to. Nothing goes over the network. Results are written as JSON so runs
+can be compared across versions:
+
+  python -m benchmarks.end_to_end --e2e_output=/tmp/before.json
+  python -m benchmarks.end_to_end --e2e_files=1000 --e2e_commands=trivial \
+    --noe2e_sync
+
+Each repo size gets a synthetic rxroot. Its first run is reported separately
+as "cold", since it uploads everything. Then each command is run --e2e_runs
+times:
+
+* trivial: `true`, so this is all rx overhead.
+* chatty: thousands of short, flushed lines.
+* large_stdout: one big write.
+"""
+import dataclasses
+import json
+import os
+import pathlib
+import pty
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Sequence
+
+from absl import app
+from absl import flags
+
+from rx.client import history
+from rx.client.configuration import local
+from rx.testing import fake_worker
+
+_FILES = flags.DEFINE_list(
+  'e2e_files', ['1000', '50000', '500000'],
+  'Sizes (number of files) of the synthetic repos to run in.')
+_COMMANDS = flags.DEFINE_list(
+  'e2e_commands', ['trivial', 'chatty', 'large_stdout'], 'Commands to run.')
+_RUNS = flags.DEFINE_integer(
+  'e2e_runs', 5, 'How many times to run each command (after the cold run).')
+_SYNC = flags.DEFINE_boolean(
+  'e2e_sync', True,
+  'Upload the repo with rsync before each run, like a real workspace. '
+  'Requires rsync.')
+_CHATTY_LINES = flags.DEFINE_integer(
+  'e2e_chatty_lines', 5000, 'Lines the chatty command prints.')
+_LARGE_STDOUT_BYTES = flags.DEFINE_integer(
+  'e2e_large_stdout_bytes', 64 << 20,
+  'Bytes the large_stdout command prints.')
+_OUTPUT = flags.DEFINE_string(
+  'e2e_output', None, 'File to write JSON results to. Defaults to stdout.')
+
+_FILES_PER_DIR = 100
+_FILE_BYTES = 256
+_WORKSPACE = 'ws123'
+_REPO_ROOT = pathlib.Path(__file__).parent.parent
+_RSYNC_START_TIMEOUT_SECS = 10
+
+
+@dataclasses.dataclass
+class Command:
+  name: str
+  argv: List[str]
+
+
+def get_commands(
+    chatty_lines: int, large_stdout_bytes: int) -> Dict[str, Command]:
+  # The fake worker runs commands locally, so this Python is available.
+  return {
+    'trivial': Command('trivial', ['true']),
+    'chatty': Command('chatty', [
+      sys.executable, '-c',
+      f'for i in range({chatty_lines}): print("line", i, flush=True)']),
+    'large_stdout': Command('large_stdout', [
+      sys.executable, '-c',
+      f'import sys; sys.stdout.buffer.write(b"x" * {large_stdout_bytes})']),
+  }
+
+
+def make_repo(rxroot: pathlib.Path, files: int):
+  """Writes files small files, _FILES_PER_DIR to a directory."""
+  content = b'x' * _FILE_BYTES
+  for i in range(files):
+    d = rxroot / 'src' / f'd{i // _FILES_PER_DIR}'
+    if i % _FILES_PER_DIR == 0:
+      d.mkdir(parents=True)
+    (d / f'f{i}.txt').write_bytes(content)
+
+
+def _free_port() -> int:
+  with socket.socket() as s:
+    s.bind(('127.0.0.1', 0))
+    return s.getsockname()[1]
+
+
+class RsyncDaemon:
+  """`rsync --daemon` serving one module, like the worker's."""
+
+  def __init__(self, rsync_path: str, workdir: pathlib.Path) -> None:
+    self.module_dir = workdir / _WORKSPACE
+    self.module_dir.mkdir(parents=True)
+    conf = workdir / 'rsyncd.conf'
+    conf.write_text(
+      'use chroot = false\n'
+      f'uid = {os.getuid()}\n'
+      f'gid = {os.getgid()}\n'
+      f'pid file = {workdir / "rsyncd.pid"}\n'
+      f'[{_WORKSPACE}]\n'
+      f'  path = {self.module_dir}\n'
+      '  read only = false\n')
+    self.port = _free_port()
+    self._process = subprocess.Popen([
+      rsync_path, '--daemon', '--no-detach', f'--config={conf}',
+      '--address=127.0.0.1', f'--port={self.port}',
+      f'--log-file={workdir / "rsyncd.log"}'])
+    deadline = time.monotonic() + _RSYNC_START_TIMEOUT_SECS
+    while True:
+      try:
+        socket.create_connection(('127.0.0.1', self.port)).close()
+        return
+      except OSError:
+        if (time.monotonic() > deadline or
+            self._process.poll() is not None):
+          self.stop()
+          raise RuntimeError('rsync daemon did not start')
+        time.sleep(0.05)
+
+  def stop(self):
+    self._process.terminate()
+    self._process.wait()
+
+
+def run_rx(
+    rxroot: pathlib.Path,
+    argv: Sequence[str],
+    rx_flags: Sequence[str] = ()) -> Dict[str, Any]:
+  """Runs `python -m rx <argv>` and returns how long it took.
+
+  Also returns the phases the CLI timed itself (via --metrics_out).
+  """
+  metrics_file = rxroot.parent / 'metrics.json'
+  cmd = [
+    sys.executable, '-m', 'rx', f'--rxroot={rxroot}',
+    f'--metrics_out={metrics_file}', *rx_flags, *argv]
+  env = dict(os.environ)
+  env['PYTHONPATH'] = os.pathsep.join(
+    p for p in (str(_REPO_ROOT), env.get('PYTHONPATH')) if p)
+  # rx puts stdin in cbreak mode, so it has to be a terminal.
+  pty_main, pty_stdin = pty.openpty()
+  try:
+    start = time.perf_counter()
+    proc = subprocess.run(
+      cmd, cwd=rxroot, env=env, stdin=pty_stdin, stdout=subprocess.PIPE,
+      stderr=subprocess.PIPE, check=False)
+    wall_secs = time.perf_counter() - start
+  finally:
+    os.close(pty_stdin)
+    os.close(pty_main)
+  if proc.returncode != 0:
+    raise RuntimeError(
+      f'`{" ".join(cmd)}` failed ({proc.returncode}): '
+      f'{proc.stderr.decode(errors="replace")[-2000:]}')
+  result = {'wall_secs': wall_secs, 'stdout_bytes': len(proc.stdout)}
+  with metrics_file.open(encoding='utf-8') as fh:
+    samples = json.load(fh)
+  for s in samples:
+    labels = s.get('labels', {})
+    if not s.get('count'):
+      # E.g., no first byte for a command with no output.
+      continue
+    if s['name'] == 'rsync.duration_secs' and labels.get('op') == 'to_remote':
+      result['sync_secs'] = s['sum']
+    elif s['name'] == 'exec.first_byte_secs':
+      result['first_byte_secs'] = s['sum']
+    elif s['name'] == 'exec.duration_secs':
+      result['exec_secs'] = s['sum']
+  return result
+
+
+def summarize(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+  """Returns p50/p99 of each measurement across runs."""
+  summary: Dict[str, Any] = {'runs': len(runs)}
+  for key in ('wall_secs', 'sync_secs', 'first_byte_secs', 'exec_secs'):
+    values = [r[key] for r in runs if key in r]
+    if values:
+      summary[f'{key}_p50'] = history.percentile(values, 50)
+      summary[f'{key}_p99'] = history.percentile(values, 99)
+  if runs:
+    summary['stdout_bytes'] = runs[0]['stdout_bytes']
+  return summary
+
+
+def run(
+    repo_sizes: Sequence[int],
+    commands: Sequence[Command],
+    runs: int,
+    sync: bool = True) -> Dict[str, Any]:
+  """Sets up a fake worker and runs each command in each size of repo."""
+  rsync_path = shutil.which('rsync') if sync else None
+  if sync and not rsync_path:
+    raise RuntimeError('--e2e_sync requires rsync')
+  results: Dict[str, Any] = {}
+  for size in repo_sizes:
+    with tempfile.TemporaryDirectory() as tmpdir:
+      rxroot = pathlib.Path(tmpdir) / 'rxroot'
+      rxroot.mkdir()
+      make_repo(rxroot, size)
+      rsyncd = None
+      rx_flags = []
+      workdir = rxroot
+      if rsync_path:
+        rsyncd = RsyncDaemon(rsync_path, pathlib.Path(tmpdir) / 'worker')
+        rx_flags.append(f'--rsync_port={rsyncd.port}')
+        workdir = rsyncd.module_dir
+      servicer = fake_worker.FakeExecutionService(workdir=workdir)
+      server, addr = fake_worker.start_server(servicer)
+      try:
+        fake_worker.setup_rxroot(
+          rxroot, addr, rsync_path=rsync_path or '/usr/bin/rsync',
+          should_sync=bool(rsync_path))
+        cold = run_rx(rxroot, ['true'], rx_flags)
+        results[str(size)] = {
+          'cold': cold,
+          'commands': {
+            c.name: summarize(
+              [run_rx(rxroot, c.argv, rx_flags) for _ in range(runs)])
+            for c in commands
+          },
+        }
+      finally:
+        server.stop(grace=None)
+        if rsyncd:
+          rsyncd.stop()
+  return {
+    'version': local.VERSION,
+    'sync': sync,
+    'repos': results,
+  }
+
+
+def main(argv: Sequence[str]):
+  del argv
+  available = get_commands(_CHATTY_LINES.value, _LARGE_STDOUT_BYTES.value)
+  unknown = set(_COMMANDS.value) - set(available)
+  if unknown:
+    raise app.UsageError(f'Unknown commands: {", ".join(sorted(unknown))}')
+  results = run(
+    [int(f) for f in _FILES.value],
+    [available[name] for name in _COMMANDS.value],
+    _RUNS.value,
+    _SYNC.value)
+  output = json.dumps(results, indent=2, sort_keys=True)
+  if _OUTPUT.value:
+    with open(_OUTPUT.value, 'wt', encoding='utf-8') as fh:
+      fh.write(output + '\n')
+  else:
+    print(output)
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -0,0 +1,424 @@
+"""Microbenchmarks for the client's and daemon's inner loops.
+
+Each benchmark times one operation (e.g., writing a chunk of output or looking
+a path up in a 1M-file manifest) over enough iterations to be measurable and
+reports the median seconds per operation. Results are compared to the baselines
+recorded in microbenchmarks_baselines.json:
+
+  python -m benchmarks.microbenchmarks
+  python -m benchmarks.microbenchmarks --micro_benchmarks=manifest_contains
+  python -m benchmarks.microbenchmarks --micro_update_baselines
+
+Baselines are machine-specific, so re-record them (on the same machine) before
+comparing a change against them. --micro_check exits non-zero if any benchmark
+is more than --micro_tolerance slower than its baseline.
+"""
+import contextlib
+import dataclasses
+import io
+import json
+import os
+import pathlib
+import pty
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from typing import (
+  Any, Callable, ContextManager, Dict, Iterator, List, Optional, Sequence)
+
+from absl import app
+from absl import flags
+import yaml
+
+from rx.client.configuration import config_base
+from rx.client.configuration import local
+from rx.daemon.port_forwarding import buffers
+from rx.daemon.port_forwarding import client_socket
+from rx.proto import rx_pb2
+from rx.shared import progress_bar
+from rx.trex.toolchain import manifest
+from rx.worker import executor
+
+_BENCHMARKS_FLAG = flags.DEFINE_list(
+  'micro_benchmarks', None, 'Benchmarks to run. Defaults to all of them.')
+_MIN_SECS = flags.DEFINE_float(
+  'micro_min_secs', 0.2, 'Minimum time each timed batch should take.')
+_REPEAT = flags.DEFINE_integer(
+  'micro_repeat', 5, 'Batches to time; the median is reported.')
+_CHECK = flags.DEFINE_boolean(
+  'micro_check', False,
+  'Exit non-zero if a benchmark regressed past --micro_tolerance.')
+_TOLERANCE = flags.DEFINE_float(
+  'micro_tolerance', 0.25,
+  'How much slower than its baseline a benchmark can be, e.g., 0.25 is 25%.')
+_UPDATE_BASELINES = flags.DEFINE_boolean(
+  'micro_update_baselines', False,
+  'Write these results as the new baselines.')
+_OUTPUT = flags.DEFINE_string(
+  'micro_output', None, 'File to write JSON results to. Defaults to stdout.')
+
+BASELINES_FILE = pathlib.Path(__file__).parent / (
+  'microbenchmarks_baselines.json')
+
+# Sizes of the data each benchmark works on.
+MANIFEST_FILES = 1_000_000
+MANIFEST_LOOKUPS = 100
+PROGRESS_LAYERS = 300
+PROGRESS_UPDATES = 20
+STDIN_LINES = 1000
+FORWARD_BYTES = 4 << 20
+
+# Returns a context manager that sets up the benchmark, yields the operation to
+# time and then cleans up.
+_Setup = Callable[[], ContextManager[Callable[[], Any]]]
+
+
+@dataclasses.dataclass
+class Benchmark:
+  name: str
+  setup: _Setup
+  # If set, throughput is reported too.
+  bytes_per_op: Callable[[], int] = lambda: 0
+
+
+_BENCHMARKS: Dict[str, Benchmark] = {}
+
+
+def _benchmark(name: str, bytes_per_op: Callable[[], int] = lambda: 0):
+  def register(setup: Callable[[], Iterator[Callable[[], Any]]]) -> _Setup:
+    cm = contextlib.contextmanager(setup)
+    _BENCHMARKS[name] = Benchmark(name, cm, bytes_per_op)
+    return cm
+  return register
+
+
+class _Drain:
+  """Reads and discards everything written to a pipe."""
+
+  def __init__(self) -> None:
+    read_fd, write_fd = os.pipe()
+    self._read_fd = read_fd
+    self.sink = os.fdopen(write_fd, 'wb')
+    self._thread = threading.Thread(target=self._drain, daemon=True)
+    self._thread.start()
+
+  def _drain(self):
+    while os.read(self._read_fd, 1 << 16):
+      pass
+
+  def close(self):
+    self.sink.close()
+    self._thread.join()
+    os.close(self._read_fd)
+
+
+def _executor_write(chunk_bytes: int) -> Iterator[Callable[[], Any]]:
+  runner = executor.Executor(None, rx_pb2.ExecRequest())  # type: ignore
+  drain = _Drain()
+  chunk = b'x' * chunk_bytes
+  try:
+    yield lambda: runner.write(chunk, drain.sink)
+  finally:
+    drain.close()
+
+
+@_benchmark('executor_write_small', bytes_per_op=lambda: 100)
+def executor_write_small() -> Iterator[Callable[[], Any]]:
+  """Writes a line of output to a pipe, like a chatty command does."""
+  yield from _executor_write(100)
+
+
+@_benchmark('executor_write_large', bytes_per_op=lambda: 1 << 20)
+def executor_write_large() -> Iterator[Callable[[], Any]]:
+  """Writes 1 MiB of output to a pipe."""
+  yield from _executor_write(1 << 20)
+
+
+@_benchmark('stdin_iterator', bytes_per_op=lambda: STDIN_LINES * 8)
+def stdin_iterator() -> Iterator[Callable[[], Any]]:
+  """Reads STDIN_LINES lines typed into a terminal as ExecRequests."""
+  main_fd, stdin_fd = pty.openpty()
+  stdin = os.fdopen(stdin_fd, 'rt')
+  original_stdin = sys.stdin
+  sys.stdin = stdin
+  line = b'1234567\n'
+  try:
+    with executor.StdinIterator(rx_pb2.ExecRequest()) as it:
+      next(it)  # The initial request.
+
+      def read_lines():
+        expected = STDIN_LINES * len(line)
+        got = 0
+        for _ in range(STDIN_LINES):
+          os.write(main_fd, line)
+        while got < expected:
+          got += len(next(it).stdin)
+
+      yield read_lines
+  finally:
+    sys.stdin = original_stdin
+    stdin.close()
+    os.close(main_fd)
+
+
+class _EchoClient:
+  """Stands in for the worker, sending each frame straight back."""
+
+  def forward_to_port(
+      self, port: int, stream: Iterator[bytes]) -> Iterator[bytes]:
+    del port
+    return stream
+
+
+@_benchmark('connection_forwarding', bytes_per_op=lambda: FORWARD_BYTES * 2)
+def connection_forwarding() -> Iterator[Callable[[], Any]]:
+  """Forwards FORWARD_BYTES through a connection to an echoing worker."""
+  budget = buffers.MemoryBudget(64 << 20)
+  payload = b'x' * FORWARD_BYTES
+
+  def forward():
+    local_end, daemon_end = socket.socketpair()
+
+    def send():
+      local_end.sendall(payload)
+      local_end.shutdown(socket.SHUT_WR)
+
+    def receive():
+      while local_end.recv(1 << 16):
+        pass
+
+    threads = [threading.Thread(target=f) for f in (send, receive)]
+    for th in threads:
+      th.start()
+    with client_socket.Connection(daemon_end, budget, 1 << 20) as conn:
+      conn.handle(_EchoClient(), 0)  # type: ignore
+    for th in threads:
+      th.join()
+    local_end.close()
+
+  yield forward
+
+
+def _manifest_files() -> List[str]:
+  exts = ['.py', '.go', '.js', '.ts', '.md', '.json', '.txt', '']
+  return [
+    f'src/pkg{i // 1000}/mod{i % 1000}/file{i}{exts[i % len(exts)]}'
+    for i in range(MANIFEST_FILES)
+  ]
+
+
+@_benchmark('manifest_contains')
+def manifest_contains() -> Iterator[Callable[[], Any]]:
+  """Looks up MANIFEST_LOOKUPS paths (half missing) in the manifest."""
+  files = _manifest_files()
+  m = manifest.Manifest(files)
+  step = max(1, len(files) // MANIFEST_LOOKUPS)
+  paths = [
+    files[i] if n % 2 else f'missing/{i}.py'
+    for n, i in enumerate(range(0, len(files), step))
+  ][:MANIFEST_LOOKUPS]
+
+  def lookup():
+    for p in paths:
+      _ = p in m
+
+  yield lookup
+
+
+@_benchmark('manifest_most_popular_extensions')
+def manifest_most_popular_extensions() -> Iterator[Callable[[], Any]]:
+  """Counts extensions on a fresh manifest."""
+  files = _manifest_files()
+  yield lambda: list(manifest.Manifest(files).most_popular_extensions())
+
+
+_ENV_DICT = {
+  'remote': {
+    'hardware': {'processor': 'gpu'},
+    'toolchain': [
+      {'name': 'python', 'version': '3.10'},
+      {'name': 'node', 'version': '18'},
+    ],
+  },
+  'image': {
+    'repository': 'python',
+    'tag': '3.10',
+    'ports': [8080, 8888],
+    'environment_variables': {f'VAR{i}': i for i in range(20)},
+  },
+}
+
+
+@_benchmark('env_dict_to_pb')
+def env_dict_to_pb() -> Iterator[Callable[[], Any]]:
+  """Converts a typical remote config to an Environment."""
+  yield lambda: local.env_dict_to_pb(_ENV_DICT)
+
+
+def _layer_progress() -> List[rx_pb2.DockerImageProgress]:
+  progress = []
+  total = 100 << 20
+  for update in range(1, PROGRESS_UPDATES + 1):
+    for layer in range(PROGRESS_LAYERS):
+      progress.append(rx_pb2.DockerImageProgress(
+        id=f'layer{layer}', status='Downloading', total=total,
+        current=total * update // PROGRESS_UPDATES))
+  return progress
+
+
+@_benchmark('show_progress_bars')
+def show_progress_bars() -> Iterator[Callable[[], Any]]:
+  """Shows PROGRESS_LAYERS layers' progress, PROGRESS_UPDATES times each."""
+  progress = _layer_progress()
+
+  def show():
+    # tqdm writes to stderr.
+    with contextlib.redirect_stderr(io.StringIO()):
+      progress_bar.show_progress_bars(progress)
+
+  yield show
+
+
+@_benchmark('config_loading')
+def config_loading() -> Iterator[Callable[[], Any]]:
+  """Finds and loads an rxroot's config and remote environment."""
+  with tempfile.TemporaryDirectory() as tmpdir:
+    rxroot = pathlib.Path(tmpdir)
+    config_base.get_config_dir(rxroot).mkdir(parents=True)
+    remote_file = rxroot / local.REMOTE_DIR / 'default'
+    remote_file.parent.mkdir(parents=True)
+    with remote_file.open('wt', encoding='utf-8') as fh:
+      yaml.safe_dump(_ENV_DICT, fh)
+    local.LocalConfig(
+      cwd=rxroot, remote=str(local.REMOTE_DIR / 'default'),
+      project_name='bench', rsync_path='/usr/bin/rsync').store()
+    subdir = rxroot / 'a' / 'b' / 'c'
+    subdir.mkdir(parents=True)
+
+    def load():
+      cfg = local.find_local_config(local.find_rxroot(subdir) or subdir)
+      assert cfg
+      cfg.get_target_env()
+
+    yield load
+
+
+def measure(
+    op: Callable[[], Any], min_secs: float, repeat: int) -> List[float]:
+  """Returns seconds per op for each of repeat batches.
+
+  Each batch runs op enough times to take at least min_secs.
+  """
+  number = 1
+  while True:
+    elapsed = _time(op, number)
+    if elapsed >= min_secs:
+      break
+    # Aim a bit over min_secs, so this usually converges in one more try.
+    number = max(number * 2, int(number * min_secs * 1.2 / max(elapsed, 1e-9)))
+  timings = [elapsed / number]
+  for _ in range(repeat - 1):
+    timings.append(_time(op, number) / number)
+  return timings
+
+
+def _time(op: Callable[[], Any], number: int) -> float:
+  start = time.perf_counter()
+  for _ in range(number):
+    op()
+  return time.perf_counter() - start
+
+
+def run(
+    names: Sequence[str],
+    min_secs: float = 0.2,
+    repeat: int = 5) -> Dict[str, Dict[str, float]]:
+  """Runs benchmarks and returns their timings."""
+  results = {}
+  for name in names:
+    bench = _BENCHMARKS[name]
+    with bench.setup() as op:
+      timings = measure(op, min_secs, repeat)
+    result = {
+      'secs_per_op': statistics.median(timings),
+      'min_secs_per_op': min(timings),
+    }
+    size = bench.bytes_per_op()
+    if size:
+      result['bytes_per_sec'] = size / result['secs_per_op']
+    results[name] = result
+  return results
+
+
+def compare(
+    results: Dict[str, Dict[str, float]],
+    baselines: Dict[str, float],
+    tolerance: float) -> List[str]:
+  """Adds each result's ratio to its baseline and returns the regressions."""
+  regressions = []
+  for name, result in results.items():
+    baseline = baselines.get(name)
+    if not baseline:
+      continue
+    ratio = result['secs_per_op'] / baseline
+    result['baseline_secs_per_op'] = baseline
+    result['ratio_to_baseline'] = ratio
+    if ratio > 1 + tolerance:
+      regressions.append(
+        f'{name}: {ratio:.2f}x its baseline '
+        f'({result["secs_per_op"]:.3g}s vs. {baseline:.3g}s per op)')
+  return regressions
+
+
+def load_baselines(path: pathlib.Path = BASELINES_FILE) -> Dict[str, float]:
+  if not path.exists():
+    return {}
+  with path.open(encoding='utf-8') as fh:
+    return json.load(fh)
+
+
+def write_baselines(
+    results: Dict[str, Dict[str, float]],
+    path: pathlib.Path = BASELINES_FILE):
+  baselines = load_baselines(path)
+  baselines.update({k: v['secs_per_op'] for k, v in results.items()})
+  with path.open('wt', encoding='utf-8') as fh:
+    json.dump(baselines, fh, indent=2, sort_keys=True)
+    fh.write('\n')
+
+
+def names() -> List[str]:
+  return list(_BENCHMARKS)
+
+
+def main(argv: Sequence[str]):
+  del argv
+  selected: Optional[List[str]] = _BENCHMARKS_FLAG.value
+  if selected is None:
+    selected = names()
+  unknown = set(selected) - set(_BENCHMARKS)
+  if unknown:
+    raise app.UsageError(f'Unknown benchmarks: {", ".join(sorted(unknown))}')
+  results = run(selected, _MIN_SECS.value, _REPEAT.value)
+  regressions = compare(results, load_baselines(), _TOLERANCE.value)
+  if _UPDATE_BASELINES.value:
+    write_baselines(results)
+  output = json.dumps(
+    {'version': local.VERSION, 'benchmarks': results}, indent=2,
+    sort_keys=True)
+  if _OUTPUT.value:
+    with open(_OUTPUT.value, 'wt', encoding='utf-8') as fh:
+      fh.write(output + '\n')
+  else:
+    print(output)
+  for r in regressions:
+    print(f'Regression: {r}', file=sys.stderr)
+  if _CHECK.value and regressions:
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -0,0 +1,384 @@
+"""Load and throughput benchmarks for the daemon's port forwarding.
+
+This runs a PortForwardingService in its own process, pointed at an in-process
+fake worker (rx/testing/fake_worker.py) that forwards to a local payload
+server, then drives TCP clients through the forwarded port. Results are written
+as JSON so runs can be compared across versions:
+
+  python -m benchmarks.port_forwarding --pf_output=/tmp/before.json
+  python -m benchmarks.port_forwarding --pf_daemon_flags=--nomultiplex_ports
+
+Scenarios:
+
+* small: many concurrent clients, each making short requests on fresh
+  connections (an API client or a page load).
+* large: a few connections transferring a lot of data.
+* idle: lots of open, idle connections (notebooks, HMR sockets).
+"""
+from concurrent import futures
+import dataclasses
+import json
+import multiprocessing
+from multiprocessing import connection
+import os
+import pathlib
+import resource
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+from absl import app
+from absl import flags
+import grpc
+
+from rx.client import history
+from rx.client.configuration import local
+from rx.daemon.port_forwarding import service
+from rx.proto import daemon_pb2
+from rx.proto import daemon_pb2_grpc
+from rx.testing import fake_worker
+
+_SCENARIOS = flags.DEFINE_list(
+  'pf_scenarios', ['small', 'large', 'idle'], 'Scenarios to run.')
+_CLIENTS = flags.DEFINE_integer(
+  'pf_clients', 50, 'Concurrent clients in the small scenario.')
+_REQUESTS = flags.DEFINE_integer(
+  'pf_requests', 20, 'Requests each small-scenario client makes.')
+_LARGE_BYTES = flags.DEFINE_integer(
+  'pf_large_bytes', 64 << 20, 'Bytes each large-scenario connection downloads.')
+_IDLE_CONNECTIONS = flags.DEFINE_integer(
+  'pf_idle_connections', 200, 'Connections held open in the idle scenario.')
+_IDLE_SECS = flags.DEFINE_float(
+  'pf_idle_secs', 5, 'How long the idle scenario holds connections open.')
+_DAEMON_FLAGS = flags.DEFINE_list(
+  'pf_daemon_flags', [], 'Flags to pass to the daemon process.')
+_OUTPUT = flags.DEFINE_string(
+  'pf_output', None, 'File to write JSON results to. Defaults to stdout.')
+
+# Each request starts with the number of request bytes that follow and the
+# number of response bytes wanted.
+_HEADER = struct.Struct('!II')
+_CHUNK = 64 * 1024
+
+
+@dataclasses.dataclass
+class Scenario:
+  name: str
+  clients: int
+  requests_per_client: int
+  request_bytes: int
+  response_bytes: int
+  # Make each request on a new connection.
+  reconnect: bool = True
+  # Connections to hold open (after one request each) for idle_secs.
+  idle_connections: int = 0
+  idle_secs: float = 0
+
+
+class PayloadServer:
+  """Answers each request with as many bytes as it asked for."""
+
+  def __init__(self) -> None:
+    self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self._sock.bind(('127.0.0.1', 0))
+    self._sock.listen(1024)
+    self.port: int = self._sock.getsockname()[1]
+    threading.Thread(target=self._accept_forever, daemon=True).start()
+
+  def close(self):
+    self._sock.close()
+
+  def _accept_forever(self):
+    while True:
+      try:
+        conn, _ = self._sock.accept()
+      except OSError:
+        return
+      threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+  def _serve(self, conn: socket.socket):
+    payload = b'x' * _CHUNK
+    with conn:
+      try:
+        while True:
+          header = _recv_exactly(conn, _HEADER.size)
+          if not header:
+            return
+          request_bytes, response_bytes = _HEADER.unpack(header)
+          _recv_exactly(conn, request_bytes)
+          while response_bytes:
+            n = min(response_bytes, _CHUNK)
+            conn.sendall(payload[:n])
+            response_bytes -= n
+      except OSError:
+        return
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+  chunks = []
+  while size:
+    buf = sock.recv(min(size, _CHUNK))
+    if not buf:
+      return b''
+    chunks.append(buf)
+    size -= len(buf)
+  return b''.join(chunks)
+
+
+class _Results:
+  """Collects measurements from every client thread."""
+
+  def __init__(self) -> None:
+    self.first_byte_secs: List[float] = []
+    self.bytes = 0
+    self.errors = 0
+    self._lock = threading.Lock()
+
+  def add(self, first_byte_secs: float, size: int):
+    with self._lock:
+      self.first_byte_secs.append(first_byte_secs)
+      self.bytes += size
+
+  def add_error(self):
+    with self._lock:
+      self.errors += 1
+
+
+def _request(
+    sock: socket.socket, scenario: Scenario, results: _Results):
+  """Makes one request and records how long the first byte took."""
+  start = time.perf_counter()
+  sock.sendall(
+    _HEADER.pack(scenario.request_bytes, scenario.response_bytes) +
+    b'r' * scenario.request_bytes)
+  remaining = scenario.response_bytes
+  first_byte = None
+  while remaining:
+    buf = sock.recv(min(remaining, _CHUNK))
+    if not buf:
+      raise ConnectionError('Connection closed mid-response')
+    if first_byte is None:
+      first_byte = time.perf_counter() - start
+    remaining -= len(buf)
+  results.add(
+    first_byte or 0, scenario.request_bytes + scenario.response_bytes)
+
+
+def _connect(port: int) -> socket.socket:
+  return socket.create_connection(('127.0.0.1', port))
+
+
+def _run_client(port: int, scenario: Scenario, results: _Results):
+  sock = None
+  try:
+    for _ in range(scenario.requests_per_client):
+      if sock is None:
+        sock = _connect(port)
+      _request(sock, scenario, results)
+      if scenario.reconnect:
+        sock.close()
+        sock = None
+  except OSError:
+    results.add_error()
+  finally:
+    if sock is not None:
+      sock.close()
+
+
+def _daemon_main(daemon_flags: List[str], conn: connection.Connection):
+  """Runs the port forwarding service, reporting usage when asked."""
+  flags.FLAGS(['rx-daemon'] + daemon_flags)
+  # Keep the forwarders' messages out of the results.
+  sys.stdout = open(os.devnull, 'wt', encoding='utf-8')
+  handler = service.PortForwardingService()
+  server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+  daemon_pb2_grpc.add_PortForwardingServiceServicer_to_server(handler, server)
+  port = server.add_insecure_port('127.0.0.1:0')
+  server.start()
+  conn.send(port)
+  while True:
+    cmd = conn.recv()
+    if cmd == 'usage':
+      conn.send(_usage())
+    else:
+      break
+  handler.close_ports()
+  server.stop(grace=None)
+
+
+def _usage() -> Dict[str, float]:
+  """Returns this process's CPU time and memory use."""
+  ru = resource.getrusage(resource.RUSAGE_SELF)
+  # ru_maxrss is in KiB on Linux and bytes on macOS.
+  peak_rss = ru.ru_maxrss if sys.platform == 'darwin' else ru.ru_maxrss * 1024
+  rss = peak_rss
+  try:
+    with open('/proc/self/statm', encoding='utf-8') as fh:
+      rss = int(fh.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+  except OSError:
+    pass
+  return {
+    'cpu_secs': ru.ru_utime + ru.ru_stime,
+    'rss_bytes': rss,
+    'peak_rss_bytes': peak_rss,
+  }
+
+
+class Daemon:
+  """A PortForwardingService running in a child process."""
+
+  def __init__(self, rxroot: pathlib.Path, daemon_flags: List[str]) -> None:
+    ctx = multiprocessing.get_context('spawn')
+    self._conn, child_conn = ctx.Pipe()
+    self._process = ctx.Process(
+      target=_daemon_main, args=(daemon_flags, child_conn),
+      daemon=True)
+    self._process.start()
+    port = self._conn.recv()
+    self._channel = grpc.insecure_channel(f'127.0.0.1:{port}')
+    self._stub = daemon_pb2_grpc.PortForwardingServiceStub(self._channel)
+    self._metadata = (('rxroot', str(rxroot)),)
+
+  def open_port(self, remote_port: int) -> int:
+    """Forwards remote_port to a free local port and returns it."""
+    with socket.socket() as s:
+      s.bind(('127.0.0.1', 0))
+      local_port = s.getsockname()[1]
+    resp = self._stub.OpenPort(
+      daemon_pb2.OpenPortRequest(port=remote_port, local_port=local_port),
+      metadata=self._metadata)
+    if resp.result.code != 0:
+      raise RuntimeError(f'Could not open port: {resp.result.message}')
+    return local_port
+
+  def close_port(self, local_port: int):
+    self._stub.ClosePort(
+      daemon_pb2.OpenPortRequest(port=local_port), metadata=self._metadata)
+
+  def usage(self) -> Dict[str, float]:
+    self._conn.send('usage')
+    return self._conn.recv()
+
+  def stop(self):
+    self._channel.close()
+    self._conn.send('stop')
+    self._process.join(timeout=10)
+    if self._process.is_alive():
+      self._process.kill()
+
+
+def run_scenario(
+    daemon: Daemon, remote_port: int, scenario: Scenario) -> Dict[str, Any]:
+  """Runs a scenario on a freshly opened port and returns its results."""
+  port = daemon.open_port(remote_port)
+  results = _Results()
+  before = daemon.usage()
+  start = time.perf_counter()
+  threads = [
+    threading.Thread(target=_run_client, args=(port, scenario, results))
+    for _ in range(scenario.clients)
+  ]
+  for th in threads:
+    th.start()
+  for th in threads:
+    th.join()
+
+  idle = []
+  for _ in range(scenario.idle_connections):
+    try:
+      sock = _connect(port)
+      idle.append(sock)
+      _request(sock, scenario, results)
+    except OSError:
+      results.add_error()
+  elapsed = time.perf_counter() - start
+
+  idle_cpu = 0.0
+  if idle:
+    idle_start = daemon.usage()
+    time.sleep(scenario.idle_secs)
+    idle_cpu = daemon.usage()['cpu_secs'] - idle_start['cpu_secs']
+  after = daemon.usage()
+  for sock in idle:
+    sock.close()
+  daemon.close_port(port)
+
+  latencies = results.first_byte_secs
+  return {
+    'clients': scenario.clients,
+    'requests': len(latencies),
+    'errors': results.errors,
+    'bytes': results.bytes,
+    'seconds': elapsed,
+    'throughput_bytes_per_sec': results.bytes / elapsed if elapsed else 0,
+    'first_byte_p50_ms': history.percentile(latencies, 50) * 1000,
+    'first_byte_p99_ms': history.percentile(latencies, 99) * 1000,
+    'daemon_cpu_secs': after['cpu_secs'] - before['cpu_secs'],
+    'daemon_idle_cpu_secs': idle_cpu,
+    'daemon_rss_bytes': after['rss_bytes'],
+    'daemon_peak_rss_bytes': after['peak_rss_bytes'],
+  }
+
+
+def get_scenarios() -> Dict[str, Scenario]:
+  return {
+    'small': Scenario(
+      'small', clients=_CLIENTS.value, requests_per_client=_REQUESTS.value,
+      request_bytes=512, response_bytes=4096),
+    'large': Scenario(
+      'large', clients=4, requests_per_client=1, request_bytes=64,
+      response_bytes=_LARGE_BYTES.value),
+    'idle': Scenario(
+      'idle', clients=0, requests_per_client=0, request_bytes=64,
+      response_bytes=64, idle_connections=_IDLE_CONNECTIONS.value,
+      idle_secs=_IDLE_SECS.value),
+  }
+
+
+def run(
+    scenarios: Sequence[Scenario],
+    daemon_flags: Optional[List[str]] = None) -> Dict[str, Any]:
+  """Sets up a fake worker and daemon and runs scenarios against them."""
+  payload = PayloadServer()
+  servicer = fake_worker.FakeExecutionService()
+  server, addr = fake_worker.start_server(servicer)
+  with tempfile.TemporaryDirectory() as tmpdir:
+    rxroot = pathlib.Path(tmpdir)
+    fake_worker.setup_rxroot(rxroot, addr)
+    daemon = Daemon(rxroot, daemon_flags or [])
+    try:
+      results = {
+        s.name: run_scenario(daemon, payload.port, s) for s in scenarios}
+    finally:
+      daemon.stop()
+      server.stop(grace=None)
+      payload.close()
+  return {
+    'version': local.VERSION,
+    'daemon_flags': daemon_flags or [],
+    'scenarios': results,
+  }
+
+
+def main(argv: Sequence[str]):
+  del argv
+  available = get_scenarios()
+  unknown = set(_SCENARIOS.value) - set(available)
+  if unknown:
+    raise app.UsageError(f'Unknown scenarios: {", ".join(sorted(unknown))}')
+  results = run(
+    [available[name] for name in _SCENARIOS.value], _DAEMON_FLAGS.value)
+  output = json.dumps(results, indent=2, sort_keys=True)
+  if _OUTPUT.value:
+    with open(_OUTPUT.value, 'wt', encoding='utf-8') as fh:
+      fh.write(output + '\n')
+  else:
+    print(output)
+
+
+if __name__ == '__main__':
+  app.run(main)
@@ -0,0 +1,47 @@
+import shutil
+import unittest
+
+from absl import flags
+from absl.testing import absltest
+
+from benchmarks import end_to_end
+
+FLAGS = flags.FLAGS
+
+
+class EndToEndBenchmarkTests(unittest.TestCase):
+
+  def setUp(self) -> None:
+    super().setUp()
+    if not FLAGS.is_parsed():
+      FLAGS.mark_as_parsed()
+    self._commands = end_to_end.get_commands(
+      chatty_lines=10, large_stdout_bytes=100000)
+
+  def test_runs_each_command(self):
+    results = end_to_end.run(
+      [10], list(self._commands.values()), runs=2, sync=False)
+
+    repo = results['repos']['10']
+    self.assertEqual(
+      set(repo['commands']), {'trivial', 'chatty', 'large_stdout'})
+    self.assertGreater(repo['cold']['wall_secs'], 0)
+    chatty = repo['commands']['chatty']
+    self.assertEqual(chatty['runs'], 2)
+    self.assertGreater(chatty['first_byte_secs_p50'], 0)
+    self.assertNotIn('first_byte_secs_p50', repo['commands']['trivial'])
+    self.assertEqual(
+      repo['commands']['large_stdout']['stdout_bytes'], 100000)
+
+  @unittest.skipUnless(shutil.which('rsync'), 'rsync is not installed')
+  def test_syncs_with_rsync_daemon(self):
+    results = end_to_end.run(
+      [10], [self._commands['trivial']], runs=1, sync=True)
+
+    repo = results['repos']['10']
+    self.assertGreater(repo['cold']['sync_secs'], 0)
+    self.assertGreater(repo['commands']['trivial']['sync_secs_p50'], 0)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,66 @@
+import pathlib
+import tempfile
+import unittest
+from unittest import mock
+
+from absl import flags
+from absl.testing import absltest
+
+from benchmarks import microbenchmarks
+
+FLAGS = flags.FLAGS
+
+
+class MicrobenchmarkTests(unittest.TestCase):
+
+  def setUp(self) -> None:
+    super().setUp()
+    if not FLAGS.is_parsed():
+      FLAGS.mark_as_parsed()
+
+  def test_runs_every_benchmark(self):
+    # Shrink everything so this is quick.
+    with mock.patch.multiple(
+        microbenchmarks, MANIFEST_FILES=1000, MANIFEST_LOOKUPS=10,
+        PROGRESS_LAYERS=3, PROGRESS_UPDATES=2, STDIN_LINES=10,
+        FORWARD_BYTES=1 << 16):
+      results = microbenchmarks.run(
+        microbenchmarks.names(), min_secs=0.001, repeat=1)
+
+    self.assertEqual(set(results), set(microbenchmarks.names()))
+    for name, result in results.items():
+      self.assertGreater(result['secs_per_op'], 0, name)
+    self.assertGreater(
+      results['connection_forwarding']['bytes_per_sec'], 0)
+
+  def test_every_benchmark_has_a_baseline(self):
+    self.assertEqual(
+      set(microbenchmarks.load_baselines()), set(microbenchmarks.names()))
+
+  def test_compare(self):
+    results = {
+      'fast': {'secs_per_op': 1.0},
+      'slow': {'secs_per_op': 2.0},
+      'new': {'secs_per_op': 1.0},
+    }
+
+    got = microbenchmarks.compare(
+      results, {'fast': 1.0, 'slow': 1.0}, tolerance=0.25)
+
+    self.assertEqual(len(got), 1)
+    self.assertTrue(got[0].startswith('slow: 2.00x'))
+    self.assertEqual(results['fast']['ratio_to_baseline'], 1.0)
+    self.assertNotIn('ratio_to_baseline', results['new'])
+
+  def test_write_baselines_keeps_others(self):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      path = pathlib.Path(tmpdir) / 'baselines.json'
+      microbenchmarks.write_baselines({'a': {'secs_per_op': 1.0}}, path)
+      microbenchmarks.write_baselines({'b': {'secs_per_op': 2.0}}, path)
+
+      self.assertEqual(
+        microbenchmarks.load_baselines(path), {'a': 1.0, 'b': 2.0})
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,44 @@
+import unittest
+
+from absl import flags
+from absl.testing import absltest
+
+from benchmarks import port_forwarding
+
+FLAGS = flags.FLAGS
+
+
+class PortForwardingBenchmarkTests(unittest.TestCase):
+
+  def setUp(self) -> None:
+    super().setUp()
+    if not FLAGS.is_parsed():
+      FLAGS.mark_as_parsed()
+
+  def test_runs_each_kind_of_scenario(self):
+    scenarios = [
+      port_forwarding.Scenario(
+        'small', clients=3, requests_per_client=2, request_bytes=16,
+        response_bytes=1024),
+      port_forwarding.Scenario(
+        'large', clients=1, requests_per_client=1, request_bytes=16,
+        response_bytes=1 << 20),
+      port_forwarding.Scenario(
+        'idle', clients=0, requests_per_client=0, request_bytes=16,
+        response_bytes=16, idle_connections=3, idle_secs=0.1),
+    ]
+
+    results = port_forwarding.run(scenarios)
+
+    self.assertEqual(set(results['scenarios']), {'small', 'large', 'idle'})
+    small = results['scenarios']['small']
+    self.assertEqual(small['errors'], 0)
+    self.assertEqual(small['requests'], 6)
+    self.assertGreater(small['first_byte_p99_ms'], 0)
+    self.assertEqual(results['scenarios']['large']['bytes'], (1 << 20) + 16)
+    self.assertEqual(results['scenarios']['idle']['requests'], 3)
+    self.assertGreater(results['scenarios']['idle']['daemon_rss_bytes'], 0)
+
+
+if __name__ == '__main__':
+  absltest.main()
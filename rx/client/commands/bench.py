@@ -0,0 +1,160 @@
+import argparse
+import json
+import sys
+import time
+from typing import Any, Dict, List, Sequence
+
+from rx.client import grpc_helper
+from rx.client import history
+from rx.client import worker_client
+from rx.client.commands import command
+from rx.client.commands import stats
+
+# min, median, tail and max.
+_PERCENTILES = (0, 50, 90, 95, 99, 100)
+_LABELS = {0: 'min', 100: 'max'}
+# Whether to upload sources before each run.
+_ALWAYS = 'always'
+_ONCE = 'once'
+_NEVER = 'never'
+
+
+class BenchCommand(command.Command):
+  """Runs a command repeatedly and reports how long each phase took."""
+
+  def __init__(self, cmdline: command.CommandLine):
+    super().__init__(cmdline)
+    self._argv = cmdline.ns.argv + cmdline.remainder
+    if self._argv and self._argv[0] == '--':
+      self._argv = self._argv[1:]
+
+  def _run(self) -> int:
+    ns = self._cmdline.ns
+    if not self._argv:
+      print('No command given.')
+      return 1
+    if ns.runs < 1 or ns.cold < 0:
+      print('--runs must be at least 1 and --cold can\'t be negative.')
+      return 1
+
+    runs: List[history.Run] = []
+    with grpc_helper.get_channel(self.remote_config.worker_addr) as ch:
+      client = worker_client.create_authed_client(ch, self.local_config)
+      for i in range(ns.runs):
+        try:
+          run = self._run_once(client, sync=_should_sync(ns.sync, i))
+        except worker_client.WorkerError as e:
+          print(e, file=sys.stderr)
+          return e.code
+        runs.append(run)
+        print(
+          f'Run {i + 1}/{ns.runs}: {stats.format_secs(run.total_secs)} '
+          f'(exit {run.exit_code})', file=sys.stderr, flush=True)
+        if run.exit_code == worker_client.SIGINT_CODE:
+          # Report what we have so far.
+          break
+
+    cold, warm = runs[:ns.cold], runs[ns.cold:]
+    print(format_results(self._argv, cold, warm))
+    if ns.json:
+      with open(ns.json, mode='wt', encoding='utf-8') as fh:
+        json.dump(to_dict(self._argv, cold, warm), fh, indent=2)
+    return 0
+
+  def _run_once(
+      self,
+      client: worker_client.Client,
+      sync: bool) -> history.Run:
+    start = time.monotonic()
+    code = client.exec(list(self._argv), sync=sync)
+    run = client.last_run
+    assert run
+    run.exit_code = code
+    run.total_secs = time.monotonic() - start
+    return run
+
+
+def _should_sync(mode: str, i: int) -> bool:
+  """Whether run i syncs, even if the workspace's config turns sync off."""
+  if mode == _NEVER:
+    return False
+  if mode == _ONCE and i > 0:
+    return False
+  return True
+
+
+def summarize(runs: Sequence[history.Run]) -> Dict[str, Dict[str, float]]:
+  """Returns {phase: {'p50': secs, ...}}, with min and max for p0/p100."""
+  return {
+    phase: {_LABELS.get(p, f'p{p}'): secs for p, secs in pcts.items()}
+    for phase, pcts in history.summarize(runs, _PERCENTILES).items()
+  }
+
+
+def to_dict(
+    argv: List[str],
+    cold: Sequence[history.Run],
+    warm: Sequence[history.Run]) -> Dict[str, Any]:
+  def _run_dict(r: history.Run) -> Dict[str, Any]:
+    d: Dict[str, Any] = {
+      f'{phase}_secs': r.phase_secs(phase) for phase in history.PHASES}
+    d.update(exit_code=r.exit_code, bytes_synced=r.bytes_synced)
+    return d
+
+  return {
+    'argv': argv,
+    'cold': {
+      'summary': summarize(cold), 'runs': [_run_dict(r) for r in cold]},
+    'warm': {
+      'summary': summarize(warm), 'runs': [_run_dict(r) for r in warm]},
+  }
+
+
+def format_results(
+    argv: List[str],
+    cold: Sequence[history.Run],
+    warm: Sequence[history.Run]) -> str:
+  """Formats a table per group of runs, one row per phase."""
+  lines = [f'`{" ".join(argv)}`', '']
+  for name, runs in (('Cold', cold), ('Warm', warm)):
+    if not runs:
+      continue
+    failed = sum(1 for r in runs if r.exit_code)
+    failures = f', {failed} failed' if failed else ''
+    lines.append(f'{name}: {len(runs)} runs{failures}')
+    summary = summarize(runs)
+    columns = list(summary['total'])
+    lines.append(f'  {"phase":<8}' + ''.join(f'{c:>10}' for c in columns))
+    for phase, values in summary.items():
+      lines.append(
+        f'  {phase:<8}' +
+        ''.join(f'{stats.format_secs(values[c]):>10}' for c in columns))
+    synced = sorted(r.bytes_synced for r in runs)
+    lines.append(
+      f'  Uploaded {synced[len(synced) // 2]} bytes per run (median)')
+    lines.append('')
+  return '\n'.join(lines).rstrip()
+
+
+def add_parser(subparsers: argparse._SubParsersAction):
+  bench_cmd = subparsers.add_parser(
+    'bench',
+    help='Runs a command several times and shows how long each phase took, '
+    'e.g., rx bench -n 20 -- pytest -q')
+  bench_cmd.add_argument(
+    '-n', '--runs', default=10, type=int,
+    help='How many times to run the command')
+  bench_cmd.add_argument(
+    '--cold', default=1, type=int,
+    help='How many of the first runs to report separately as "cold" (e.g., '
+    'the first sync after a change)')
+  bench_cmd.add_argument(
+    '--sync', default=_ALWAYS, choices=(_ALWAYS, _ONCE, _NEVER),
+    help='When to upload sources: before every run (like rx does), only '
+    'before the first or never, to leave sync out of warm runs')
+  bench_cmd.add_argument(
+    '--json', help='Also write every run and the summary to this JSON file')
+  # Everything after the first positional arg is the command, so its flags
+  # aren't mistaken for bench's.
+  bench_cmd.add_argument('argv', nargs=argparse.REMAINDER)
+  bench_cmd.set_defaults(cmd=BenchCommand)
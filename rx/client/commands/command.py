@@ -8,6 +8,7 @@ from rx.client import trex_client
 from rx.client.configuration import config_base
 from rx.client.configuration import local
 from rx.client.configuration import remote
+from rx.shared import trace
 
 
 @dataclasses.dataclass(frozen=True)
@@ -30,7 +31,8 @@ class Command:
     if not self._rxroot:
       raise config_base.ConfigNotFoundError(
         pathlib.Path('.'), 'Run `rx init` first!')
-    config = local.find_local_config(self._rxroot)
+    with trace.span('load_config'):
+      config = local.find_local_config(self._rxroot)
     if not config:
       raise config_base.ConfigNotFoundError(
         self._rxroot, 'Run `rx init` first!')
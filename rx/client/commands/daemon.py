@@ -9,6 +9,8 @@ from rx.client.commands import command
 from rx.daemon import client
 from rx.daemon import manager
 from rx.daemon import pidfile
+from rx.proto import daemon_pb2
+from rx.shared import metrics
 
 
 class DaemonCommand(command.Command):
@@ -16,7 +18,7 @@ class DaemonCommand(command.Command):
 
   def __init__(self, cmdline: command.CommandLine) -> None:
     super().__init__(cmdline)
-    self._pidfile = pidfile.PidFile(self.local_config.cwd)
+    self._pidfile = pidfile.PidFile()
     self._manager = manager.DaemonManager(self.local_config)
 
 
@@ -45,8 +47,9 @@ class StopCommand(DaemonCommand):
         print(f'Could not find process {pid}, attempting to connect to the '
               'daemon.')
     except pidfile.NotFoundError:
-      nice_path = self._pidfile.filename.relative_to(self.local_config.cwd)
-      print(f'Could not find {nice_path}, is the daemon still running?')
+      print(
+        f'Could not find {self._pidfile.filename}, is the daemon still '
+        'running?')
 
     # If that didn't work/we didn't have the pid, kill via sending a request
     # and getting its pid that way.
@@ -60,7 +63,7 @@ class StopCommand(DaemonCommand):
       if not done:
         print(
           'Couldn\'t connect to the daemon, maybe a different process is '
-          f'running at {self._manager.daemon_addr}.')
+          f'running at {self._manager.tcp_addr}.')
         return -1
     return 0
 
@@ -99,6 +102,27 @@ class InfoCommand(DaemonCommand):
       print('Daemon is not running. Run `rx daemon start` to start it.')
     else:
       print(f'Daemon is running with pid {self._pidfile.pid}')
+      with self._manager.get_daemon_client() as cli:
+        try:
+          print(format_stats(cli.get_ports()))
+        except client.DaemonUnavailable as e:
+          print(f'Could not get stats from the daemon: {e}')
+    return 0
+
+
+class MetricsCommand(DaemonCommand):
+  """Prints the daemon's metrics as JSON."""
+
+  def _run(self) -> int:
+    if not self._pidfile.is_running():
+      print('Daemon is not running. Run `rx daemon start` to start it.')
+      return -1
+    with self._manager.get_daemon_client() as cli:
+      try:
+        print(metrics.to_json(cli.get_metrics()))
+      except client.DaemonUnavailable as e:
+        print(f'Could not get metrics from the daemon: {e}')
+        return -1
     return 0
 
 
@@ -116,6 +140,48 @@ def format_info(info: Dict[int, int]) -> str:
     return 'No open ports.'
 
 
+def format_stats(resp: daemon_pb2.GetPortsResponse) -> str:
+  """Formats how much data the daemon is holding on to."""
+  buf = resp.buffers
+  lines = [
+    f'Buffered: {format_bytes(buf.buffered_bytes)} of '
+    f'{format_bytes(buf.limit_bytes)} '
+    f'(peak {format_bytes(buf.high_water_bytes)})'
+  ]
+  lines.append(f'Workspaces: {resp.workspaces}')
+  conns = resp.connections
+  lines.append(
+    f'Connections: {conns.active} of {conns.limit} '
+    f'(limit reached {conns.saturated} times)')
+  if any(p.http_cache for p in resp.ports):
+    lines.append(
+      f'HTTP cache: {format_bytes(buf.http_cache_bytes)} of '
+      f'{format_bytes(buf.http_cache_limit_bytes)}')
+  for p in resp.ports:
+    local_port = p.local_port if p.local_port else p.port
+    lines.append(
+      f'  localhost:{local_port}: {p.stats.active_connections} connections, '
+      f'{p.stats.queued_frames} frames '
+      f'({format_bytes(p.stats.queued_bytes)}) queued, '
+      f'peak {format_bytes(p.stats.high_water_bytes)}')
+    if p.http_cache:
+      lines.append(
+        f'    {p.stats.cache_hits} cache hits, '
+        f'{p.stats.cache_revalidations} revalidated, '
+        f'{p.stats.cache_misses} misses')
+  return '\n'.join(lines)
+
+
+def format_bytes(size: float) -> str:
+  if size < 1024:
+    return f'{size} B'
+  for unit in ('KiB', 'MiB', 'GiB'):
+    size /= 1024
+    if size < 1024:
+      break
+  return f'{size:.1f} {unit}'
+
+
 def add_parser(subparsers: argparse._SubParsersAction):
   daemon_cmd = subparsers.add_parser(
     'daemon', help='Daemon management commands')
@@ -124,7 +190,8 @@ def add_parser(subparsers: argparse._SubParsersAction):
   start_cmd = subparsers.add_parser('start', help='Starts the daemon')
   start_cmd.set_defaults(cmd=StartCommand)
 
-  stop_cmd = subparsers.add_parser('stop', help='Stops the daemon')
+  stop_cmd = subparsers.add_parser(
+    'stop', help='Stops the daemon (for every rxroot)')
   stop_cmd.set_defaults(cmd=StopCommand)
 
   status_cmd = subparsers.add_parser('info', help='Gets info about the daemon')
@@ -132,3 +199,7 @@ def add_parser(subparsers: argparse._SubParsersAction):
 
   status_cmd = subparsers.add_parser('restart', help='Restarts the daemon')
   status_cmd.set_defaults(cmd=RestartCommand)
+
+  metrics_cmd = subparsers.add_parser(
+    'metrics', help='Prints the daemon\'s metrics as JSON')
+  metrics_cmd.set_defaults(cmd=MetricsCommand)
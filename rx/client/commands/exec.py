@@ -19,18 +19,32 @@ import tempfile
 from typing import List, Optional
 
 from absl import app
+from absl import flags
 from absl import logging
 from absl.flags import argparse_flags
 
 from rx.client import worker_client
+from rx.client.commands import bench
 from rx.client.commands import command
 from rx.client.commands import daemon
 from rx.client.commands import init
 from rx.client.commands import runner
+from rx.client.commands import stats
 from rx.client.commands import stop
 from rx.client.commands import subscribe
 from rx.client.commands import ws
 from rx.client.configuration import local
+from rx.shared import metrics
+from rx.shared import trace
+
+_METRICS_OUT = flags.DEFINE_string(
+  'metrics_out', None,
+  'Write the metrics this command recorded (e.g., rsync and exec times) to '
+  'this JSON file.')
+_TRACE = flags.DEFINE_string(
+  'trace', None,
+  'Write a timeline of this command (flag parsing, rsync, exec, etc.) to this '
+  'file, in Chrome\'s trace format. Open it with https://ui.perfetto.dev.')
 
 
 class HelpCommand(command.Command):
@@ -60,9 +74,11 @@ def get_subcommand_parser(
     .add_parser('help', help='Show help message for a given command')
     .set_defaults(cmd=help_cmd)
   )
+  bench.add_parser(subparsers)
   daemon.add_parser(subparsers)
   init.add_parser(subparsers)
   runner.add_parser(subparsers)
+  stats.add_parser(subparsers)
   stop.add_parser(subparsers)
   subscribe.add_parsers(subparsers)
   ws.add_parser(subparsers)
@@ -83,13 +99,21 @@ def main(cmdline: command.CommandLine):
 
   try:
     cmd: command.Command = cmdline.ns.cmd(cmdline)
-    cmd.run()
+    with trace.span('run'):
+      cmd.run()
   except KeyboardInterrupt:
     return worker_client.SIGINT_CODE
+  finally:
+    if _METRICS_OUT.value:
+      metrics.write_json(_METRICS_OUT.value)
+    if _TRACE.value:
+      trace.instant('exit')
+      trace.write(_TRACE.value)
 
 
 def parse_flags_with_usage(argv) -> command.CommandLine:
   """The output of this is passed to main."""
+  start = trace.now_us()
   parser = argparse_flags.ArgumentParser(
     description=(
       'rx is a cli interface for seamless hybrid development. Develop locally, '
@@ -111,6 +135,10 @@ def parse_flags_with_usage(argv) -> command.CommandLine:
     to_parse = ['run'] + to_parse
 
   ns, remainder = parser.parse_known_args(to_parse)
+  # Tracing can't start until we know whether it's on.
+  if _TRACE.value:
+    trace.enable()
+    trace.add_span('parse_flags', start, trace.now_us())
   return command.CommandLine(
     ns=ns,
     remainder=remainder,
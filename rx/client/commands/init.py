@@ -3,6 +3,7 @@ from distutils import util
 import pathlib
 import re
 import sys
+from typing import List, Optional
 
 from absl import logging
 
@@ -13,8 +14,11 @@ from rx.client import trex_client
 from rx.client.commands import command
 from rx.client.configuration import config_base
 from rx.client.configuration import local
+from rx.daemon import client as daemon_client
+from rx.daemon import deps
 from rx.daemon import manager
 from rx.proto import rx_pb2
+from rx.trex.toolchain import lang_detector
 from rx.trex.toolchain import local_fs
 from rx.trex.toolchain import toolchain
 
@@ -93,9 +97,22 @@ Press y to continue:""", 'y')
       return -1
 
     if is_dry_run:
-      local_fs.dry_run(config)
+      scan = local_fs.scan(config)
+      local_fs.dry_run(config, scan.paths)
+      print(f'\nTotal: {scan.summary()}')
+      tools = lang_detector.detect(scan.get_manifest(), self._rxroot)
+      if tools:
+        print('\nDetected:')
+        for t in tools:
+          print(f'  {t.name} ({t.why})')
       return 0
 
+    # The daemon installs dependencies in the background, so init doesn't have
+    # to wait for them. It's only started once the sources are uploaded, so
+    # declining init doesn't leave one running. It only serves installs on its
+    # Unix socket, so install them here if there can't be one.
+    background_deps = (
+      config.should_sync and local.get_daemon_unix_addr() is not None)
     try:
       with grpc_helper.get_channel(config_base.TREX_HOST.value) as ch:
         client = trex_client.Client(ch, config, auth_metadata=None)
@@ -108,6 +125,8 @@ Press y to continue:""", 'y')
             return 0
           source = {}
           source_type = 'rsync'
+          scan = self._scan(config)
+          tools = self._detect_toolchain(scan)
         else:
           # TODO: also support --workspace.
           source = {
@@ -115,9 +134,15 @@ Press y to continue:""", 'y')
             'commit': self._cmdline.ns.commit,
           }
           source_type = 'git'
+          scan = None
+          tools = []
         if not menu._QUIET.value:
           print('Great! Let\'s get down to business.')
-        workspace_id = client.init(source_type=source_type, source=source)
+          if scan:
+            print(f'Uploading {scan.summary()}.')
+        workspace_id = client.init(
+          source_type=source_type, source=source, toolchain=tools,
+          install_deps=not background_deps, scan=scan)
         environment = client.get_info(workspace_id).environment
     except trex_client.TrexError as e:
       sys.stderr.write(f'{e}\n')
@@ -126,6 +151,18 @@ Press y to continue:""", 'y')
 
     toolchain.Toolchain(config).save_config(environment)
     self._open_ports(environment)
+    if config.should_sync:
+      if background_deps and self._watch_deps(config, install=True):
+        print(
+          'Installing dependencies in the background (see '
+          f'{deps.get_log_file(config.cwd)}). `rx <cmd>` waits for them to '
+          'finish, unless run with --no-wait-deps.')
+      elif background_deps:
+        sys.stderr.write(
+          'Could not install dependencies in the background, run `rx init` '
+          'again to install them.\n')
+      else:
+        self._watch_deps(config)
     print('\nDone setting up rx! To use, run:\n\n\t$ rx <your command>\n')
     return 0
 
@@ -141,6 +178,48 @@ Press y to continue:""", 'y')
         print(f'\t* Forwarding {p}')
         cli.open_port(p)
 
+  def _watch_deps(
+      self, config: local.LocalConfig, install: bool = False) -> bool:
+    """Has the daemon reinstall dependencies when their files change.
+
+    If install is set, it starts installing them now. Returns if the daemon
+    is watching them.
+    """
+    daemon_mgr = manager.DaemonManager(config)
+    if not daemon_mgr.maybe_start_daemon() or not daemon_mgr.serves_deps:
+      return False
+    try:
+      with daemon_mgr.get_daemon_client() as cli:
+        cli.watch_deps(install=install)
+    except (daemon_client.DaemonUnavailable, daemon_client.RetryError) as e:
+      logging.warning('Could not watch dependencies for changes: %s', e)
+      return False
+    return True
+
+  def _scan(self, config: local.LocalConfig) -> Optional[local_fs.Scan]:
+    """Lists what will be uploaded, once for everything init does with it.
+
+    It's saved so the daemon can start watching from it, too.
+    """
+    try:
+      scan = local_fs.scan(config)
+    except local_fs.ManifestError as e:
+      logging.warning('Could not list files to upload: %s', e)
+      return None
+    try:
+      local_fs.save_scan(self._rxroot, scan)
+    except OSError as e:
+      logging.warning('Could not save the list of files: %s', e)
+    return scan
+
+  def _detect_toolchain(
+      self, scan: Optional[local_fs.Scan]) -> List[rx_pb2.Tool]:
+    """Returns the languages the project uses, for choosing an image."""
+    if scan is None:
+      return []
+    return lang_detector.to_toolchain(
+      lang_detector.detect(scan.get_manifest(), self._rxroot))
+
   def _should_call_init(self) -> bool:
     """Checks if the user actually wants to upload"""
     if not self._cmdline.ns.sync:
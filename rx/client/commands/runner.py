@@ -1,24 +1,87 @@
 import argparse
+import pathlib
+import sys
+import threading
+import time
+from typing import Optional
 
 from absl import logging
+import grpc
 
+from rx.client import history
 from rx.client import trex_client
 from rx.client import worker_client
 from rx.client import grpc_helper
 from rx.client.commands import command
 from rx.client.configuration import config_base
+from rx.daemon import client as daemon_client
+from rx.daemon import manager
+from rx.daemon import pidfile
+from rx.proto import daemon_pb2
+from rx.shared import trace
+
+_CONNECT_TIMEOUT_SECS = 10
+# How often the install log is checked for new output while waiting.
+_TAIL_SECS = 0.2
 
 
 class RunCommand(command.Command):
 
   def __init__(self, cmdline: command.CommandLine):
     super().__init__(cmdline)
-    self._argv = cmdline.remainder
+    self._argv = cmdline.ns.argv + cmdline.remainder
 
   def _run(self) -> int:
+    start = time.monotonic()
+    self._wait_for_deps()
     with grpc_helper.get_channel(self.remote_config.worker_addr) as ch:
+      if trace.enabled():
+        _connect(ch)
       client = worker_client.create_authed_client(ch, self.local_config)
-      return self._try_exec(client)
+      code = self._try_exec(client)
+    if client.last_run:
+      client.last_run.exit_code = code
+      client.last_run.total_secs = time.monotonic() - start
+      history.record(self.local_config.cwd, client.last_run)
+    return code
+
+  def _wait_for_deps(self):
+    """Waits for the daemon to finish installing dependencies.
+
+    The install's output is shown while waiting. This is skipped with
+    --no-wait-deps, or if the daemon isn't running (or only over TCP), since
+    nothing is installing the dependencies then.
+    """
+    if not getattr(self._cmdline.ns, 'wait_deps', True):
+      return
+    if not self.local_config.should_sync or not pidfile.PidFile().is_running():
+      return
+    mgr = manager.DaemonManager(self.local_config)
+    if not mgr.serves_deps:
+      return
+    tail: Optional[_LogTail] = None
+    def on_wait(status: daemon_pb2.DepsStatus):
+      nonlocal tail
+      print(
+        'Waiting for dependencies to finish installing (see '
+        f'{status.log_file}, or use --no-wait-deps to skip waiting)...',
+        file=sys.stderr, flush=True)
+      tail = _LogTail(pathlib.Path(status.log_file))
+      tail.start()
+    try:
+      with trace.span('wait_for_deps'):
+        with mgr.get_daemon_client() as cli:
+          status = cli.wait_for_deps(on_wait)
+    except (daemon_client.DaemonUnavailable, daemon_client.RetryError) as e:
+      logging.info('Could not check on dependencies: %s', e)
+      return
+    finally:
+      if tail:
+        tail.stop()
+    if status.state == daemon_pb2.DepsStatus.FAILED:
+      print(
+        f'Installing dependencies failed: {status.result.message} (see '
+        f'{status.log_file})', file=sys.stderr, flush=True)
 
   def _try_exec(self, client: worker_client.Client) -> int:
     """Sends the command to the server."""
@@ -71,9 +134,62 @@ class RunCommand(command.Command):
     return result.code
 
 
+class _LogTail:
+  """Copies whatever is appended to a file to stderr, until stopped."""
+
+  def __init__(self, path: pathlib.Path) -> None:
+    self._path = path
+    try:
+      self._offset = path.stat().st_size
+    except OSError:
+      self._offset = 0
+    self._stopped = threading.Event()
+    self._thread = threading.Thread(target=self._run, daemon=True)
+
+  def start(self):
+    self._thread.start()
+
+  def stop(self):
+    """Stops once everything written so far has been copied."""
+    self._stopped.set()
+    self._thread.join()
+
+  def _run(self):
+    try:
+      with self._path.open(mode='rb') as fh:
+        fh.seek(self._offset)
+        while True:
+          stopped = self._stopped.wait(_TAIL_SECS)
+          buf = fh.read()
+          if buf:
+            sys.stderr.write(buf.decode('utf-8', 'replace'))
+            sys.stderr.flush()
+          if stopped:
+            return
+    except OSError as e:
+      logging.info('Could not show %s: %s', self._path, e)
+
+
+def _connect(ch: grpc.Channel):
+  """Connects up front, so the trace shows how long connecting takes.
+
+  Otherwise gRPC connects lazily and it's hidden in the first RPC.
+  """
+  with trace.span('connect'):
+    try:
+      grpc.channel_ready_future(ch).result(timeout=_CONNECT_TIMEOUT_SECS)
+    except grpc.FutureTimeoutError:
+      # Let exec report the error, same as without tracing.
+      pass
+
+
 def add_parser(subparsers: argparse._SubParsersAction):
-  (
-    subparsers
-    .add_parser('run', help='Runs a command')
-    .set_defaults(cmd=RunCommand)
-  )
+  run_cmd = subparsers.add_parser('run', help='Runs a command')
+  run_cmd.add_argument(
+    '--no-wait-deps', default=True, dest='wait_deps', action='store_false',
+    help='Runs the command without waiting for dependencies to finish '
+    'installing')
+  # Everything after the first positional arg is the command, so its flags
+  # (or prefixes of rx's, like --no-w) aren't mistaken for rx's.
+  run_cmd.add_argument('argv', nargs=argparse.REMAINDER)
+  run_cmd.set_defaults(cmd=RunCommand)
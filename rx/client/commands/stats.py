@@ -0,0 +1,131 @@
+import argparse
+import datetime
+import json
+import re
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from rx.client import history
+from rx.client.commands import command
+
+_UNIT_SECS = {'m': 60, 'h': 60 * 60, 'd': 24 * 60 * 60, 'w': 7 * 24 * 60 * 60}
+_PERCENTILES = (50, 95, 99)
+
+# A time window, e.g., ('7d', 604800). None means every run.
+_Window = Tuple[str, Optional[float]]
+
+
+class StatsCommand(command.Command):
+  """Shows how long each phase of recent commands took."""
+
+  def _run(self) -> int:
+    ns = self._cmdline.ns
+    path = history.get_history_file(self.local_config.cwd)
+    if not path.exists():
+      print('No commands have been run in this workspace yet.')
+      return 0
+    now = time.time()
+    with history.History(path) as hist:
+      runs = hist.runs()
+    windows = [
+      (name, [r for r in runs if secs is None or r.start >= now - secs])
+      for name, secs in ns.windows
+    ]
+    if ns.json:
+      print(json.dumps(to_dict(windows, ns.slowest), indent=2))
+    else:
+      print(format_stats(windows, ns.slowest))
+    return 0
+
+
+def to_dict(
+    windows: Sequence[Tuple[str, List[history.Run]]],
+    n_slowest: int) -> Dict[str, Any]:
+  result = {}
+  for name, runs in windows:
+    result[name] = {
+      'runs': len(runs),
+      'phases': {
+        phase: {f'p{p}': secs for p, secs in pcts.items()}
+        for phase, pcts in history.summarize(runs, _PERCENTILES).items()
+      },
+      'slowest': [
+        {'argv': r.argv, 'start': r.start, 'total_secs': r.total_secs,
+         'exit_code': r.exit_code, 'version': r.version}
+        for r in history.slowest(runs, n_slowest)
+      ],
+    }
+  return result
+
+
+def format_stats(
+    windows: Sequence[Tuple[str, List[history.Run]]], n_slowest: int) -> str:
+  """Formats a table of percentiles per phase for each window."""
+  lines = []
+  for name, runs in windows:
+    label = 'All time' if name == 'all' else f'Last {name}'
+    lines.append(f'{label}: {len(runs)} runs')
+    if not runs:
+      lines.append('')
+      continue
+    lines.append(
+      f'  {"phase":<8}' + ''.join(f'{f"p{p}":>10}' for p in _PERCENTILES))
+    for phase, pcts in history.summarize(runs, _PERCENTILES).items():
+      lines.append(
+        f'  {phase:<8}' +
+        ''.join(f'{format_secs(pcts[p]):>10}' for p in _PERCENTILES))
+    lines.append('')
+
+  # Only list the slowest runs from the widest window, the rest are a subset.
+  _, runs = windows[-1]
+  slowest = history.slowest(runs, n_slowest)
+  if slowest:
+    lines.append('Slowest commands:')
+    for r in slowest:
+      started = datetime.datetime.fromtimestamp(r.start).strftime(
+        '%Y-%m-%d %H:%M')
+      lines.append(
+        f'  {format_secs(r.total_secs):>8}  {started}  '
+        f'exit {r.exit_code}  (rx {r.version})  {" ".join(r.argv)}')
+  return '\n'.join(lines).rstrip()
+
+
+def format_secs(secs: float) -> str:
+  if secs < 1:
+    return f'{secs * 1000:.0f}ms'
+  return f'{secs:.2f}s'
+
+
+def windows(arg: str) -> List[_Window]:
+  """Parses a comma-separated list of windows, e.g., "1h,7d,all"."""
+  result = []
+  for name in arg.split(','):
+    name = name.strip()
+    if name == 'all':
+      result.append((name, None))
+      continue
+    match = re.fullmatch(r'(\d+)([mhdw])', name)
+    if not match:
+      raise argparse.ArgumentTypeError(
+        f'{name} is not a window, use something like 30m, 12h, 7d, 2w or all')
+    result.append((name, int(match.group(1)) * _UNIT_SECS[match.group(2)]))
+  # Widest last.
+  return sorted(
+    result, key=lambda w: float('inf') if w[1] is None else w[1])
+
+
+def add_parser(subparsers: argparse._SubParsersAction):
+  stats_cmd = subparsers.add_parser(
+    'stats',
+    help='Shows how long syncing, running and pulling outputs took for the '
+    'commands run in this workspace')
+  stats_cmd.add_argument(
+    '--windows', default=windows('1d,7d,30d'), type=windows,
+    help='Comma-separated time windows to show, e.g., 1h,7d,all')
+  stats_cmd.add_argument(
+    '--slowest', default=5, type=int,
+    help='How many of the slowest commands to list')
+  stats_cmd.add_argument(
+    '--json', default=False, action='store_true',
+    help='Print stats as JSON')
+  stats_cmd.set_defaults(cmd=StatsCommand)
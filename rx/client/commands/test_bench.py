@@ -0,0 +1,61 @@
+import unittest
+
+from rx.client import history
+from rx.client.commands import bench
+from rx.client.commands import exec
+
+
+def _run(secs: float, exit_code: int = 0) -> history.Run:
+  return history.Run(
+    argv=['pytest'], exit_code=exit_code, bytes_synced=100, sync_secs=1,
+    exec_secs=secs - 1, total_secs=secs)
+
+
+class BenchTests(unittest.TestCase):
+
+  def test_flag_parsing(self):
+    cmdline = exec.parse_flags_with_usage(
+      ['rx', 'bench', '-n', '20', '--', 'pytest', '-q', 'tests/unit'])
+
+    self.assertEqual(cmdline.ns.runs, 20)
+    self.assertEqual(
+      bench.BenchCommand(cmdline)._argv, ['pytest', '-q', 'tests/unit'])
+
+  def test_command_flags_are_not_benchs(self):
+    cmdline = exec.parse_flags_with_usage(['rx', 'bench', 'pytest', '-n', '4'])
+
+    self.assertEqual(cmdline.ns.runs, 10)
+    self.assertEqual(bench.BenchCommand(cmdline)._argv, ['pytest', '-n', '4'])
+
+  def test_should_sync(self):
+    self.assertEqual(
+      [bench._should_sync('once', i) for i in range(3)], [True, False, False])
+    self.assertEqual(
+      [bench._should_sync('always', i) for i in range(2)], [True, True])
+    self.assertEqual(bench._should_sync('never', 0), False)
+
+  def test_summarize(self):
+    got = bench.summarize([_run(secs) for secs in (2, 4, 3)])
+
+    self.assertEqual(
+      got['total'],
+      {'min': 2, 'p50': 3, 'p90': 4, 'p95': 4, 'p99': 4, 'max': 4})
+    self.assertEqual(got['sync']['max'], 1)
+
+  def test_format_results(self):
+    got = bench.format_results(
+      ['pytest'], [_run(5)], [_run(2), _run(3, exit_code=1)])
+
+    self.assertIn('Cold: 1 runs\n', got)
+    self.assertIn('Warm: 2 runs, 1 failed\n', got)
+    self.assertIn(
+      '  total        2.00s     2.00s     3.00s     3.00s     3.00s     3.00s',
+      got)
+
+  def test_to_dict(self):
+    got = bench.to_dict(['pytest'], [], [_run(2)])
+
+    self.assertEqual(got['cold']['runs'], [])
+    self.assertEqual(got['warm']['runs'][0]['total_secs'], 2)
+    self.assertEqual(got['warm']['runs'][0]['bytes_synced'], 100)
+    self.assertEqual(got['warm']['summary']['exec']['p50'], 1)
@@ -24,12 +24,25 @@ class ExecTests(unittest.TestCase):
     got = exec.parse_flags_with_usage(['rx', 'ls', '-l'])
 
     want = command.CommandLine(
-      ns=argparse.Namespace(cmd=runner.RunCommand),
-      remainder=['ls', '-l'],
+      ns=argparse.Namespace(
+        cmd=runner.RunCommand, wait_deps=True, argv=['ls', '-l']),
+      remainder=[],
       original=['rx', 'ls', '-l']
     )
     self.assertEqual(got, want)
 
+  def test_flag_parsing_no_wait_deps(self):
+    got = exec.parse_flags_with_usage(['rx', '--no-wait-deps', 'ls', '-l'])
+
+    self.assertFalse(got.ns.wait_deps)
+    self.assertEqual(got.ns.argv, ['ls', '-l'])
+
+  def test_command_flags_are_not_rxs(self):
+    got = exec.parse_flags_with_usage(['rx', 'git', 'log', '--no-w'])
+
+    self.assertTrue(got.ns.wait_deps)
+    self.assertEqual(got.ns.argv, ['git', 'log', '--no-w'])
+
   def test_required_arg_found(self):
     got = exec.get_first_required_arg(['--remote=r', 'init', '--dry-run'])
     self.assertEqual(got, 'init')
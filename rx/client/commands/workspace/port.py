@@ -37,7 +37,9 @@ class OpenPortCommand(Command):
         None, f'Invalid port number: {self._cmdline.remainder[0]}')
     local_port = self._cmdline.ns.local_port
     try:
-      daemon_cli.open_port(port=port, local_port=local_port)
+      daemon_cli.open_port(
+        port=port, local_port=local_port,
+        http_cache=self._cmdline.ns.http_cache)
     except client.PortError as e:
       # Bind error.
       print(e)
@@ -81,6 +83,9 @@ def add_parser(subparsers: argparse._SubParsersAction):
   open_port_cmd.add_argument(
     '--local-port', dest='local_port', type=int, default=0,
     help='Port to forward to listen on locally')
+  open_port_cmd.add_argument(
+    '--http-cache', dest='http_cache', action='store_true',
+    help='Cache HTTP responses from the port locally (for dev servers)')
   open_port_cmd.set_defaults(cmd=OpenPortCommand)
 
   close_port_cmd = subparsers.add_parser(
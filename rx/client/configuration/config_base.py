@@ -73,7 +73,9 @@ def get_config_dir(rxroot: pathlib.Path) -> pathlib.Path:
 
 
 def is_local(addr: str) -> bool:
-  return addr.startswith('localhost') or addr == '127.0.0.1'
+  return (
+    addr.startswith('localhost') or addr == '127.0.0.1' or
+    addr.startswith('unix:'))
 
 
 class ConfigNotFoundError(FileNotFoundError):
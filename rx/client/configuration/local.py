@@ -2,6 +2,7 @@
 import dataclasses
 import pathlib
 import shutil
+import socket
 import subprocess
 from typing import Any, Dict, Optional, Tuple
 import uuid
@@ -17,6 +18,9 @@ VERSION = '0.1.0'
 
 # Port the rx-daemon listens on.
 DEFAULT_DAEMON_PORT = 8478
+# Unix socket paths longer than this don't fit in sockaddr_un on macOS (Linux
+# allows 107).
+_MAX_UNIX_SOCKET_PATH = 103
 IGNORE = pathlib.Path('.rxignore')
 REMOTE_DIR = config_base.RX_DIR / 'remotes'
 
@@ -24,6 +28,10 @@ _REMOTE = flags.DEFINE_string(
   'remote', None,
   'The path to the remote configuration file to use (see .rx/README.md).')
 _RSYNC_PATH = flags.DEFINE_string('rsync_path', None, 'Path to rsync binary')
+_DAEMON_DIR = flags.DEFINE_string(
+  'daemon_dir', None,
+  'Where the daemon keeps its pid file and socket (defaults to '
+  '~/.rx/<trex-host>/daemon).')
 
 _DEFAULT_REMOTE = REMOTE_DIR / 'default'
 
@@ -67,9 +75,6 @@ class LocalConfig:
         'daemon_port': self.daemon_port,
       }, fh)
 
-  def get_daemon_pid_file(self) -> pathlib.Path:
-    return config_base.get_config_dir(self.cwd) / 'daemon.pid'
-
 
 def create_local_config(rxroot: pathlib.Path, should_sync: bool) -> LocalConfig:
   """Gets or creates .rx directory and local config."""
@@ -220,6 +225,39 @@ def load_config(rxroot: pathlib.Path) -> LocalConfig:
   return LocalConfig(**{k: v for k, v in cfg.items() if k in fields})
 
 
+def get_daemon_dir() -> pathlib.Path:
+  """Returns the daemon's directory, e.g., ~/.rx/trex-dev.run-rx.com/daemon.
+
+  One daemon serves every rxroot for this user, so it doesn't live in any of
+  them.
+  """
+  if _DAEMON_DIR.value:
+    return pathlib.Path(_DAEMON_DIR.value).absolute()
+  return (
+    pathlib.Path.home() / config_base.RX_DIR / config_base.TREX_HOST.value /
+    'daemon')
+
+
+def get_daemon_pid_file() -> pathlib.Path:
+  return get_daemon_dir() / 'daemon.pid'
+
+
+def get_daemon_socket_file() -> pathlib.Path:
+  return get_daemon_dir() / 'daemon.sock'
+
+
+def get_daemon_unix_addr() -> Optional[str]:
+  """Returns the address of the daemon's Unix socket.
+
+  Returns None if Unix sockets can't be used here (e.g., the home directory's
+  path is too long), in which case only TCP is used.
+  """
+  path = str(get_daemon_socket_file())
+  if not hasattr(socket, 'AF_UNIX') or len(path) > _MAX_UNIX_SOCKET_PATH:
+    return None
+  return f'unix:{path}'
+
+
 def get_local_config_path(rxroot: pathlib.Path) -> pathlib.Path:
   """Return .rx/trex-dev.run-rx.com/config/local."""
   return config_base.get_config_dir(rxroot) / 'local'
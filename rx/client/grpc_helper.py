@@ -1,9 +1,14 @@
+from typing import Sequence, Tuple
+
 import grpc
 
 from rx.client.configuration import config_base
 
 
-def get_channel(addr: str) -> grpc.Channel:
+def get_channel(
+    addr: str, options: Sequence[Tuple[str, int]] = ()) -> grpc.Channel:
   return (
-    grpc.insecure_channel(addr) if config_base.is_local(addr) else
-    grpc.secure_channel(addr, credentials=grpc.ssl_channel_credentials()))
+    grpc.insecure_channel(addr, options=options)
+    if config_base.is_local(addr) else
+    grpc.secure_channel(
+      addr, credentials=grpc.ssl_channel_credentials(), options=options))
@@ -0,0 +1,155 @@
+"""A local record of every command run in this rxroot, with per-phase timings.
+
+This is kept on the client (in .rx/<trex-host>/history.db) so that `rx stats`
+can show how long syncing, queueing, running and pulling outputs take, and
+whether that changed after upgrading rx or editing .rxignore.
+"""
+import dataclasses
+import json
+import math
+import pathlib
+import sqlite3
+import time
+from types import TracebackType
+from typing import Dict, List, Optional, Sequence, Type
+
+from absl import logging
+
+from rx.client.configuration import config_base
+from rx.client.configuration import local
+
+PHASES = ('sync', 'queue', 'exec', 'pull', 'total')
+# Older runs are dropped once there are this many.
+_MAX_RUNS = 10000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+  id INTEGER PRIMARY KEY,
+  start REAL NOT NULL,
+  argv TEXT NOT NULL,
+  exit_code INTEGER,
+  bytes_synced INTEGER NOT NULL,
+  sync_secs REAL NOT NULL,
+  queue_secs REAL NOT NULL,
+  exec_secs REAL NOT NULL,
+  pull_secs REAL NOT NULL,
+  total_secs REAL NOT NULL,
+  version TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_start ON runs (start);
+"""
+_COLUMNS = (
+  'start', 'argv', 'exit_code', 'bytes_synced', 'sync_secs', 'queue_secs',
+  'exec_secs', 'pull_secs', 'total_secs', 'version')
+
+
+@dataclasses.dataclass
+class Run:
+  """One `rx <cmd>` invocation.
+
+  Phases that didn't happen (e.g., sync when should_sync is off) are 0.
+  """
+  argv: List[str]
+  # Seconds since the epoch.
+  start: float = dataclasses.field(default_factory=time.time)
+  exit_code: Optional[int] = None
+  bytes_synced: int = 0
+  sync_secs: float = 0
+  # From sending the Exec RPC until the worker started the command.
+  queue_secs: float = 0
+  exec_secs: float = 0
+  pull_secs: float = 0
+  total_secs: float = 0
+  version: str = local.VERSION
+
+  def phase_secs(self, phase: str) -> float:
+    return getattr(self, f'{phase}_secs')
+
+
+class History:
+  """The SQLite database of runs."""
+
+  def __init__(self, path: pathlib.Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    self._conn = sqlite3.connect(str(path))
+    self._conn.executescript(_SCHEMA)
+
+  def __enter__(self) -> 'History':
+    return self
+
+  def __exit__(self, exctype: Optional[Type[BaseException]],
+             excinst: Optional[BaseException],
+             exctb: Optional[TracebackType]):
+    del exctype
+    del excinst
+    del exctb
+    self.close()
+
+  def close(self):
+    self._conn.close()
+
+  def add(self, run: Run):
+    row = dataclasses.asdict(run)
+    row['argv'] = json.dumps(run.argv)
+    with self._conn:
+      self._conn.execute(
+        f'INSERT INTO runs ({", ".join(_COLUMNS)}) '
+        f'VALUES ({", ".join("?" * len(_COLUMNS))})',
+        [row[c] for c in _COLUMNS])
+      self._conn.execute(
+        'DELETE FROM runs WHERE id <= (SELECT MAX(id) FROM runs) - ?',
+        (_MAX_RUNS,))
+
+  def runs(self, since: float = 0) -> List[Run]:
+    """Returns runs that started at or after since, oldest first."""
+    cursor = self._conn.execute(
+      f'SELECT {", ".join(_COLUMNS)} FROM runs WHERE start >= ? '
+      'ORDER BY start', (since,))
+    runs = []
+    for row in cursor:
+      values = dict(zip(_COLUMNS, row))
+      values['argv'] = json.loads(values['argv'])
+      runs.append(Run(**values))
+    return runs
+
+
+def get_history_file(rxroot: pathlib.Path) -> pathlib.Path:
+  """Returns .rx/<trex-host>/history.db, which .rxignore keeps from syncing."""
+  return config_base.get_config_dir(rxroot).parent / 'history.db'
+
+
+def record(rxroot: pathlib.Path, run: Run):
+  """Adds run to rxroot's history.
+
+  History is best-effort: it shouldn't fail the command that was just run.
+  """
+  try:
+    with History(get_history_file(rxroot)) as hist:
+      hist.add(run)
+  except (OSError, sqlite3.Error):
+    logging.exception('Could not record run in history')
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+  """Returns the value pct% of values are at or below (nearest rank)."""
+  if not values:
+    return 0
+  ordered = sorted(values)
+  rank = max(1, math.ceil(pct / 100 * len(ordered)))
+  return ordered[rank - 1]
+
+
+def summarize(
+    runs: Sequence[Run],
+    pcts: Sequence[float] = (50, 95, 99),
+) -> Dict[str, Dict[float, float]]:
+  """Returns {phase: {pct: secs}} for every phase."""
+  return {
+    phase: {p: percentile([r.phase_secs(phase) for r in runs], p)
+            for p in pcts}
+    for phase in PHASES
+  }
+
+
+def slowest(runs: Sequence[Run], n: int) -> List[Run]:
+  return sorted(runs, key=lambda r: r.total_secs, reverse=True)[:n]
@@ -36,6 +36,8 @@ import yaml
 
 from rx.client import browser
 from rx.client.configuration import config_base
+from rx.shared import metrics
+from rx.shared import trace
 
 _DO_AUTH = flags.DEFINE_bool(
   'do_auth', True, 'Skip auth for offline development')
@@ -92,6 +94,8 @@ class LoginManager:
     self._server = None
     self._port = 0
     self._code_holder = CodeHolder()
+    # Clients can be shared between threads, make sure only one refreshes.
+    self._refresh_lock = threading.Lock()
     self._access_token = config_base.ReadOnlyConfig(
       _get_access_token_file(rxroot), strict_mode=False)
     if not _DO_AUTH.value:
@@ -148,6 +152,7 @@ class LoginManager:
 
   def refresh_access_token(self):
     """Refreshes the access token when it expires."""
+    metrics.counter('login.token_refreshes').inc()
     refresh_file = _get_refresh_token_file(self._rxroot)
     if not refresh_file.exists():
       # Access token was expired but the refresh token doesn't exist. Just start
@@ -189,14 +194,15 @@ class LoginManager:
 
   def validate_login(self):
     assert self._access_token
-    try:
-      id_token = decode_id_token(self._access_token['id_token'])
-    except ValueError as e:
-      _delete_auth_files(self._rxroot)
-      logging.exception(e)
-      raise AuthError('Could not read token, please try logging in again.')
-    if is_expired(id_token):
-      self.refresh_access_token()
+    with self._refresh_lock, trace.span('validate_login'):
+      try:
+        id_token = decode_id_token(self._access_token['id_token'])
+      except ValueError as e:
+        _delete_auth_files(self._rxroot)
+        logging.exception(e)
+        raise AuthError('Could not read token, please try logging in again.')
+      if is_expired(id_token):
+        self.refresh_access_token()
 
   def wait_for_login(self):
     """Shuts down the server after login."""
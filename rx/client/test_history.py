@@ -0,0 +1,104 @@
+import argparse
+import pathlib
+import tempfile
+import unittest
+from unittest import mock
+
+from absl import flags
+from absl.testing import absltest
+
+from rx.client import history
+from rx.client.commands import stats
+
+FLAGS = flags.FLAGS
+
+
+class HistoryTests(unittest.TestCase):
+
+  def setUp(self) -> None:
+    super().setUp()
+    if not FLAGS.is_parsed():
+      FLAGS.mark_as_parsed()
+    tmpdir = tempfile.TemporaryDirectory()
+    self.addCleanup(tmpdir.cleanup)
+    self._tmpdir = pathlib.Path(tmpdir.name)
+
+  def test_round_trip(self):
+    run = history.Run(
+      argv=['pytest', '-q'], start=100, exit_code=1, bytes_synced=1234,
+      sync_secs=0.5, queue_secs=0.1, exec_secs=3, pull_secs=0.2,
+      total_secs=4)
+
+    with history.History(self._tmpdir / 'history.db') as hist:
+      hist.add(run)
+      hist.add(history.Run(argv=['ls'], start=50))
+      got = hist.runs(since=75)
+
+    self.assertEqual(got, [run])
+
+  def test_keeps_newest_runs(self):
+    with mock.patch.object(history, '_MAX_RUNS', 3):
+      with history.History(self._tmpdir / 'history.db') as hist:
+        for i in range(5):
+          hist.add(history.Run(argv=[str(i)], start=i))
+        got = [r.argv for r in hist.runs()]
+
+    self.assertEqual(got, [['2'], ['3'], ['4']])
+
+  def test_record_is_best_effort(self):
+    # The "rxroot" is a file, so the database can't be created under it.
+    rxroot = self._tmpdir / 'file'
+    rxroot.touch()
+
+    history.record(rxroot, history.Run(argv=['ls']))
+
+  def test_summarize(self):
+    runs = [
+      history.Run(argv=['ls'], exec_secs=secs, total_secs=secs + 1)
+      for secs in range(1, 101)
+    ]
+
+    got = history.summarize(runs, (50, 99))
+
+    self.assertEqual(got['exec'], {50: 50, 99: 99})
+    self.assertEqual(got['total'], {50: 51, 99: 100})
+    self.assertEqual(got['sync'], {50: 0, 99: 0})
+    self.assertEqual(history.summarize([], (50,))['exec'], {50: 0})
+
+  def test_slowest(self):
+    runs = [
+      history.Run(argv=[str(secs)], total_secs=secs) for secs in (3, 9, 1)]
+
+    got = history.slowest(runs, 2)
+
+    self.assertEqual([r.argv for r in got], [['9'], ['3']])
+
+
+class StatsCommandTests(unittest.TestCase):
+
+  def test_windows(self):
+    self.assertEqual(
+      stats.windows('all,7d,1h'),
+      [('1h', 3600), ('7d', 7 * 24 * 3600), ('all', None)])
+
+  def test_bad_window(self):
+    with self.assertRaises(argparse.ArgumentTypeError):
+      stats.windows('7 days')
+
+  def test_format(self):
+    runs = [
+      history.Run(
+        argv=['pytest'], start=0, exit_code=0, exec_secs=2, total_secs=2.5,
+        version='0.1')
+    ]
+
+    got = stats.format_stats([('1d', []), ('all', runs)], 1)
+
+    self.assertIn('Last 1d: 0 runs', got)
+    self.assertIn('All time: 1 runs', got)
+    self.assertIn('  exec         2.00s     2.00s     2.00s', got)
+    self.assertIn('exit 0  (rx 0.1)  pytest', got)
+
+
+if __name__ == '__main__':
+  absltest.main()
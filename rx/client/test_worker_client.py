@@ -0,0 +1,126 @@
+import io
+import pathlib
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from absl import flags
+from absl.testing import absltest
+import grpc
+
+from rx.client import login
+from rx.client import worker_client
+from rx.client.configuration import local
+from rx.client.configuration import remote
+from rx.testing import fake_worker
+from rx.trex.toolchain import local_fs
+
+FLAGS = flags.FLAGS
+
+
+class InitTests(unittest.TestCase):
+
+  def setUp(self) -> None:
+    super().setUp()
+    if not FLAGS.is_parsed():
+      FLAGS.mark_as_parsed()
+    self._tmpdir = tempfile.TemporaryDirectory()
+    self._rxroot = pathlib.Path(self._tmpdir.name)
+    local.get_local_config_path(self._rxroot).parent.mkdir(parents=True)
+    (self._rxroot / 'requirements.txt').write_text('absl-py\n')
+    self._servicer = fake_worker.FakeExecutionService()
+    self._server, addr = fake_worker.start_server(self._servicer)
+    with remote.WritableRemote(self._rxroot) as r:
+      r['workspace_id'] = 'ws123'
+      r['worker_addr'] = addr
+      r['daemon_module'] = 'ws123'
+    self._channel = grpc.insecure_channel(addr)
+    lm = mock.create_autospec(login.LoginManager, instance=True)
+    lm.grpc_metadata = (('id-token', 'abc123'),)
+    local_cfg = local.LocalConfig(
+      cwd=self._rxroot, project_name='test', rsync_path='/usr/bin/rsync')
+    self._client = worker_client.Client(self._channel, local_cfg, lm)
+    self._from_remote = mock.patch.object(
+      self._client._rsync, 'from_remote').start()
+    self._to_remote = mock.patch.object(
+      self._client._rsync, 'to_remote', return_value=0).start()
+    mock.patch.object(
+      local_fs, 'get_manifest', return_value=['requirements.txt']).start()
+    mock.patch.object(sys, 'stdout', new=io.TextIOWrapper(io.BytesIO())).start()
+
+  def tearDown(self) -> None:
+    mock.patch.stopall()
+    self._channel.close()
+    self._server.stop(grace=None)
+    self._tmpdir.cleanup()
+    super().tearDown()
+
+  def test_unchanged_deps_are_skipped(self):
+    self._client.init()
+    self._client.init()
+
+    self.assertEqual(self._servicer.installs, 1)
+    self._from_remote.assert_called_once()
+
+  def test_changed_deps_are_installed(self):
+    self._client.init()
+    (self._rxroot / 'requirements.txt').write_text('absl-py\ngrpcio\n')
+    self._client.init()
+
+    self.assertEqual(self._servicer.installs, 2)
+    self.assertEqual(self._from_remote.call_count, 2)
+
+  def test_deps_files_are_uploaded_first(self):
+    self._client.init()
+
+    self.assertEqual(self._to_remote.call_args_list, [
+      mock.call(files=['requirements.txt']), mock.call(files=None)])
+    self.assertEqual(self._servicer.init_calls, 1)
+
+  def test_install_overlaps_upload(self):
+    installed = threading.Event()
+    def to_remote(files=None):
+      # The full upload doesn't finish until the install has started.
+      if files is None and not installed.wait(timeout=10):
+        return 1
+      return 0
+    self._to_remote.side_effect = to_remote
+    install_deps = self._client.install_deps
+    def install(out, fingerprint):
+      installed.set()
+      return install_deps(out, fingerprint)
+
+    with mock.patch.object(self._client, 'install_deps', side_effect=install):
+      self._client.init()
+
+    self.assertEqual(self._servicer.installs, 1)
+    self._from_remote.assert_called_once()
+
+  def test_scan_is_uploaded(self):
+    scan = local_fs.Scan(paths=['src/', 'src/x.py', 'requirements.txt'])
+
+    self._client.init(scan=scan)
+
+    self.assertEqual(self._to_remote.call_args_list, [
+      mock.call(files=['requirements.txt']), mock.call(files=scan.paths)])
+    self.assertEqual(self._servicer.installs, 1)
+
+  def test_skip_install(self):
+    self._client.init(install_deps=False)
+
+    self.assertEqual(self._servicer.installs, 0)
+    self._to_remote.assert_called_once_with(files=None)
+    self._from_remote.assert_not_called()
+
+  def test_upload_error(self):
+    self._to_remote.side_effect = lambda files=None: 0 if files else 23
+
+    with self.assertRaises(worker_client.RsyncError):
+      self._client.init()
+
+    self._from_remote.assert_not_called()
+
+if __name__ == '__main__':
+  absltest.main()
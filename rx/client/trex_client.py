@@ -1,7 +1,8 @@
 import datetime
 import sys
 import time
-from typing import cast, Any, Dict, Generator, Iterable, Optional, Tuple
+from typing import (
+  cast, Any, Dict, Generator, Iterable, Optional, Sequence, Tuple)
 
 from absl import logging
 from google.protobuf import empty_pb2
@@ -18,6 +19,7 @@ from rx.client.configuration import remote
 from rx.shared import progress_bar
 from rx.proto import rx_pb2
 from rx.proto import rx_pb2_grpc
+from rx.trex.toolchain import local_fs
 
 _PAYMENT_TIMEOUT = datetime.timedelta(300)
 _RPC_TIMEOUT_SECS = seconds=10
@@ -73,12 +75,26 @@ class Client:
       raise TrexError(response.result.message, response.result.code)
     return response
 
-  def init(self, source_type: str, source: Dict[str, Any]) -> str:
-    """Creates a new workspace and returns its ID."""
+  def init(
+      self,
+      source_type: str,
+      source: Dict[str, Any],
+      toolchain: Sequence[rx_pb2.Tool] = (),
+      install_deps: bool = True,
+      scan: Optional[local_fs.Scan] = None) -> str:
+    """Creates a new workspace and returns its ID.
+
+    toolchain is what was detected locally. It's only sent if the remote
+    config doesn't specify one. If install_deps is False, the caller is
+    responsible for installing dependencies. scan is what to upload, if the
+    caller already listed it.
+    """
     try:
       target_env = self._local_cfg.get_target_env()
     except local.ConfigError as e:
       raise TrexError(str(e), -1)
+    if toolchain and not target_env.remote.toolchain:
+      target_env.remote.toolchain.extend(toolchain)
     req = rx_pb2.InitRequest(
       project_name=self._local_cfg.project_name,
       target_env=target_env,
@@ -121,7 +137,7 @@ Then retry this command.
     try:
       with grpc_helper.get_channel(resp.worker_addr) as ch:
         worker = worker_client.create_authed_client(ch, self._local_cfg)
-        worker.init()
+        worker.init(install_deps=install_deps, scan=scan)
     except worker_client.WorkerError as e:
       raise TrexError(f'Error setting up worker {resp.worker_addr}: {e}', -1)
     return workspace_id
@@ -1,20 +1,24 @@
-import errno
 import os
 import pathlib
 import sys
 import threading
 import time
-from typing import Callable, Generator, Iterable, Iterator, List, Optional, Tuple, TypeVar, cast
+from typing import Any, BinaryIO, Generator, Iterable, Iterator, List, Optional, Sequence, Tuple, cast
 
 from absl import flags
 from absl import logging
 import grpc
 
+from rx.client import history
 from rx.client import login
 from rx.client import output_handler
 from rx.client.configuration import local
 from rx.client.configuration import remote
 from rx.shared import progress_bar
+from rx.shared import trace
+from rx.trex.toolchain import lang_detector
+from rx.trex.toolchain import local_fs
+from rx.trex.toolchain import manifest
 from rx.worker import executor
 from rx.worker import rsync
 from rx.proto import rx_pb2
@@ -41,6 +45,8 @@ class Client:
     self._login_manager = login_manager
     self._rsync = rsync.RsyncClient(local_cfg, self._remote_cfg)
     self._stub = rx_pb2_grpc.ExecutionServiceStub(channel)
+    # Timings for the last exec, for the history.
+    self.last_run: Optional[history.Run] = None
 
   @property
   def metadata(self) -> Tuple[Tuple[str, str], Tuple[str, str]]:
@@ -48,46 +54,85 @@ class Client:
     self._login_manager.validate_login()
     return local.get_grpc_metadata() + self._login_manager.grpc_metadata
 
-  def init(self):
+  def init(
+      self,
+      install_deps: bool = True,
+      scan: Optional[local_fs.Scan] = None):
+    """Sets up the workspace's sources, container and dependencies.
+
+    Uploading sources and pulling the image are independent, so they run at
+    the same time. Dependency files (requirements.txt, etc.) are uploaded
+    first, so installing dependencies can start as soon as the container is
+    up, while the rest of the sources are still uploading.
+
+    If install_deps is False, this returns once the sources are uploaded and
+    the container is up, e.g., so the daemon can install them in the
+    background.
+
+    If the caller already scanned the tree, rsync is told exactly which files
+    to upload instead of walking it again. The workspace is new, so there's
+    nothing on the worker to delete.
+    """
+    uploader = None
+    fingerprint = ''
     if self._local_cfg.should_sync:
       req = rx_pb2.GenericRequest(workspace_id=self._remote_cfg.workspace_id)
       resp = self._stub.SetupRsync(req, metadata=self.metadata)
       if resp.HasField('result') and resp.result.code != rx_pb2.OK:
         raise WorkerError('Error setting up rsync', resp.result)
+      deps_files = []
+      if install_deps:
+        deps_files = (
+          lang_detector.get_deps_files(scan.get_manifest()) if scan
+          else self._get_deps_files())
+      fingerprint = lang_detector.fingerprint_files(
+        deps_files, self._local_cfg.cwd)
+      uploader = _Uploader(
+        self._rsync, deps_files, scan.paths if scan else None)
+      uploader.start()
+
+    with trace.span('init.container'):
+      self._init_container()
+
+    if not install_deps:
+      if uploader:
+        uploader.wait()
+      return
+    if uploader:
+      # Installing only needs the dependency files, not the rest.
+      uploader.wait_for_deps()
+    with trace.span('init.install_deps'):
+      up_to_date = self.install_deps(sys.stdout.buffer, fingerprint)
+    if not uploader:
+      return
+    # Pulling deletes anything the worker doesn't have, so the upload has to
+    # be done first.
+    uploader.wait()
+    if up_to_date:
+      logging.info('Dependencies are up-to-date, not pulling them')
+      return
+    self._rsync.from_remote('.', self._local_cfg.cwd)
 
-      # Sync sources.
-      prog = ShowLongRunningProgress(title='Syncing directory contents')
-      result = prog.run(self._rsync.to_remote)
-      if result != 0:
-        logging.info('error: %s', errno.errorcode[result])
-        raise RsyncError()
-
-    # Get the container downloaded/running.
-    req = rx_pb2.GenericRequest(workspace_id=self._remote_cfg.workspace_id)
-    resp = self._stub.Init(req, metadata=self.metadata)
-    def get_progress(
-        resp: Iterable[rx_pb2.WorkerInitResponse]
-    ) -> Generator[rx_pb2.DockerImageProgress, None, None]:
-      for r in resp:
-        if r.result.code != rx_pb2.OK:
-          raise WorkerError(result=r.result)
-        if r.pull_progress:
-          yield r.pull_progress
-    result = progress_bar.show_progress_bars(get_progress(resp))
-    if result and result.code != rx_pb2.OK:
-      if result.code == rx_pb2.MOVED:
-        raise WorkspaceRelocationError()
-      raise WorkerError(
-        f'Error initializing worker {self._remote_cfg.worker_addr}', result)
-
-    self._install_deps()
+  def exec(self, argv: List[str], sync: Optional[bool] = None) -> int:
+    """Runs argv on the worker and returns its exit code.
 
-  def exec(self, argv: List[str]) -> int:
+    sync overrides whether sources are uploaded first (by default, if the
+    workspace syncs).
+    """
     cmd_str = ' '.join(argv)
     logging.info(f'Running `{cmd_str}` on {self._remote_cfg.worker_addr}')
-
-    if self._local_cfg.should_sync:
+    run = history.Run(argv=argv)
+    self.last_run = run
+    if sync is None:
+      sync = self._local_cfg.should_sync
+
+    if sync:
+      start = time.monotonic()
+      # A full sync, not from init's saved scan: this has to pick up files
+      # added and deleted since.
       result = self._rsync.to_remote()
+      run.sync_secs = time.monotonic() - start
+      run.bytes_synced = self._rsync.last_bytes_sent
       if result != 0:
         raise RsyncError()
 
@@ -104,7 +149,10 @@ class Client:
       workspace_id=self._remote_cfg.workspace_id, argv=argv, cwd=cwd)
     runner = executor.Executor(self._stub, request)
     try:
-      response = runner.run(self.metadata, out_handler)
+      with trace.span('exec'):
+        response = runner.run(self.metadata, out_handler)
+      run.queue_secs = runner.queue_secs
+      run.exec_secs = runner.exec_secs
     except grpc.RpcError as e:
       e = cast(grpc.Call, e)
       sys.stderr.write(f'Error contacting {self._remote_cfg.worker_addr}: {e.details()}\n')
@@ -135,7 +183,10 @@ Please run `rx subscribe` to continue.""")
       return response.result.code
 
     if self._local_cfg.should_sync:
-      out_handler.write_outputs(self._rsync)
+      start = time.monotonic()
+      with trace.span('pull_outputs'):
+        out_handler.write_outputs(self._rsync)
+      run.pull_secs = time.monotonic() - start
 
     # Return the process's exit code.
     return response.exit_code
@@ -156,6 +207,15 @@ Please run `rx subscribe` to continue.""")
   def forward_to_port(
       self, port: int, stream: Iterator[bytes],
   ) -> Iterator[bytes]:
+    return self.start_port_forward(port, stream).responses()
+
+  def start_port_forward(
+      self, port: int, stream: Iterator[bytes]) -> 'PortForwardCall':
+    """Starts a PortForward call immediately.
+
+    The call is set up (and authed) even if stream doesn't yield anything yet,
+    which lets the daemon open streams before it has a connection for them.
+    """
     workspace_id = self._remote_cfg.workspace_id
     def _make_req(
         stream: Iterator[bytes]
@@ -163,28 +223,55 @@ Please run `rx subscribe` to continue.""")
       for frame in stream:
         yield rx_pb2.PortForwardRequest(
           workspace_id=workspace_id, port=port, frame=frame)
-    try:
-      for resp in self._stub.PortForward(
-          _make_req(stream), metadata=self.metadata):
-        if resp.HasField('result') and resp.result.code != 0:
-          raise WorkerError(resp.result)
-        yield resp.frame
-    except grpc.RpcError as e:
-      e = cast(grpc.Call, e)
-      if e.code() == grpc.StatusCode.UNAVAILABLE:
-        raise DisconnectionError()
-      raise WorkerError(f'Error forwarding to {port}: {e.details()}')
-    # Signal end of response.
-    yield b''
-
-  def _install_deps(self):
-    req = rx_pb2.GenericRequest(workspace_id=self._remote_cfg.workspace_id)
+    call = self._stub.PortForward(_make_req(stream), metadata=self.metadata)
+    return PortForwardCall(port, call)
+
+  def forward_mux(
+      self, port: int, stream: Iterator[rx_pb2.PortForwardMuxRequest],
+  ) -> Iterator[rx_pb2.PortForwardMuxResponse]:
+    """Opens a stream that multiplexes many connections to port.
+
+    This blocks until the worker has accepted the stream, so an
+    UnimplementedError is raised here (rather than while iterating) if the
+    worker doesn't support multiplexing.
+    """
+    workspace_id = self._remote_cfg.workspace_id
+    def _make_req(
+        stream: Iterator[rx_pb2.PortForwardMuxRequest]
+    ) -> Iterator[rx_pb2.PortForwardMuxRequest]:
+      for req in stream:
+        if req.signal == rx_pb2.OPEN:
+          req.workspace_id = workspace_id
+          req.port = port
+        yield req
+    call = self._stub.PortForwardMux(_make_req(stream), metadata=self.metadata)
+    # The worker sends initial metadata as soon as it accepts the stream.
+    call.initial_metadata()
+    if call.done() and call.code() != grpc.StatusCode.OK:
+      raise _forwarding_error(port, call)
+    def _get_responses() -> Iterator[rx_pb2.PortForwardMuxResponse]:
+      try:
+        for resp in call:
+          yield resp
+      except grpc.RpcError as e:
+        raise _forwarding_error(port, cast(grpc.Call, e))
+    return _get_responses()
+
+  def install_deps(self, out: BinaryIO, deps_fingerprint: str = '') -> bool:
+    """Installs dependencies on the worker, writing their output to out.
+
+    Returns if they were already up-to-date (deps_fingerprint matched the last
+    install), so nothing was installed.
+    """
+    req = rx_pb2.InstallDepsRequest(
+      workspace_id=self._remote_cfg.workspace_id,
+      deps_fingerprint=deps_fingerprint)
     response = None
     try:
       for response in self._stub.InstallDeps(req, metadata=self.metadata):
         if response.stdout:
-          sys.stdout.buffer.write(response.stdout)
-          sys.stdout.buffer.flush()
+          out.write(response.stdout)
+          out.flush()
     except grpc.RpcError as e:
       e = cast(grpc.Call, e)
       raise WorkerError(e.details(), result=None)
@@ -193,17 +280,87 @@ Please run `rx subscribe` to continue.""")
       raise WorkspaceRelocationError()
     if response.result.code:
       raise WorkerError(message=None, result=response.result)
+    return response.up_to_date
 
-    if self._local_cfg.should_sync:
-      self._rsync.from_remote('.', self._local_cfg.cwd)
+  def sync_files(self, files: Sequence[str]) -> int:
+    """Uploads just these files (relative to the rxroot)."""
+    return self._rsync.to_remote(files=files)
+
+  def pull_changes(self) -> int:
+    """Downloads what changed on the worker, keeping newer local files."""
+    return self._rsync.from_remote('.', self._local_cfg.cwd, keep_local=True)
+
+  def _init_container(self):
+    """Gets the container downloaded/running."""
+    req = rx_pb2.GenericRequest(workspace_id=self._remote_cfg.workspace_id)
+    resp = self._stub.Init(req, metadata=self.metadata)
+    def get_progress(
+        resp: Iterable[rx_pb2.WorkerInitResponse]
+    ) -> Generator[rx_pb2.DockerImageProgress, None, None]:
+      for r in resp:
+        if r.result.code != rx_pb2.OK:
+          raise WorkerError(result=r.result)
+        if r.pull_progress:
+          yield r.pull_progress
+    result = progress_bar.show_progress_bars(get_progress(resp))
+    if result and result.code != rx_pb2.OK:
+      if result.code == rx_pb2.MOVED:
+        raise WorkspaceRelocationError()
+      raise WorkerError(
+        f'Error initializing worker {self._remote_cfg.worker_addr}', result)
+
+  def _get_deps_files(self) -> List[str]:
+    """Returns the local dependency files, or [] if they can't be listed."""
+    try:
+      files = local_fs.get_manifest(self._local_cfg)
+    except local_fs.ManifestError as e:
+      logging.warning('Could not list files to find dependencies: %s', e)
+      return []
+    return lang_detector.get_deps_files(manifest.Manifest(files))
 
 
 def create_authed_client(ch: grpc.Channel, local_cfg: local.LocalConfig):
   lm = login.LoginManager(local_cfg.cwd)
-  lm.login()
+  with trace.span('login'):
+    lm.login()
   return Client(ch, local_cfg, lm)
 
 
+class PortForwardCall:
+  """A PortForward call that has been started."""
+
+  def __init__(self, port: int, call: Any) -> None:
+    self._port = port
+    self._call = call
+
+  @property
+  def is_active(self) -> bool:
+    return not self._call.done()
+
+  def cancel(self):
+    self._call.cancel()
+
+  def responses(self) -> Iterator[bytes]:
+    """Yields response frames, then b'' once the worker is done."""
+    try:
+      for resp in self._call:
+        if resp.HasField('result') and resp.result.code != 0:
+          raise WorkerError(result=resp.result)
+        yield resp.frame
+    except grpc.RpcError as e:
+      raise _forwarding_error(self._port, cast(grpc.Call, e))
+    # Signal end of response.
+    yield b''
+
+
+def _forwarding_error(port: int, e: grpc.Call) -> RuntimeError:
+  if e.code() == grpc.StatusCode.UNAVAILABLE:
+    return DisconnectionError()
+  if e.code() == grpc.StatusCode.UNIMPLEMENTED:
+    return UnimplementedError(e.details())
+  return WorkerError(f'Error forwarding to {port}: {e.details()}')
+
+
 def is_subdir(*, parent: str, child: str) -> bool:
   return os.path.commonpath([parent]) == os.path.commonpath([parent, child])
 
@@ -222,41 +379,76 @@ class WorkerError(RuntimeError):
     super().__init__(full_message)
     self.code = result.code if result is not None else -1
 
-T = TypeVar('T')
+class _Uploader:
+  """Uploads sources in the background, dependency files first.
+
+  If files is None, rsync finds what to upload itself.
+  """
 
-# TODO: use semaphores.
-class ShowLongRunningProgress:
   def __init__(
-      self, title: str, secs: int = 1, message: str = '.'
-  ):
-    self._title = title
-    self._sleep_secs = secs
-    self._message = message
-    self._still_running = True
-
-  def run(self, func: Callable[[], T]) -> T:
-    th = threading.Thread(target=self._message_printer, daemon=True)
-    th.start()
-    retval = func()
-    self._still_running = False
-    return retval
-
-  def _message_printer(self):
-    first = True
-    time.sleep(self._sleep_secs)
-    while self._still_running:
-      if first:
-        sys.stdout.write(self._title)
-        first = False
-      sys.stdout.write(self._message)
-      sys.stdout.flush()
-      time.sleep(self._sleep_secs)
+      self,
+      rsync_client: rsync.RsyncClient,
+      deps_files: Sequence[str],
+      files: Optional[Sequence[str]] = None,
+  ) -> None:
+    self._rsync = rsync_client
+    self._deps_files = deps_files
+    self._files = files
+    # rsync's exit codes, or None if it didn't finish.
+    self._deps_result: Optional[int] = None
+    self._result: Optional[int] = None
+    self._deps_done = threading.Event()
+    self._thread = threading.Thread(target=self._run, daemon=True)
+
+  def start(self):
+    self._thread.start()
+
+  def wait_for_deps(self):
+    """Waits for the dependency files to be uploaded."""
+    self._deps_done.wait()
+    _check_rsync_result(self._deps_result)
+
+  def wait(self):
+    """Waits for everything to be uploaded."""
+    self._thread.join()
+    _check_rsync_result(self._result)
+
+  def _run(self):
+    try:
+      if self._deps_files:
+        with trace.span('init.upload_deps'):
+          self._deps_result = self._rsync.to_remote(files=self._deps_files)
+      else:
+        self._deps_result = 0
+    except Exception:  # pylint: disable=broad-except
+      logging.exception('Error uploading dependency files')
+    finally:
+      self._deps_done.set()
+    progress_bar.write('Uploading sources...')
+    try:
+      with trace.span('init.upload'):
+        self._result = self._rsync.to_remote(files=self._files)
+    except Exception:  # pylint: disable=broad-except
+      logging.exception('Error uploading sources')
+      return
+    if self._result == 0:
+      progress_bar.write('Uploaded sources.')
+
+
+def _check_rsync_result(result: Optional[int]):
+  if result != 0:
+    logging.info('rsync failed: %s', result)
+    raise RsyncError()
 
 
 class DisconnectionError(RuntimeError):
   pass
 
 
+class UnimplementedError(RuntimeError):
+  """The worker is running a version that doesn't support this RPC."""
+
+
 class RsyncError(WorkerError):
   def __init__(self, *args: object):
     super().__init__('rsync unreachable', None, *args)
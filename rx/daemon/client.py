@@ -1,7 +1,7 @@
 """rx command daemon client."""
 import os
 import signal
-from typing import Dict, Optional, cast
+from typing import Callable, Dict, List, Optional, Tuple, cast
 
 import grpc
 from google.protobuf import empty_pb2
@@ -11,16 +11,31 @@ from rx.daemon import pidfile
 from rx.proto import daemon_pb2
 from rx.proto import daemon_pb2_grpc
 from rx.proto import rx_pb2
+from rx.shared import metrics
 
 
 class Client:
   """Handle contacting the local daemon."""
 
-  def __init__(self, channel: grpc.Channel, local_cfg: local.LocalConfig):
+  def __init__(
+      self,
+      channel: grpc.Channel,
+      local_cfg: local.LocalConfig,
+      check_pid: bool = True):
+    """Creates a client.
+
+    Over TCP, check_pid makes sure the daemon on the port is this user's. It
+    isn't needed on the user's Unix socket.
+    """
     self._local_cfg = local_cfg
     self._stub = daemon_pb2_grpc.PortForwardingServiceStub(channel)
-    self._pidfile = pidfile.PidFile(local_cfg.cwd)
-    self._metadata = (('cv', local.VERSION), ('pid', f'{self._pidfile.pid}'))
+    self._deps_stub = daemon_pb2_grpc.DepsServiceStub(channel)
+    self._pidfile = pidfile.PidFile()
+    # The daemon serves every rxroot, so tell it which one this is for.
+    self._metadata: Tuple[Tuple[str, str], ...] = (
+      ('cv', local.VERSION), ('rxroot', str(local_cfg.cwd)))
+    if check_pid:
+      self._metadata += (('pid', f'{self._pidfile.pid}'),)
 
   def close_port(self, port: int):
     req = daemon_pb2.OpenPortRequest(port=port)
@@ -32,12 +47,71 @@ class Client:
     if resp.result.code != 0:
       raise PortError(resp.result.message)
 
-  def info(self) -> Dict[int, int]:
+  def get_ports(self) -> daemon_pb2.GetPortsResponse:
+    """Returns forwarded ports along with their buffer stats."""
     try:
       resp: daemon_pb2.GetPortsResponse = self._stub.GetPorts(
         empty_pb2.Empty(), metadata=self._metadata)
     except grpc.RpcError as e:
       handle_rpc_error(cast(grpc.Call, e))
+    return resp
+
+  def get_metrics(self) -> List[metrics.Sample]:
+    """Returns everything the daemon has recorded."""
+    try:
+      resp: daemon_pb2.GetMetricsResponse = self._stub.GetMetrics(
+        empty_pb2.Empty(), metadata=self._metadata)
+    except grpc.RpcError as e:
+      handle_rpc_error(cast(grpc.Call, e))
+    kinds = {v: k for k, v in METRIC_KINDS.items()}
+    return [
+      metrics.Sample(
+        name=m.name,
+        kind=kinds[m.kind],
+        labels=dict(m.labels),
+        value=m.value,
+        count=m.count,
+        sum=m.sum,
+        min=m.min,
+        max=m.max,
+        percentiles=dict(sorted(m.percentiles.items())),
+      ) for m in resp.metrics
+    ]
+
+  def watch_deps(self, install: bool = False):
+    """Has the daemon reinstall dependencies when their files change.
+
+    If install is set, it starts installing them right away.
+    """
+    req = daemon_pb2.WatchDepsRequest(install=install)
+    try:
+      resp: rx_pb2.GenericResponse = self._deps_stub.WatchDeps(
+        req, metadata=self._metadata)
+    except grpc.RpcError as e:
+      handle_rpc_error(cast(grpc.Call, e))
+    if resp.result.code != 0:
+      raise DaemonUnavailable(resp.result.message)
+
+  def wait_for_deps(
+      self,
+      on_wait: Optional[Callable[[daemon_pb2.DepsStatus], None]] = None,
+  ) -> daemon_pb2.DepsStatus:
+    """Returns once no dependency install is running.
+
+    If one is, on_wait is called with its status before waiting.
+    """
+    status = daemon_pb2.DepsStatus()
+    try:
+      for status in self._deps_stub.WaitForDeps(
+          empty_pb2.Empty(), metadata=self._metadata):
+        if status.state == daemon_pb2.DepsStatus.INSTALLING and on_wait:
+          on_wait(status)
+    except grpc.RpcError as e:
+      handle_rpc_error(cast(grpc.Call, e))
+    return status
+
+  def info(self) -> Dict[int, int]:
+    resp = self.get_ports()
     result = {}
     for p in resp.ports:
       if p.local_port != 0:
@@ -46,8 +120,12 @@ class Client:
         result[p.port] = p.port
     return result
 
-  def open_port(self, port: int, local_port: Optional[int] = None):
-    req = daemon_pb2.OpenPortRequest(port=port)
+  def open_port(
+      self,
+      port: int,
+      local_port: Optional[int] = None,
+      http_cache: bool = False):
+    req = daemon_pb2.OpenPortRequest(port=port, http_cache=http_cache)
     if local_port:
       req.local_port = local_port
     try:
@@ -59,7 +137,7 @@ class Client:
       raise PortError(resp.result.message)
 
   def is_running(self) -> bool:
-    if not self._local_cfg.get_daemon_pid_file().exists():
+    if not local.get_daemon_pid_file().exists():
       return False
     try:
       self.info()
@@ -68,6 +146,13 @@ class Client:
     return True
 
 
+METRIC_KINDS = {
+  metrics.COUNTER: daemon_pb2.Metric.COUNTER,
+  metrics.GAUGE: daemon_pb2.Metric.GAUGE,
+  metrics.HISTOGRAM: daemon_pb2.Metric.HISTOGRAM,
+}
+
+
 def handle_rpc_error(e: grpc.Call):
   if e.code() == grpc.StatusCode.FAILED_PRECONDITION:
     # Kill daemon.
@@ -21,9 +21,9 @@ class Daemonizer:
   This does a fork-detach-fork, closes all stdio, prevents core dumps, and
   manages the PID file."""
 
-  def __init__(self, rxroot: pathlib.Path):
-    self._rxroot = rxroot
-    self._pidfile = pidfile.PidFile(rxroot)
+  def __init__(self, daemon_dir: pathlib.Path):
+    self._daemon_dir = daemon_dir
+    self._pidfile = pidfile.PidFile()
 
   def __enter__(self) -> 'Daemonizer':
     self.daemonize()
@@ -38,8 +38,9 @@ class Daemonizer:
     return False
 
   def daemonize(self):
-    # Make sure we're in rxroot
-    os.chdir(self._rxroot)
+    # The daemon serves every rxroot, so it runs in its own directory.
+    self._daemon_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+    os.chdir(self._daemon_dir)
     self.prevent_core_dump()
 
     _fork(1)
@@ -0,0 +1,344 @@
+"""Reinstalls workspaces' dependencies in the background when they change.
+
+Editing requirements.txt or package.json shouldn't mean the next `rx` command
+runs against stale dependencies, or sits through a multi-minute install. The
+daemon watches the dependency files lang_detector knows about and, when they
+change, uploads just those files and runs InstallDeps, appending its output to
+.rx/<trex-host>/deps.log. `rx <cmd>` only waits if an install is still going.
+The fingerprint of the last install is saved next to it, so edits made while
+the daemon wasn't running are installed once it starts watching again.
+
+`rx init` hands its install off to the daemon the same way, so it can return as
+soon as the sources are uploaded and the container is up.
+"""
+import os
+import pathlib
+import threading
+import time
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from absl import flags
+from absl import logging
+import grpc
+from google.protobuf import empty_pb2
+
+from rx.client import worker_client
+from rx.client.configuration import config_base
+from rx.client.configuration import local
+from rx.client.configuration import remote
+from rx.daemon import worker_channel
+from rx.daemon.port_forwarding import service
+from rx.proto import daemon_pb2
+from rx.proto import daemon_pb2_grpc
+from rx.proto import rx_pb2
+from rx.trex.toolchain import lang_detector
+from rx.trex.toolchain import local_fs
+
+_POLL_SECS = flags.DEFINE_float(
+  'deps_poll_secs', 2, 'How often to check dependency files for changes.')
+# Listing the project to find dependency files is much more expensive than
+# stat-ing them, so new ones are only looked for this often.
+_RESCAN_SECS = 300
+
+# (path, mtime, size) of each dependency file.
+_Stats = Tuple[Tuple[str, int, int], ...]
+
+
+def get_log_file(rxroot: pathlib.Path) -> pathlib.Path:
+  """Returns .rx/<trex-host>/deps.log, which .rxignore keeps local."""
+  return config_base.get_config_dir(rxroot).parent / 'deps.log'
+
+
+def get_fingerprint_file(rxroot: pathlib.Path) -> pathlib.Path:
+  """Returns .rx/<trex-host>/deps.fingerprint, the last one installed."""
+  return config_base.get_config_dir(rxroot).parent / 'deps.fingerprint'
+
+
+class DepsWatcher:
+  """Reinstalls one rxroot's dependencies when its dependency files change.
+
+  The first check is the baseline. It only installs if the dependency files
+  changed since the last install this machine knows of.
+  """
+
+  def __init__(
+      self,
+      local_cfg: local.LocalConfig,
+      worker: worker_channel.WorkerChannel) -> None:
+    self._local_cfg = local_cfg
+    self._worker = worker
+    self._log_file = get_log_file(local_cfg.cwd)
+    # Only one check at a time.
+    self._check_lock = threading.Lock()
+    self._paths: List[str] = []
+    self._listed_at: Optional[float] = None
+    self._stats: Optional[_Stats] = None
+    self._fingerprint = ''
+    self._cv = threading.Condition()
+    self._state = daemon_pb2.DepsStatus.IDLE
+    self._result = rx_pb2.Result()
+
+  def check(self) -> bool:
+    """Starts an install if the dependency files changed.
+
+    Returns if one was started. If an install is already running, changes are
+    picked up by the first check after it finishes.
+    """
+    with self._check_lock:
+      with self._cv:
+        if self._state == daemon_pb2.DepsStatus.INSTALLING:
+          return False
+      self._maybe_list_paths()
+      stats = self._stat_paths()
+      if stats == self._stats:
+        return False
+      paths = [p for p, _, _ in stats]
+      fingerprint = lang_detector.fingerprint_files(
+        paths, self._local_cfg.cwd)
+      baseline = self._stats is None
+      if baseline:
+        self._fingerprint = self._load_fingerprint()
+      self._stats = stats
+      if fingerprint == self._fingerprint or (baseline and not paths):
+        # A file was touched but not changed, or there's nothing to install.
+        self._fingerprint = fingerprint
+        return False
+      logging.info('Dependencies changed in %s', self._local_cfg.cwd)
+      # If the daemon wasn't running, the worker may have installed these
+      # already. It skips the install if so.
+      self._start_install(
+        paths, fingerprint, 'dependencies changed, reinstalling')
+      return True
+
+  def install(self) -> bool:
+    """Starts installing the dependencies, whether they changed or not.
+
+    Returns if one was started, i.e., one wasn't already running.
+    """
+    with self._check_lock:
+      with self._cv:
+        if self._state == daemon_pb2.DepsStatus.INSTALLING:
+          return False
+      self._maybe_list_paths()
+      self._stats = self._stat_paths()
+      paths = [p for p, _, _ in self._stats]
+      fingerprint = lang_detector.fingerprint_files(
+        paths, self._local_cfg.cwd)
+      logging.info('Installing dependencies in %s', self._local_cfg.cwd)
+      self._start_install(paths, fingerprint, 'installing dependencies')
+      return True
+
+  def status(self) -> daemon_pb2.DepsStatus:
+    with self._cv:
+      return daemon_pb2.DepsStatus(
+        state=self._state, result=self._result, log_file=str(self._log_file))
+
+  def wait(self) -> daemon_pb2.DepsStatus:
+    """Waits for installs to finish, including for changes made meanwhile."""
+    while True:
+      with self._cv:
+        self._cv.wait_for(
+          lambda: self._state != daemon_pb2.DepsStatus.INSTALLING)
+      if not self.check():
+        return self.status()
+
+  def _maybe_list_paths(self):
+    now = time.monotonic()
+    if self._listed_at is None or now - self._listed_at > _RESCAN_SECS:
+      self._list_paths()
+      self._listed_at = now
+
+  def _list_paths(self):
+    scan = None
+    if self._listed_at is None:
+      # Right after `rx init`, start from its scan rather than walking the
+      # tree again.
+      scan = local_fs.load_scan(self._local_cfg.cwd, _RESCAN_SECS)
+    if scan is None:
+      try:
+        scan = local_fs.scan(self._local_cfg)
+      except local_fs.ManifestError as e:
+        logging.warning(
+          'Could not list files in %s, not watching for new dependency files: '
+          '%s', self._local_cfg.cwd, e)
+        return
+    self._paths = lang_detector.get_deps_files(scan.get_manifest())
+
+  def _stat_paths(self) -> _Stats:
+    stats = []
+    for path in self._paths:
+      try:
+        st = os.stat(self._local_cfg.cwd / path)
+      except FileNotFoundError:
+        continue
+      stats.append((path, st.st_mtime_ns, st.st_size))
+    return tuple(stats)
+
+  def _start_install(self, paths: List[str], fingerprint: str, reason: str):
+    with self._cv:
+      self._state = daemon_pb2.DepsStatus.INSTALLING
+    threading.Thread(
+      target=self._install, args=(paths, fingerprint, reason),
+      daemon=True).start()
+
+  def _install(self, paths: List[str], fingerprint: str, reason: str):
+    result = rx_pb2.Result()
+    try:
+      with self._log_file.open(mode='ab') as log:
+        log.write(f'{time.ctime()}: {reason}\n'.encode())
+        log.flush()
+        result = self._run_install(log, paths, fingerprint)
+        log.write(f'{time.ctime()}: {result.message or "done"}\n'.encode())
+    except OSError as e:
+      logging.exception('Could not write %s', self._log_file)
+      result = rx_pb2.Result(code=rx_pb2.UNKNOWN, message=str(e))
+    if result.code == rx_pb2.OK:
+      self._save_fingerprint(fingerprint)
+    with self._cv:
+      if result.code == rx_pb2.OK:
+        self._fingerprint = fingerprint
+        self._state = daemon_pb2.DepsStatus.IDLE
+      else:
+        self._state = daemon_pb2.DepsStatus.FAILED
+      self._result = result
+      self._cv.notify_all()
+
+  def _load_fingerprint(self) -> str:
+    try:
+      return get_fingerprint_file(self._local_cfg.cwd).read_text().strip()
+    except OSError:
+      return ''
+
+  def _save_fingerprint(self, fingerprint: str):
+    path = get_fingerprint_file(self._local_cfg.cwd)
+    try:
+      path.write_text(f'{fingerprint}\n')
+    except OSError as e:
+      logging.warning('Could not write %s: %s', path, e)
+
+  def _run_install(
+      self, log: BinaryIO, paths: List[str], fingerprint: str,
+  ) -> rx_pb2.Result:
+    try:
+      client = self._worker.get_client()
+      if client.sync_files(paths) != 0:
+        return rx_pb2.Result(
+          code=rx_pb2.UNKNOWN, message='Could not upload dependency files')
+      if (not client.install_deps(log, fingerprint) and
+          client.pull_changes() != 0):
+        return rx_pb2.Result(
+          code=rx_pb2.UNKNOWN,
+          message='Could not download the installed dependencies')
+    except worker_client.WorkerError as e:
+      logging.error('Error installing dependencies: %s', e)
+      return rx_pb2.Result(code=e.code, message=str(e))
+    except (grpc.RpcError, OSError) as e:
+      logging.exception('Error installing dependencies')
+      return rx_pb2.Result(code=rx_pb2.UNKNOWN, message=str(e))
+    return rx_pb2.Result()
+
+
+class DepsService(daemon_pb2_grpc.DepsServiceServicer):
+  """Watches the dependency files of every rxroot that asks it to.
+
+  An rxroot is watched from its WatchDeps (i.e., `rx init`) until its config
+  is deleted. After a restart, the daemon picks rxroots it installed for back
+  up on their next WaitForDeps.
+  """
+
+  def __init__(
+      self, channels: Optional[worker_channel.ChannelPool] = None) -> None:
+    super().__init__()
+    self._channels = (
+      worker_channel.ChannelPool() if channels is None else channels)
+    self._watchers: Dict[pathlib.Path, DepsWatcher] = {}
+    self._workers: Dict[pathlib.Path, worker_channel.WorkerChannel] = {}
+    self._lock = threading.Lock()
+    self._stopped = threading.Event()
+    threading.Thread(target=self._poll, daemon=True).start()
+
+  def close(self):
+    self._stopped.set()
+    with self._lock:
+      workers = list(self._workers.values())
+      self._watchers = {}
+      self._workers = {}
+    for w in workers:
+      w.close()
+
+  def WatchDeps(
+      self, request: daemon_pb2.WatchDepsRequest,
+      context: grpc.ServicerContext,
+  ) -> rx_pb2.GenericResponse:
+    watcher = self._get_watcher(context)
+    if request.install:
+      watcher.install()
+    return rx_pb2.GenericResponse(result=rx_pb2.Result())
+
+  def WaitForDeps(
+      self, request: empty_pb2.Empty, context: grpc.ServicerContext,
+  ) -> Iterator[daemon_pb2.DepsStatus]:
+    del request
+    rxroot = service.get_rxroot(context)
+    with self._lock:
+      watcher = self._watchers.get(rxroot)
+    if watcher is None:
+      if not get_fingerprint_file(rxroot).exists():
+        # Nothing ever asked the daemon to install these.
+        yield daemon_pb2.DepsStatus(log_file=str(get_log_file(rxroot)))
+        return
+      watcher = self._get_watcher(context)
+    watcher.check()
+    status = watcher.status()
+    yield status
+    if status.state == daemon_pb2.DepsStatus.INSTALLING:
+      yield watcher.wait()
+
+  def _get_watcher(self, context: grpc.ServicerContext) -> DepsWatcher:
+    rxroot = service.get_rxroot(context)
+    with self._lock:
+      watcher = self._watchers.get(rxroot)
+      if watcher is not None:
+        return watcher
+      try:
+        local_cfg = local.load_config(rxroot)
+        # Make sure there's a worker to install on.
+        remote.Remote(rxroot)
+      except (config_base.ConfigNotFoundError, local.ConfigError) as e:
+        context.abort(
+          grpc.StatusCode.INVALID_ARGUMENT,
+          f'Could not load the config for {rxroot}: {e}')
+      logging.info('Watching dependencies in %s', rxroot)
+      worker = worker_channel.WorkerChannel(local_cfg, self._channels)
+      watcher = DepsWatcher(local_cfg, worker)
+      self._watchers[rxroot] = watcher
+      self._workers[rxroot] = worker
+    # Take the baseline now, so changes from here on (and since the last
+    # install) are installed.
+    watcher.check()
+    return watcher
+
+  def _poll(self):
+    while not self._stopped.wait(_POLL_SECS.value):
+      self._check_all()
+
+  def _check_all(self):
+    with self._lock:
+      watchers = list(self._watchers.items())
+    for rxroot, w in watchers:
+      if not local.get_local_config_path(rxroot).exists():
+        self._drop(rxroot)
+        continue
+      try:
+        w.check()
+      except Exception:  # pylint: disable=broad-except
+        logging.exception('Error checking dependencies')
+
+  def _drop(self, rxroot: pathlib.Path):
+    """Stops watching rxroot, e.g., once it's deleted."""
+    logging.info('Not watching dependencies in %s anymore', rxroot)
+    with self._lock:
+      self._watchers.pop(rxroot, None)
+      worker = self._workers.pop(rxroot, None)
+    if worker is not None:
+      worker.close()
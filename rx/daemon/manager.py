@@ -1,9 +1,9 @@
 import contextlib
+import os
 import subprocess
 import sys
 import tempfile
-import time
-from typing import Generator, cast
+from typing import Generator, Optional, cast
 
 import grpc
 from google.protobuf import empty_pb2
@@ -13,36 +13,60 @@ from rx.client.configuration import config_base
 from rx.client.configuration import local
 from rx.daemon import client
 from rx.daemon import pidfile
+from rx.daemon import readiness
 from rx.proto import daemon_pb2_grpc
 
+# How long to wait for a new daemon to start serving.
+_START_TIMEOUT_SECS = 10
+
 
 class DaemonManager:
   def __init__(self, local_cfg: local.LocalConfig) -> None:
     self._local_cfg = local_cfg
-    self._pidfile = pidfile.PidFile(self._local_cfg.cwd)
-    self._daemon_addr = f'localhost:{self._local_cfg.daemon_port}'
+    self._pidfile = pidfile.PidFile()
+    self._tcp_addr = f'localhost:{self._local_cfg.daemon_port}'
+
+  @property
+  def tcp_addr(self) -> str:
+    return self._tcp_addr
 
   @property
   def daemon_addr(self) -> str:
-    return self._daemon_addr
+    """The address the CLI talks to the daemon on."""
+    return self._get_unix_addr() or self._tcp_addr
+
+  @property
+  def serves_deps(self) -> bool:
+    """If the daemon can install dependencies for this user.
+
+    It only does on its Unix socket: anyone local can connect over TCP.
+    """
+    return self._get_unix_addr() is not None
 
   @contextlib.contextmanager
   def get_daemon_client(self) -> Generator[client.Client, None, None]:
-    daemon_addr = f'localhost:{self._local_cfg.daemon_port}'
-    ch = grpc_helper.get_channel(daemon_addr)
-    cli = client.Client(ch, self._local_cfg)
+    unix_addr = self._get_unix_addr()
+    ch = grpc_helper.get_channel(unix_addr or self._tcp_addr)
+    # Only this user can connect to the socket, so it must be the right
+    # daemon.
+    cli = client.Client(ch, self._local_cfg, check_pid=unix_addr is None)
     try:
         yield cli
     finally:
         ch.close()
 
+  def _get_unix_addr(self) -> Optional[str]:
+    """Returns the daemon's Unix socket address, if it is listening on one."""
+    if not local.get_daemon_socket_file().exists():
+      return None
+    return local.get_daemon_unix_addr()
+
   def maybe_start_daemon(self) -> bool:
     """Returns if the daemon is running when this returns."""
     if self._pidfile.is_running():
       return True
 
-    pretty_file = self._pidfile.filename.relative_to(self._local_cfg.cwd)
-    print(f'Daemon specified in {pretty_file} isn\'t running.')
+    print(f'Daemon specified in {self._pidfile.filename} isn\'t running.')
 
     # Daemon isn't running, attempt to start.
     # This hangs if we open a GRPC channel before forking, so only check the
@@ -65,43 +89,44 @@ class DaemonManager:
     """Starts the daemon. Returns if successful."""
     port = self._local_cfg.daemon_port
     trex_addr = config_base.TREX_HOST.value
-    # This is a vanilla Popen: the daemon is its grandchild!
-    subprocess.Popen([
-      'rx-daemon',
-      f'--port={port}',
-      f'--trex-host={trex_addr}',
-      f'--rxroot={self._local_cfg.cwd}',
-    ])
-    print(f'Daemon started at localhost:{port}')
-
-    # Now (try to) connect to it to make sure it's running.
-    sys.stdout.write('Checking daemon is running...')
-    sys.stdout.flush()
-    tries = 5
-    with grpc_helper.get_channel(self._daemon_addr) as ch:
-      for _ in range(tries):
-        time.sleep(1)
-        try:
-          cli = client.Client(ch, self._local_cfg)
-          if cli.is_running():
-            sys.stdout.write(' Connected!\n')
-            return True
-        except pidfile.NotFoundError:
-          # The daemon might not have created the pid file yet.
-          pass
-        sys.stdout.write('.')
-        sys.stdout.flush()
+    read_fd, write_fd = os.pipe()
+    try:
+      # This is a vanilla Popen: the daemon is its grandchild! It reports on
+      # the pipe once it's serving. It serves every rxroot, so it isn't
+      # passed this one.
+      subprocess.Popen([
+        'rx-daemon',
+        f'--port={port}',
+        f'--trex-host={trex_addr}',
+        f'--daemon_dir={local.get_daemon_dir()}',
+        f'--ready_fd={write_fd}',
+      ], pass_fds=(write_fd,))
+    finally:
+      # Only the daemon should hold the write end, so we see EOF if it dies.
+      os.close(write_fd)
 
+    sys.stdout.write('Waiting for daemon to start...')
+    sys.stdout.flush()
+    status = readiness.wait(read_fd, _START_TIMEOUT_SECS)
     logfile = f'{tempfile.gettempdir()}/rx-daemon.INFO'
-    print(f'Unable to connect to daemon, check {logfile} for details')
-    return False
+    if status is None:
+      print(
+        f' Timed out after {_START_TIMEOUT_SECS}s, check {logfile} for '
+        'details')
+      return False
+    if not status.ready:
+      print(f' {status.error or "Daemon exited"}, check {logfile} for details')
+      return False
+    print(f' Daemon started at {", ".join(status.addrs)}')
+    return True
 
   def connect_and_kill(self) -> bool:
     """Returns if the daemon is no longer running."""
     try:
       # This connection is made manually, as Client attempts to look up the pid
-      # which we don't have.
-      with grpc_helper.get_channel(self._daemon_addr) as ch:
+      # which we don't have. It uses TCP, since the Unix socket doesn't check
+      # pids.
+      with grpc_helper.get_channel(self._tcp_addr) as ch:
         stub = daemon_pb2_grpc.PortForwardingServiceStub(ch)
         stub.GetPorts(
           empty_pb2.Empty(),
@@ -2,14 +2,14 @@
 import os
 import pathlib
 
-from rx.client.configuration import config_base
+from rx.client.configuration import local
 
 
 class PidFile:
   """Handle pid file management."""
 
-  def __init__(self, rxroot: pathlib.Path) -> None:
-    self._pidfile = config_base.get_config_dir(rxroot) / 'daemon.pid'
+  def __init__(self) -> None:
+    self._pidfile = local.get_daemon_pid_file()
 
   @property
   def filename(self) -> pathlib.Path:
@@ -0,0 +1,173 @@
+"""Bounded buffers for bytes moving through the daemon.
+
+Every byte the daemon holds on to while forwarding is charged to a
+MemoryBudget shared by all connections. Producers block when either their
+connection's buffer or the budget is full, so they stop reading from the
+socket or gRPC stream and TCP/HTTP2 flow control pushes back on the sender.
+"""
+import collections
+import threading
+from typing import Deque, Optional
+
+from rx.shared import metrics
+
+# How often blocked producers check if their buffer was closed.
+_POLL_SECS = 0.1
+
+
+class Traffic:
+  """Counts the bytes forwarded for one local port, in each direction."""
+
+  def __init__(self, local_port: int) -> None:
+    port = str(local_port)
+    self.to_worker = metrics.counter(
+      'port_forward.bytes', port=port, direction='to_worker')
+    self.from_worker = metrics.counter(
+      'port_forward.bytes', port=port, direction='from_worker')
+
+
+class MemoryBudget:
+  """Caps the bytes buffered across every connection in the daemon."""
+
+  def __init__(self, limit: int) -> None:
+    self.limit = limit
+    self._used = 0
+    self._high_water = 0
+    self._cv = threading.Condition()
+
+  @property
+  def used(self) -> int:
+    return self._used
+
+  @property
+  def available(self) -> int:
+    return max(0, self.limit - self._used)
+
+  @property
+  def high_water(self) -> int:
+    return self._high_water
+
+  def acquire(self, size: int, timeout: Optional[float] = None) -> bool:
+    """Blocks until size bytes are available, returns if they were acquired.
+
+    A request larger than the whole budget is allowed through once nothing
+    else is buffered, so a single huge frame can't wedge the daemon.
+    """
+    with self._cv:
+      ok = self._cv.wait_for(
+        lambda: self._used + size <= self.limit or self._used == 0,
+        timeout=timeout)
+      if ok:
+        self._charge(size)
+      return ok
+
+  def charge(self, size: int):
+    """Takes size bytes without waiting, even if that goes over the limit."""
+    with self._cv:
+      self._charge(size)
+
+  def release(self, size: int):
+    with self._cv:
+      self._used -= size
+      self._cv.notify_all()
+
+  def _charge(self, size: int):
+    self._used += size
+    self._high_water = max(self._high_water, self._used)
+
+
+class FrameBuffer:
+  """A FIFO of frames that holds at most `capacity` bytes.
+
+  put() blocks while the buffer (or the daemon's budget) is full, which stops
+  whoever is producing frames from reading more.
+  """
+
+  def __init__(self, capacity: int, budget: MemoryBudget) -> None:
+    self._capacity = capacity
+    self._budget = budget
+    self._frames: Deque[bytes] = collections.deque()
+    self._size = 0
+    self._high_water = 0
+    self._closed = False
+    self._cv = threading.Condition()
+
+  @property
+  def depth(self) -> int:
+    """Number of frames waiting."""
+    return len(self._frames)
+
+  @property
+  def size(self) -> int:
+    """Number of bytes waiting."""
+    return self._size
+
+  @property
+  def high_water(self) -> int:
+    """Most bytes that were ever waiting at once."""
+    return self._high_water
+
+  @property
+  def is_closed(self) -> bool:
+    return self._closed
+
+  def put(self, frame: bytes) -> bool:
+    """Adds a frame, returns False if the buffer was closed."""
+    size = len(frame)
+    with self._cv:
+      self._cv.wait_for(
+        lambda: (
+          self._closed or self._size + size <= self._capacity or
+          not self._frames))
+      if self._closed:
+        return False
+    while not self._budget.acquire(size, timeout=_POLL_SECS):
+      if self._closed:
+        return False
+    with self._cv:
+      if self._closed:
+        self._budget.release(size)
+        return False
+      self._frames.append(frame)
+      self._size += size
+      self._high_water = max(self._high_water, self._size)
+      self._cv.notify_all()
+    return True
+
+  def get(self) -> Optional[bytes]:
+    """Blocks for the next frame, returns None once closed and drained."""
+    with self._cv:
+      self._cv.wait_for(lambda: self._frames or self._closed)
+      if not self._frames:
+        return None
+      frame = self._frames.popleft()
+      self._size -= len(frame)
+      self._cv.notify_all()
+    self._budget.release(len(frame))
+    return frame
+
+  def wait_for_data(self) -> bool:
+    """Blocks until there is a frame or the buffer is closed.
+
+    Returns if there is a frame to get.
+    """
+    with self._cv:
+      self._cv.wait_for(lambda: self._frames or self._closed)
+      return bool(self._frames)
+
+  def close(self):
+    """Stops accepting frames. Frames already in the buffer can still be read."""
+    with self._cv:
+      self._closed = True
+      self._cv.notify_all()
+
+  def clear(self):
+    """Closes the buffer and drops anything still waiting."""
+    with self._cv:
+      self._closed = True
+      dropped = self._size
+      self._frames.clear()
+      self._size = 0
+      self._cv.notify_all()
+    if dropped:
+      self._budget.release(dropped)
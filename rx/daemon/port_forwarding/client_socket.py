@@ -1,13 +1,13 @@
-import queue
 import socket
 import threading
-import time
 from types import TracebackType
-from typing import Generator, Optional, Type
+from typing import Generator, Iterator, Optional, Type
 
 from absl import logging
 
 from rx.client import worker_client
+from rx.daemon.port_forwarding import buffers
+from rx.daemon.port_forwarding import stream_pool
 
 _FRAME_SIZE = 1024
 
@@ -15,16 +15,22 @@ _FRAME_SIZE = 1024
 class Connection:
   """Handles one client connection."""
 
-  def __init__(self, client_sock: socket.socket) -> None:
+  def __init__(
+      self,
+      client_sock: socket.socket,
+      budget: buffers.MemoryBudget,
+      buffer_size: int,
+      traffic: Optional[buffers.Traffic] = None) -> None:
     self._client_sock = client_sock
-
-    self._request_queue = queue.SimpleQueue()
-    self._done_with_requests = threading.Event()
-    self._response_queue = queue.SimpleQueue()
-    self._done_with_responses = threading.Event()
+    self._traffic = traffic
+    # Both directions are bounded: when one fills up we stop reading from the
+    # local socket (requests) or the gRPC stream (responses).
+    self._requests = buffers.FrameBuffer(buffer_size, budget)
+    self._responses = buffers.FrameBuffer(buffer_size, budget)
+    self._client_recv_thread: Optional[threading.Thread] = None
+    self._server_recv_thread: Optional[threading.Thread] = None
 
   def __enter__(self) -> 'Connection':
-    # Start up a thread to forward data to the local socket as it arrives.
     return self
 
   def __exit__(self, exctype: Optional[Type[BaseException]],
@@ -33,86 +39,102 @@ class Connection:
     del exctype
     del excinst
     del exctb
-    self._done_with_requests.set()
-    self._done_with_responses.set()
-    self._client_recv_thread.join()
-    self._server_recv_thread.join()
+    self._requests.clear()
+    self._responses.clear()
+    try:
+      # Unblock recv_from_local if we're bailing out early.
+      self._client_sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+      pass
+    if self._client_recv_thread:
+      self._client_recv_thread.join()
+    if self._server_recv_thread:
+      self._server_recv_thread.join()
     if self._client_sock:
       self._client_sock.close()
 
-  def handle(self, grpc_client: worker_client.Client, remote_port: int):
-    """Handles a client connection."""
-    self._done_with_requests.clear()
-    self._done_with_responses.clear()
-
+  @property
+  def queued_frames(self) -> int:
+    return self._requests.depth + self._responses.depth
+
+  @property
+  def queued_bytes(self) -> int:
+    return self._requests.size + self._responses.size
+
+  @property
+  def high_water(self) -> int:
+    """Most bytes queued in either direction at once."""
+    return max(self._requests.high_water, self._responses.high_water)
+
+  def handle(
+      self,
+      grpc_client: worker_client.Client,
+      remote_port: int,
+      warm_stream: Optional[stream_pool.WarmStream] = None):
+    """Handles a client connection.
+
+    If warm_stream is given, the connection uses it instead of starting a new
+    stream once it has something to send.
+    """
     self._client_recv_thread = threading.Thread(target=self.recv_from_local)
     self._client_recv_thread.start()
     self._server_recv_thread = threading.Thread(target=self.remote_to_local)
     self._server_recv_thread.start()
 
+    responses: Iterator[bytes] = iter(())
+    if warm_stream is not None:
+      responses = warm_stream.bind(self._pull_from_req_queue())
     # Wait for requests to be sent.
-    if self._has_requests():
-      for resp in grpc_client.forward_to_port(
-        remote_port, self._pull_from_req_queue()):
-        if not resp:
-          break
-        self._response_queue.put(resp)
-      self._done_with_responses.set()
-
-      # Wait for responses to be sent.
-      while self._response_queue.qsize() > 0:
-        time.sleep(0)
-    else:
-      self._done_with_requests.set()
-      self._done_with_responses.set()
-
+    elif self._requests.wait_for_data():
+      responses = grpc_client.forward_to_port(
+        remote_port, self._pull_from_req_queue())
+    for resp in responses:
+      if not resp or not self._responses.put(resp):
+        break
+    self._responses.close()
+
+    # Wait for responses to be sent.
     self._server_recv_thread.join()
     self._client_recv_thread.join()
 
-  def _has_requests(self) -> bool:
-    """Blocks until there is either something in the request queue or the
-    connection is closed."""
-    while not self._done_with_requests.is_set():
-      if not self._request_queue.empty():
-        return True
-      time.sleep(0)
-    return not self._request_queue.empty()
-
   def _pull_from_req_queue(self) -> Generator[bytes, None, None]:
     """Yield local requests."""
-    while not self._done_with_requests.is_set():
-      try:
-        yield self._request_queue.get_nowait()
-      except queue.Empty:
-        time.sleep(0)
+    while True:
+      frame = self._requests.get()
+      if frame is None:
+        return
+      yield frame
 
   def recv_from_local(self):
     """Receives bytes from the local sock and puts them in a queue."""
     # Wait for a client to make a request.
     try:
-      while not self._done_with_requests.is_set():
+      while True:
         response = self._client_sock.recv(_FRAME_SIZE)
-        if not response:
+        # put blocks while the request buffer is full.
+        if not response or not self._requests.put(response):
           break
-        self._request_queue.put(response)
+        if self._traffic is not None:
+          self._traffic.to_worker.inc(len(response))
     except ConnectionResetError:
       logging.exception('Connection reset in recv')
     except OSError:
       logging.exception('Error in recv')
     finally:
-      self._done_with_requests.set()
+      self._requests.close()
 
   def remote_to_local(self):
     """Sends bytes from the remote's queue to the local sock."""
-    while (
-        self._response_queue.qsize() > 0 or
-        not self._done_with_responses.is_set()):
-      time.sleep(0)
+    while True:
+      buf = self._responses.get()
+      if buf is None:
+        return
       try:
-        buf = self._response_queue.get(timeout=0)
-      except queue.Empty:
-        continue
-      x = 0
-      while x < len(buf):
-        assert self._client_sock
-        x += self._client_sock.send(buf)
+        self._client_sock.sendall(buf)
+        if self._traffic is not None:
+          self._traffic.from_worker.inc(len(buf))
+      except OSError:
+        logging.exception('Error in send')
+        # Unblock the response stream, nothing is listening anymore.
+        self._responses.clear()
+        return
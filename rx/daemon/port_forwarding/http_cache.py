@@ -0,0 +1,546 @@
+"""HTTP/1.x parsing and a local cache for forwarded ports.
+
+Dev servers and notebooks serve the same bundles, fonts, and images over and
+over. When a port is opened with http_cache, the daemon parses the HTTP going
+through it and keeps cacheable responses locally, following Cache-Control,
+Expires, ETag, and Last-Modified like a browser's (private) cache would.
+"""
+import collections
+import dataclasses
+import email.utils
+import re
+import socket
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+_MAX_LINE = 64 * 1024
+_MAX_HEADERS = 256
+_RECV_SIZE = 64 * 1024
+# Headers that only apply to one connection and are never stored or replayed.
+_HOP_BY_HOP = frozenset([
+  'connection', 'keep-alive', 'proxy-connection', 'te', 'trailer',
+  'transfer-encoding', 'upgrade',
+])
+# Responses that may be cached without explicit permission (RFC 9110 15.1).
+_CACHEABLE_STATUSES = frozenset([200, 203, 204, 300, 301, 308, 404, 410])
+# Headers a 304 may update on the stored response.
+_REFRESHED_HEADERS = frozenset([
+  'cache-control', 'content-location', 'date', 'etag', 'expires', 'vary',
+  'last-modified',
+])
+# Without an explicit lifetime, responses with a Last-Modified are fresh for
+# this fraction of their age (RFC 9111 4.2.2).
+_HEURISTIC_FRACTION = 0.1
+_REQUEST_START = re.compile(rb'^[!#$%&\'*+.^_`|~0-9A-Za-z-]+ ')
+_REQUEST_LINE = re.compile(r'^(\S+) (\S+) (HTTP/1\.[01])$')
+_STATUS_LINE = re.compile(r'^(HTTP/1\.[01]) (\d{3})(?: (.*))?$')
+
+
+class ParseError(RuntimeError):
+  """The bytes on the connection weren't valid HTTP/1.x."""
+
+
+class Reader:
+  """Buffered reads from a socket."""
+
+  def __init__(self, sock: socket.socket) -> None:
+    self._sock = sock
+    self._buf = bytearray()
+    self._eof = False
+
+  @property
+  def buffered(self) -> bytes:
+    return bytes(self._buf)
+
+  def fill(self) -> bool:
+    """Reads more from the socket, returns False at EOF."""
+    if self._eof:
+      return False
+    buf = self._sock.recv(_RECV_SIZE)
+    if not buf:
+      self._eof = True
+      return False
+    self._buf += buf
+    return True
+
+  def read_line(self) -> Optional[str]:
+    """Returns the next line without its line ending, or None at EOF."""
+    while True:
+      idx = self._buf.find(b'\n')
+      if idx >= 0:
+        line = bytes(self._buf[:idx])
+        del self._buf[:idx + 1]
+        return line.rstrip(b'\r').decode('latin-1')
+      if len(self._buf) > _MAX_LINE:
+        raise ParseError('Line too long')
+      if not self.fill():
+        if self._buf:
+          raise ParseError('Connection closed mid-line')
+        return None
+
+  def read(self, size: int) -> bytes:
+    """Returns up to size bytes, or b'' at EOF."""
+    if not self._buf and not self.fill():
+      return b''
+    data = bytes(self._buf[:size])
+    del self._buf[:size]
+    return data
+
+  def take_buffered(self) -> bytes:
+    data = bytes(self._buf)
+    self._buf.clear()
+    return data
+
+
+class Headers:
+  """An ordered, case-insensitive list of header fields."""
+
+  def __init__(self, fields: Optional[List[Tuple[str, str]]] = None) -> None:
+    self.fields: List[Tuple[str, str]] = list(fields or [])
+
+  def get(self, name: str) -> Optional[str]:
+    """Returns all values for name, joined with commas."""
+    values = [v for k, v in self.fields if k.lower() == name.lower()]
+    if not values:
+      return None
+    return ', '.join(values)
+
+  def set(self, name: str, value: str):
+    self.remove(name)
+    self.fields.append((name, value))
+
+  def remove(self, name: str):
+    self.fields = [(k, v) for k, v in self.fields if k.lower() != name.lower()]
+
+  def tokens(self, name: str) -> List[str]:
+    """Returns the comma-separated tokens of a header, lowercased."""
+    value = self.get(name)
+    if value is None:
+      return []
+    return [t.strip().lower() for t in value.split(',') if t.strip()]
+
+  def copy(self) -> 'Headers':
+    return Headers(self.fields)
+
+  def to_bytes(self) -> bytes:
+    return b''.join(
+      f'{k}: {v}\r\n'.encode('latin-1') for k, v in self.fields)
+
+
+@dataclasses.dataclass
+class Request:
+  method: str
+  target: str
+  version: str
+  headers: Headers
+
+  @property
+  def keep_alive(self) -> bool:
+    return _keep_alive(self.version, self.headers)
+
+  def head_bytes(self) -> bytes:
+    return (
+      f'{self.method} {self.target} {self.version}\r\n'.encode('latin-1') +
+      self.headers.to_bytes() + b'\r\n')
+
+
+@dataclasses.dataclass
+class Response:
+  version: str
+  status: int
+  reason: str
+  headers: Headers
+
+  @property
+  def keep_alive(self) -> bool:
+    return _keep_alive(self.version, self.headers)
+
+  def head_bytes(self) -> bytes:
+    return (
+      f'{self.version} {self.status} {self.reason}\r\n'.encode('latin-1') +
+      self.headers.to_bytes() + b'\r\n')
+
+
+@dataclasses.dataclass
+class BodyFraming:
+  """How the end of a message body is found."""
+  length: Optional[int] = None
+  chunked: bool = False
+  # The body continues until the connection closes.
+  until_close: bool = False
+
+
+def looks_like_http(data: bytes) -> bool:
+  """Returns if data could be the start of an HTTP/1.x request."""
+  return bool(_REQUEST_START.match(data)) and not data.startswith(b'PRI * ')
+
+
+def read_request(reader: Reader) -> Optional[Request]:
+  """Reads a request head, returns None if the connection closed first."""
+  line = reader.read_line()
+  # Ignore stray blank lines between requests (RFC 9112 2.2).
+  while line == '':
+    line = reader.read_line()
+  if line is None:
+    return None
+  m = _REQUEST_LINE.match(line)
+  if not m:
+    raise ParseError(f'Bad request line: {line[:100]!r}')
+  return Request(m.group(1), m.group(2), m.group(3), _read_headers(reader))
+
+
+def read_response(reader: Reader) -> Optional[Response]:
+  """Reads a response head, returns None if the connection closed first."""
+  line = reader.read_line()
+  if line is None:
+    return None
+  m = _STATUS_LINE.match(line)
+  if not m:
+    raise ParseError(f'Bad status line: {line[:100]!r}')
+  return Response(
+    m.group(1), int(m.group(2)), m.group(3) or '', _read_headers(reader))
+
+
+def request_framing(req: Request) -> BodyFraming:
+  if 'chunked' in req.headers.tokens('transfer-encoding'):
+    return BodyFraming(chunked=True)
+  return BodyFraming(length=_content_length(req.headers) or 0)
+
+
+def response_framing(method: str, resp: Response) -> BodyFraming:
+  if method == 'HEAD' or resp.status in (204, 304) or resp.status < 200:
+    return BodyFraming(length=0)
+  if 'chunked' in resp.headers.tokens('transfer-encoding'):
+    return BodyFraming(chunked=True)
+  length = _content_length(resp.headers)
+  if length is None:
+    return BodyFraming(until_close=True)
+  return BodyFraming(length=length)
+
+
+def read_body(
+    reader: Reader, framing: BodyFraming) -> Iterator[Tuple[bytes, bytes]]:
+  """Yields (raw bytes as sent, decoded body bytes) until the body ends."""
+  if framing.chunked:
+    yield from _read_chunked(reader)
+    return
+  remaining = framing.length
+  while framing.until_close or remaining:
+    data = reader.read(
+      _RECV_SIZE if remaining is None else min(remaining, _RECV_SIZE))
+    if not data:
+      if framing.until_close:
+        return
+      raise ParseError('Connection closed mid-body')
+    if remaining is not None:
+      remaining -= len(data)
+    yield data, data
+
+
+def _read_chunked(reader: Reader) -> Iterator[Tuple[bytes, bytes]]:
+  while True:
+    line = reader.read_line()
+    if line is None:
+      raise ParseError('Connection closed mid-body')
+    try:
+      size = int(line.split(';', 1)[0].strip(), 16)
+    except ValueError:
+      raise ParseError(f'Bad chunk size: {line[:100]!r}')
+    yield (line + '\r\n').encode('latin-1'), b''
+    if size == 0:
+      break
+    while size:
+      data = reader.read(min(size, _RECV_SIZE))
+      if not data:
+        raise ParseError('Connection closed mid-chunk')
+      size -= len(data)
+      yield data, data
+    if reader.read_line() != '':
+      raise ParseError('Missing chunk terminator')
+    yield b'\r\n', b''
+  # Trailers.
+  while True:
+    line = reader.read_line()
+    if line is None:
+      raise ParseError('Connection closed in trailers')
+    yield (line + '\r\n').encode('latin-1'), b''
+    if not line:
+      return
+
+
+def _read_headers(reader: Reader) -> Headers:
+  fields = []
+  while True:
+    line = reader.read_line()
+    if line is None:
+      raise ParseError('Connection closed in headers')
+    if not line:
+      return Headers(fields)
+    if len(fields) >= _MAX_HEADERS:
+      raise ParseError('Too many headers')
+    name, sep, value = line.partition(':')
+    if not sep or not name or name != name.strip():
+      raise ParseError(f'Bad header: {line[:100]!r}')
+    fields.append((name, value.strip()))
+
+
+def _content_length(headers: Headers) -> Optional[int]:
+  value = headers.get('content-length')
+  if value is None:
+    return None
+  # Repeated identical values are allowed (RFC 9110 8.6).
+  values = {v.strip() for v in value.split(',')}
+  if len(values) != 1 or not next(iter(values)).isdigit():
+    raise ParseError(f'Bad Content-Length: {value!r}')
+  return int(values.pop())
+
+
+def _keep_alive(version: str, headers: Headers) -> bool:
+  connection = headers.tokens('connection')
+  if version == 'HTTP/1.0':
+    return 'keep-alive' in connection
+  return 'close' not in connection
+
+
+def _directives(headers: Headers) -> Dict[str, Optional[str]]:
+  """Parses Cache-Control into {directive: argument}."""
+  result: Dict[str, Optional[str]] = {}
+  for token in headers.tokens('cache-control'):
+    name, sep, arg = token.partition('=')
+    result[name.strip()] = arg.strip().strip('"') if sep else None
+  return result
+
+
+def _seconds(value: Optional[str]) -> Optional[int]:
+  if value is None or not value.isdigit():
+    return None
+  return int(value)
+
+
+def _http_date(value: Optional[str]) -> Optional[float]:
+  if not value:
+    return None
+  try:
+    return email.utils.parsedate_to_datetime(value).timestamp()
+  except (TypeError, ValueError):
+    return None
+
+
+def is_cacheable_request(req: Request) -> bool:
+  """Returns if the cache may answer req."""
+  return (
+    req.method in ('GET', 'HEAD') and
+    'no-store' not in _directives(req.headers) and
+    # Partial content isn't stored, so let these go to the worker.
+    req.headers.get('range') is None)
+
+
+def needs_revalidation(req: Request) -> bool:
+  """Returns if the client asked not to be served a stored response as-is."""
+  directives = _directives(req.headers)
+  return (
+    'no-cache' in directives or
+    _seconds(directives.get('max-age', '')) == 0 or
+    'no-cache' in req.headers.tokens('pragma'))
+
+
+def is_storable(req: Request, resp: Response) -> bool:
+  """Returns if resp to req may be stored (RFC 9111 3)."""
+  if req.method != 'GET' or not is_cacheable_request(req):
+    return False
+  if resp.status not in _CACHEABLE_STATUSES:
+    return False
+  directives = _directives(resp.headers)
+  if 'no-store' in directives or '*' in resp.headers.tokens('vary'):
+    return False
+  if resp.headers.get('set-cookie') is not None:
+    # Don't replay one connection's cookies on another.
+    return False
+  return (
+    'max-age' in directives or
+    resp.headers.get('expires') is not None or
+    resp.headers.get('etag') is not None or
+    resp.headers.get('last-modified') is not None)
+
+
+def _freshness_lifetime(resp: Response, now: float) -> float:
+  directives = _directives(resp.headers)
+  if 'no-cache' in directives:
+    return 0
+  max_age = _seconds(directives.get('max-age'))
+  if max_age is not None:
+    return max_age
+  date = _http_date(resp.headers.get('date')) or now
+  if resp.headers.get('expires') is not None:
+    expires = _http_date(resp.headers.get('expires'))
+    # Invalid dates (e.g., "0") mean already expired.
+    return max(0, expires - date) if expires is not None else 0
+  last_modified = _http_date(resp.headers.get('last-modified'))
+  if last_modified is not None:
+    return max(0, (date - last_modified) * _HEURISTIC_FRACTION)
+  return 0
+
+
+class Entry:
+  """A stored response."""
+
+  def __init__(
+      self, req: Request, resp: Response, body: bytes) -> None:
+    self.response = Response(
+      resp.version, resp.status, resp.reason, _end_to_end(resp.headers))
+    self.body = body
+    self._vary = {
+      name: req.headers.get(name) for name in resp.headers.tokens('vary')}
+    self._update_freshness()
+
+  @property
+  def size(self) -> int:
+    return len(self.body) + len(self.response.head_bytes())
+
+  @property
+  def etag(self) -> Optional[str]:
+    return self.response.headers.get('etag')
+
+  @property
+  def last_modified(self) -> Optional[str]:
+    return self.response.headers.get('last-modified')
+
+  def matches(self, req: Request) -> bool:
+    """Returns if the request headers named by Vary are the same."""
+    return all(req.headers.get(k) == v for k, v in self._vary.items())
+
+  def age(self) -> float:
+    return self._initial_age + time.monotonic() - self._stored_at
+
+  def is_fresh(self) -> bool:
+    return self.age() < self._lifetime
+
+  def refresh(self, not_modified: Response):
+    """Updates the entry from a 304 response."""
+    for name in {k.lower() for k, _ in not_modified.headers.fields}:
+      if name in _REFRESHED_HEADERS:
+        value = not_modified.headers.get(name)
+        assert value is not None
+        self.response.headers.set(name, value)
+    self._update_freshness()
+
+  def _update_freshness(self):
+    self._stored_at = time.monotonic()
+    self._initial_age = _seconds(self.response.headers.get('age')) or 0
+    self._lifetime = _freshness_lifetime(self.response, time.time())
+
+
+def _end_to_end(headers: Headers) -> Headers:
+  hop_by_hop = _HOP_BY_HOP | set(headers.tokens('connection'))
+  return Headers(
+    [(k, v) for k, v in headers.fields if k.lower() not in hop_by_hop])
+
+
+# (workspace, remote port): where a response came from.
+_Origin = Tuple[str, int]
+
+
+class HttpCache:
+  """A size-bounded, least-recently-used store of responses.
+
+  One cache is shared by every rxroot the daemon serves, so entries are keyed
+  by workspace (e.g., the rxroot), remote port and request target. Two
+  workspaces forwarding the same remote port never see each other's responses,
+  but all of them share the byte limit.
+  """
+
+  def __init__(self, limit: int) -> None:
+    self.limit = limit
+    self._entries: collections.OrderedDict[Tuple[str, int, str], Entry] = (
+      collections.OrderedDict())
+    self._size = 0
+    self._hits: Dict[_Origin, int] = collections.Counter()
+    self._misses: Dict[_Origin, int] = collections.Counter()
+    self._revalidations: Dict[_Origin, int] = collections.Counter()
+    self._lock = threading.Lock()
+
+  @property
+  def size(self) -> int:
+    return self._size
+
+  @property
+  def max_entry_size(self) -> int:
+    """Larger bodies are passed through without being stored."""
+    return self.limit // 4
+
+  def lookup(self, workspace: str, port: int, req: Request) -> Optional[Entry]:
+    key = (workspace, port, req.target)
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None or not entry.matches(req):
+        return None
+      self._entries.move_to_end(key)
+      return entry
+
+  def store(
+      self, workspace: str, port: int, req: Request, resp: Response,
+      body: bytes):
+    entry = Entry(req, resp, body)
+    if entry.size > self.max_entry_size:
+      return
+    key = (workspace, port, req.target)
+    with self._lock:
+      self._remove(key)
+      self._entries[key] = entry
+      self._size += entry.size
+      while self._size > self.limit:
+        self._remove(next(iter(self._entries)))
+
+  def invalidate(self, workspace: str, port: int, target: str):
+    with self._lock:
+      self._remove((workspace, port, target))
+
+  def record_hit(self, workspace: str, port: int):
+    self._hits[(workspace, port)] += 1
+
+  def record_miss(self, workspace: str, port: int):
+    self._misses[(workspace, port)] += 1
+
+  def record_revalidation(self, workspace: str, port: int):
+    self._revalidations[(workspace, port)] += 1
+
+  def stats(self, workspace: str, port: int) -> Tuple[int, int, int]:
+    """Returns hits, misses, and revalidations for workspace's port."""
+    origin = (workspace, port)
+    return (
+      self._hits[origin], self._misses[origin], self._revalidations[origin])
+
+  def _remove(self, key: Tuple[str, int, str]):
+    entry = self._entries.pop(key, None)
+    if entry is not None:
+      self._size -= entry.size
+
+
+def cached_response(req: Request, entry: Entry) -> Tuple[Response, bytes]:
+  """Builds the response to send for req from entry."""
+  headers = entry.response.headers.copy()
+  headers.set('Age', str(int(entry.age())))
+  etag = entry.etag
+  if etag is not None and _etag_matches(req.headers.get('if-none-match'), etag):
+    headers.remove('content-length')
+    return Response('HTTP/1.1', 304, 'Not Modified', headers), b''
+  headers.set('Content-Length', str(len(entry.body)))
+  body = b'' if req.method == 'HEAD' else entry.body
+  resp = entry.response
+  return Response('HTTP/1.1', resp.status, resp.reason, headers), body
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+  if not if_none_match:
+    return False
+  if if_none_match.strip() == '*':
+    return True
+  # If-None-Match uses weak comparison.
+  return _opaque_tag(etag) in {
+    _opaque_tag(t) for t in if_none_match.split(',')}
+
+
+def _opaque_tag(etag: str) -> str:
+  etag = etag.strip()
+  return etag[2:] if etag.startswith('W/') else etag
@@ -0,0 +1,237 @@
+"""Serves local HTTP connections to a forwarded port, using the HTTP cache.
+
+A Proxy reads requests from the local connection and answers what it can from
+the cache. Everything else goes to the worker over an upstream connection,
+which is forwarded to the remote port like any other connection. Anything
+that isn't plain HTTP/1.x (other protocols, CONNECT, WebSocket upgrades) is
+passed through untouched.
+"""
+import socket
+import threading
+from typing import Callable, Optional
+
+from absl import logging
+
+from rx.daemon.port_forwarding import http_cache
+
+_UNSAFE_METHODS = frozenset(['POST', 'PUT', 'DELETE', 'PATCH'])
+_BAD_GATEWAY = (
+  b'HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+
+
+class Proxy:
+  """Handles one local connection to an http_cache port."""
+
+  def __init__(
+      self,
+      client_sock: socket.socket,
+      workspace: str,
+      remote_port: int,
+      cache: http_cache.HttpCache,
+      connect: Callable[[], Optional[socket.socket]]) -> None:
+    """Creates a proxy.
+
+    Args:
+      client_sock: The accepted local connection.
+      workspace: Which workspace remote_port is on, e.g., its rxroot. Its
+        entries are kept apart from other workspaces'.
+      remote_port: The port on the workspace.
+      cache: Where to look up and store responses.
+      connect: Opens a connection to the remote port, or returns None if the
+        worker can't be reached.
+    """
+    self._client = client_sock
+    self._client_reader = http_cache.Reader(client_sock)
+    self._workspace = workspace
+    self._remote_port = remote_port
+    self._cache = cache
+    self._connect = connect
+    self._upstream: Optional[socket.socket] = None
+    self._upstream_reader: Optional[http_cache.Reader] = None
+
+  def run(self):
+    try:
+      self._serve()
+    except (OSError, http_cache.ParseError) as e:
+      logging.info('HTTP connection to port %s ended: %s', self._remote_port, e)
+    finally:
+      self._close_upstream()
+      self._client.close()
+
+  def _serve(self):
+    if not self._client_reader.fill():
+      return
+    if not http_cache.looks_like_http(self._client_reader.buffered):
+      if self._open_upstream():
+        self._splice()
+      return
+    while True:
+      req = http_cache.read_request(self._client_reader)
+      if req is None:
+        return
+      if req.method == 'CONNECT' or req.headers.get('upgrade') is not None:
+        # Hand the connection over to whatever protocol they're switching to.
+        if self._open_upstream():
+          self._send_upstream(req.head_bytes())
+          self._splice()
+        return
+      if not self._handle(req):
+        return
+
+  def _handle(self, req: http_cache.Request) -> bool:
+    """Answers one request, returns if the connection can be reused."""
+    entry = None
+    if http_cache.is_cacheable_request(req):
+      entry = self._cache.lookup(self._workspace, self._remote_port, req)
+    if (entry is not None and entry.is_fresh() and
+        not http_cache.needs_revalidation(req)):
+      self._cache.record_hit(self._workspace, self._remote_port)
+      self._send_cached(req, entry)
+      return req.keep_alive
+
+    upstream_req = req
+    revalidating = (
+      entry is not None and
+      (entry.etag is not None or entry.last_modified is not None) and
+      req.headers.get('if-none-match') is None and
+      req.headers.get('if-modified-since') is None)
+    if revalidating:
+      assert entry is not None
+      upstream_req = http_cache.Request(
+        req.method, req.target, req.version, req.headers.copy())
+      if entry.etag is not None:
+        upstream_req.headers.set('If-None-Match', entry.etag)
+      if entry.last_modified is not None:
+        upstream_req.headers.set('If-Modified-Since', entry.last_modified)
+
+    resp = self._exchange(upstream_req)
+    if resp is None:
+      self._client.sendall(_BAD_GATEWAY)
+      return False
+    framing = http_cache.response_framing(req.method, resp)
+    upstream_ok = resp.keep_alive and not framing.until_close
+
+    if revalidating and resp.status == 304:
+      assert entry is not None
+      self._cache.record_revalidation(self._workspace, self._remote_port)
+      entry.refresh(resp)
+      if not upstream_ok:
+        self._close_upstream()
+      self._send_cached(req, entry)
+      return req.keep_alive
+
+    if http_cache.is_cacheable_request(req):
+      self._cache.record_miss(self._workspace, self._remote_port)
+    if resp.status == 101:
+      self._client.sendall(resp.head_bytes())
+      self._splice()
+      return False
+    self._relay_response(req, resp, framing)
+    if req.method in _UNSAFE_METHODS and resp.status < 400:
+      self._cache.invalidate(self._workspace, self._remote_port, req.target)
+    if not upstream_ok:
+      self._close_upstream()
+      return False
+    return req.keep_alive
+
+  def _exchange(
+      self, req: http_cache.Request) -> Optional[http_cache.Response]:
+    """Sends req upstream, returns the final response's head."""
+    reused = self._upstream is not None
+    if not self._open_upstream():
+      return None
+    self._send_upstream(req.head_bytes())
+    for raw, _ in http_cache.read_body(
+        self._client_reader, http_cache.request_framing(req)):
+      self._send_upstream(raw)
+    while True:
+      assert self._upstream_reader is not None
+      resp = http_cache.read_response(self._upstream_reader)
+      if resp is None:
+        self._close_upstream()
+        if reused and req.method in ('GET', 'HEAD'):
+          # The worker's side closed the idle connection, try a fresh one.
+          return self._exchange(req)
+        return None
+      if resp.status >= 200 or resp.status == 101:
+        return resp
+      # Pass along interim responses (e.g., 100 Continue).
+      self._client.sendall(resp.head_bytes())
+
+  def _relay_response(
+      self,
+      req: http_cache.Request,
+      resp: http_cache.Response,
+      framing: http_cache.BodyFraming):
+    """Sends resp to the client, storing it if possible."""
+    assert self._upstream_reader is not None
+    self._client.sendall(resp.head_bytes())
+    store = http_cache.is_storable(req, resp)
+    body = []
+    size = 0
+    for raw, data in http_cache.read_body(self._upstream_reader, framing):
+      self._client.sendall(raw)
+      if store:
+        body.append(data)
+        size += len(data)
+        store = size <= self._cache.max_entry_size
+    if store:
+      self._cache.store(
+        self._workspace, self._remote_port, req, resp, b''.join(body))
+
+  def _send_cached(self, req: http_cache.Request, entry: http_cache.Entry):
+    resp, body = http_cache.cached_response(req, entry)
+    if not req.keep_alive:
+      resp.headers.set('Connection', 'close')
+    self._client.sendall(resp.head_bytes() + body)
+
+  def _open_upstream(self) -> bool:
+    if self._upstream is None:
+      sock = self._connect()
+      if sock is None:
+        return False
+      self._upstream = sock
+      self._upstream_reader = http_cache.Reader(sock)
+    return True
+
+  def _send_upstream(self, data: bytes):
+    assert self._upstream is not None
+    self._upstream.sendall(data)
+
+  def _close_upstream(self):
+    if self._upstream is not None:
+      self._upstream.close()
+    self._upstream = None
+    self._upstream_reader = None
+
+  def _splice(self):
+    """Copies raw bytes both ways until both sides are done."""
+    assert self._upstream is not None and self._upstream_reader is not None
+    upstream = self._upstream
+    pending = self._upstream_reader.take_buffered()
+    th = threading.Thread(
+      target=_copy,
+      args=(self._client, upstream, self._client_reader.take_buffered()),
+      daemon=True)
+    th.start()
+    _copy(upstream, self._client, pending)
+    th.join()
+
+
+def _copy(src: socket.socket, dst: socket.socket, pending: bytes):
+  try:
+    if pending:
+      dst.sendall(pending)
+    while True:
+      buf = src.recv(64 * 1024)
+      if not buf:
+        break
+      dst.sendall(buf)
+    dst.shutdown(socket.SHUT_WR)
+  except OSError:
+    # Unblock the other direction too.
+    for sock in (src, dst):
+      try:
+        sock.shutdown(socket.SHUT_RDWR)
+      except OSError:
+        pass
@@ -0,0 +1,128 @@
+"""Bounds how many connections the daemon forwards at once.
+
+Without a cap, a burst of connections (say, a page fetching 60 assets) means a
+burst of threads and sockets. Instead, forwarders take a slot for each
+connection they accept, before forwarding it. When every slot is in use, a
+forwarder holds the connection it just accepted until one frees up, and its
+next connections wait in the listen backlog. Idle ports don't hold a slot.
+Work that needs a thread of its own runs on one pool shared by every port.
+"""
+import queue
+import threading
+from typing import Any, Callable, Optional, Tuple
+
+from absl import flags
+from absl import logging
+
+_MAX_CONNECTIONS = flags.DEFINE_integer(
+  'max_connections', 256,
+  'Most local connections the daemon forwards at once, across all ports. '
+  'Others wait to be accepted.')
+_ACCEPT_BACKLOG = flags.DEFINE_integer(
+  'accept_backlog', 128,
+  'Connections each forwarded port queues (unaccepted) when the daemon is at '
+  '--max_connections.')
+
+
+def accept_backlog() -> int:
+  return _ACCEPT_BACKLOG.value
+
+
+class Slot:
+  """Permission to forward one connection. Release it when it's done."""
+
+  def __init__(self, limits: 'ConnectionLimits') -> None:
+    self._limits = limits
+    self._released = False
+    self._lock = threading.Lock()
+
+  def release(self):
+    """Gives the slot back. Safe to call more than once."""
+    with self._lock:
+      if self._released:
+        return
+      self._released = True
+    self._limits._release()
+
+
+class ConnectionLimits:
+  """Connection slots and the thread pool for forwarding them."""
+
+  def __init__(self, max_connections: Optional[int] = None) -> None:
+    self.limit = (
+      _MAX_CONNECTIONS.value if max_connections is None else max_connections)
+    self._active = 0
+    # How many times a forwarder had to wait for a slot.
+    self._saturated = 0
+    self._cv = threading.Condition()
+    # An HTTP proxy's upstream connection is handled on the pool too, so each
+    # slot may need two threads.
+    self._pool = _ThreadPool(2 * self.limit)
+
+  @property
+  def active(self) -> int:
+    return self._active
+
+  @property
+  def saturated(self) -> int:
+    return self._saturated
+
+  def acquire(self, timeout: Optional[float] = None) -> Optional[Slot]:
+    """Waits up to timeout secs for a slot, returns None if none freed up."""
+    with self._cv:
+      if self._active >= self.limit:
+        self._saturated += 1
+        logging.info(
+          'All %s connection slots in use, waiting to accept more', self.limit)
+      if not self._cv.wait_for(lambda: self._active < self.limit, timeout):
+        return None
+      self._active += 1
+    return Slot(self)
+
+  def submit(self, fn: Callable[..., Any], *args: Any):
+    """Runs fn on the shared pool."""
+    self._pool.submit(fn, args)
+
+  def _release(self):
+    with self._cv:
+      self._active -= 1
+      self._cv.notify()
+
+
+class _ThreadPool:
+  """Reuses threads, starting new ones (up to a max) only when all are busy.
+
+  Unlike concurrent.futures, the threads are daemon threads: a connection that
+  is stuck in recv shouldn't keep the daemon from exiting.
+  """
+
+  def __init__(self, max_threads: int) -> None:
+    self._max_threads = max_threads
+    self._tasks: queue.SimpleQueue = queue.SimpleQueue()
+    self._threads = 0
+    # Idle threads minus tasks waiting for one (negative when all threads are
+    # busy and work is queued).
+    self._idle = 0
+    self._lock = threading.Lock()
+
+  def submit(self, fn: Callable[..., Any], args: Tuple[Any, ...]):
+    with self._lock:
+      start_thread = self._idle == 0 and self._threads < self._max_threads
+      if start_thread:
+        self._threads += 1
+      else:
+        self._idle -= 1
+    self._tasks.put((fn, args))
+    if start_thread:
+      threading.Thread(target=self._work, daemon=True).start()
+
+  def _work(self):
+    while True:
+      fn, args = self._tasks.get()
+      try:
+        fn(*args)
+      except Exception:  # pylint: disable=broad-except
+        # Otherwise this would be swallowed.
+        logging.exception('Error forwarding connection')
+      with self._lock:
+        self._idle += 1
@@ -0,0 +1,397 @@
+"""Multiplexes every connection to a forwarded port over one stream.
+
+Opening a PortForward stream per connection means paying stream setup and auth
+for every asset a browser fetches. Instead, a Tunnel keeps a single
+PortForwardMux stream open and frames each local connection's bytes with a
+connection ID.
+
+Each direction of each connection is flow controlled: a side may only send as
+many DATA bytes as the other side has granted it (starting at
+_INITIAL_WINDOW), and grants more with WINDOW_UPDATE once it has written the
+bytes out. This keeps one slow local client from stalling the whole stream.
+"""
+import collections
+import itertools
+import queue
+import selectors
+import socket
+import threading
+from typing import Callable, Deque, Dict, Iterator, Optional
+
+from absl import logging
+
+from rx.client import worker_client
+from rx.daemon.port_forwarding import buffers
+from rx.proto import rx_pb2
+
+# Bytes each side may send on a connection before it gets a WINDOW_UPDATE.
+_INITIAL_WINDOW = 256 * 1024
+_FRAME_SIZE = 32 * 1024
+# How long the io loop waits for events before checking if it should exit.
+_SELECT_TIMEOUT_SECS = 1
+# How long the io loop waits when it is not reading because the daemon's
+# memory budget is used up.
+_THROTTLED_SELECT_TIMEOUT_SECS = 0.05
+
+
+class _SubConnection:
+  """State for one local connection carried by the tunnel."""
+
+  def __init__(
+      self,
+      connection_id: int,
+      sock: socket.socket,
+      on_close: Optional[Callable[[], None]]) -> None:
+    self.id = connection_id
+    self.sock = sock
+    self._on_close = on_close
+    # Bytes we may still send to the worker.
+    self.send_window = _INITIAL_WINDOW
+    # Bytes received from the worker that haven't been written locally yet.
+    self.pending: Deque[bytes] = collections.deque()
+    self.pending_bytes = 0
+    # Bytes written locally that we haven't granted back to the worker yet.
+    self.unacked = 0
+    self.local_eof = False
+    self.remote_eof = False
+    self.shut_down_write = False
+    self.closed = False
+
+  @property
+  def is_finished(self) -> bool:
+    return self.closed or (
+      self.local_eof and self.remote_eof and self.shut_down_write)
+
+  def close_socket(self):
+    self.sock.close()
+    if self._on_close is not None:
+      self._on_close()
+
+
+class Tunnel:
+  """Forwards local connections to one remote port over a single stream."""
+
+  def __init__(
+      self,
+      grpc_client: worker_client.Client,
+      remote_port: int,
+      budget: buffers.MemoryBudget,
+      traffic: Optional[buffers.Traffic] = None):
+    self._client = grpc_client
+    self._remote_port = remote_port
+    self._budget = budget
+    self._traffic = traffic
+    self._requests: queue.SimpleQueue = queue.SimpleQueue()
+    # Frames/bytes from local sockets that haven't been sent to the worker yet.
+    self._outgoing_frames = 0
+    self._outgoing_bytes = 0
+    self._high_water = 0
+    self._throttled = False
+    self._conns: Dict[int, _SubConnection] = {}
+    self._registered: Dict[int, int] = {}
+    self._lock = threading.Lock()
+    self._ids = itertools.count(1)
+    self._selector = selectors.DefaultSelector()
+    self._wake_r, self._wake_w = socket.socketpair()
+    self._wake_r.setblocking(False)
+    self._wake_w.setblocking(False)
+    self._selector.register(self._wake_r, selectors.EVENT_READ)
+    self._closed = threading.Event()
+
+  @property
+  def client(self) -> worker_client.Client:
+    return self._client
+
+  @property
+  def is_closed(self) -> bool:
+    return self._closed.is_set()
+
+  def start(self):
+    """Opens the stream to the worker.
+
+    Raises worker_client.UnimplementedError if the worker can't multiplex.
+    """
+    responses = self._client.forward_mux(
+      self._remote_port, self._get_requests())
+    threading.Thread(
+      target=self._recv_from_remote, args=(responses,), daemon=True).start()
+    threading.Thread(target=self._io_loop, daemon=True).start()
+
+  def add(
+      self,
+      sock: socket.socket,
+      on_close: Optional[Callable[[], None]] = None):
+    """Starts forwarding a newly accepted local connection.
+
+    on_close is called once the tunnel is done with sock and has closed it.
+    Raises TunnelClosedError (and leaves sock to the caller) if the tunnel has
+    closed.
+    """
+    conn = _SubConnection(next(self._ids), sock, on_close)
+    with self._lock:
+      # Checked under the lock, so the io loop's teardown either sees this
+      # connection or this sees that the tunnel is closed.
+      if self.is_closed:
+        raise TunnelClosedError()
+      sock.setblocking(False)
+      self._conns[conn.id] = conn
+    self._send(conn.id, rx_pb2.OPEN)
+    self._wake()
+
+  def close(self):
+    """Tears down the stream and all connections using it."""
+    with self._lock:
+      if self.is_closed:
+        return
+      self._closed.set()
+    # Ends the request stream.
+    self._requests.put(None)
+    self._wake()
+
+  @property
+  def connection_count(self) -> int:
+    with self._lock:
+      return len(self._conns)
+
+  @property
+  def queued_frames(self) -> int:
+    with self._lock:
+      return (
+        self._outgoing_frames +
+        sum(len(c.pending) for c in self._conns.values()))
+
+  @property
+  def queued_bytes(self) -> int:
+    with self._lock:
+      return (
+        self._outgoing_bytes +
+        sum(c.pending_bytes for c in self._conns.values()))
+
+  @property
+  def high_water(self) -> int:
+    """Most bytes that were ever waiting to be written to one connection."""
+    return self._high_water
+
+  def _get_requests(self) -> Iterator[rx_pb2.PortForwardMuxRequest]:
+    while True:
+      req = self._requests.get()
+      if req is None:
+        return
+      self._dequeued(req)
+      yield req
+
+  def _dequeued(self, req: rx_pb2.PortForwardMuxRequest):
+    """Gives back what req was charged when it was queued."""
+    if req.frame:
+      with self._lock:
+        self._outgoing_frames -= 1
+        self._outgoing_bytes -= len(req.frame)
+      self._budget.release(len(req.frame))
+
+  def _drop_requests(self):
+    """Releases frames that will never be sent, once the tunnel is closed.
+
+    Otherwise every torn down tunnel would keep its share of the daemon's
+    memory budget.
+    """
+    while True:
+      try:
+        req = self._requests.get_nowait()
+      except queue.Empty:
+        break
+      if req is not None:
+        self._dequeued(req)
+    # The stream may still be reading requests.
+    self._requests.put(None)
+
+  def _send(
+      self, connection_id: int, signal: int, frame: bytes = b'',
+      window: int = 0):
+    if frame:
+      # The io loop only reads what the budget has room for, so this won't go
+      # (far) over.
+      self._budget.charge(len(frame))
+      with self._lock:
+        self._outgoing_frames += 1
+        self._outgoing_bytes += len(frame)
+    self._requests.put(rx_pb2.PortForwardMuxRequest(
+      connection_id=connection_id, signal=signal, frame=frame, window=window))
+
+  def _wake(self):
+    try:
+      self._wake_w.send(b'\0')
+    except OSError:
+      # Already closed.
+      pass
+
+  def _recv_from_remote(
+      self, responses: Iterator[rx_pb2.PortForwardMuxResponse]):
+    """Dispatches frames from the worker to their connections."""
+    try:
+      for resp in responses:
+        if resp.frame:
+          # Blocking here stops us reading from the stream when the daemon is
+          # buffering too much.
+          self._budget.acquire(len(resp.frame))
+        with self._lock:
+          conn = self._conns.get(resp.connection_id)
+          if conn is None:
+            # Frames can still arrive for a connection we've torn down.
+            self._budget.release(len(resp.frame))
+            continue
+          if resp.signal == rx_pb2.DATA:
+            conn.pending.append(resp.frame)
+            conn.pending_bytes += len(resp.frame)
+            self._high_water = max(self._high_water, conn.pending_bytes)
+          elif resp.signal == rx_pb2.WINDOW_UPDATE:
+            conn.send_window += resp.window
+          elif resp.signal == rx_pb2.HALF_CLOSE:
+            conn.remote_eof = True
+          elif resp.signal == rx_pb2.CLOSE:
+            if resp.result.code != rx_pb2.OK:
+              logging.info(
+                'Connection %s to port %s closed by worker: %s',
+                conn.id, self._remote_port, resp.result.message)
+            conn.closed = True
+        self._wake()
+    except (worker_client.DisconnectionError, worker_client.WorkerError) as e:
+      logging.info('Tunnel to port %s failed: %s', self._remote_port, e)
+    finally:
+      self.close()
+
+  def _io_loop(self):
+    """Moves bytes between local sockets and the stream."""
+    try:
+      while not self.is_closed:
+        self._update_registrations()
+        timeout = (
+          _THROTTLED_SELECT_TIMEOUT_SECS if self._throttled else
+          _SELECT_TIMEOUT_SECS)
+        for key, mask in self._selector.select(timeout=timeout):
+          if key.fileobj is self._wake_r:
+            self._drain_wakeups()
+            continue
+          conn: _SubConnection = key.data
+          if mask & selectors.EVENT_READ:
+            self._local_to_remote(conn)
+          if mask & selectors.EVENT_WRITE:
+            self._remote_to_local(conn)
+    finally:
+      with self._lock:
+        # In case this is exiting on an error, stop add() taking more.
+        self._closed.set()
+        conns = list(self._conns.values())
+        self._conns = {}
+      for conn in conns:
+        self._budget.release(conn.pending_bytes)
+        conn.close_socket()
+      # This thread is the only one sending DATA, so nothing is charged after
+      # this.
+      self._drop_requests()
+      self._selector.close()
+      self._wake_r.close()
+      self._wake_w.close()
+
+  def _update_registrations(self):
+    """Only listen for events that we currently have the window/data for."""
+    can_read = self._budget.available > 0
+    self._throttled = False
+    with self._lock:
+      for conn in list(self._conns.values()):
+        registered = self._registered.get(conn.id, 0)
+        if conn.is_finished:
+          if registered:
+            self._selector.unregister(conn.sock)
+            del self._registered[conn.id]
+          self._budget.release(conn.pending_bytes)
+          conn.close_socket()
+          del self._conns[conn.id]
+          continue
+        events = 0
+        if not conn.local_eof and conn.send_window > 0:
+          if can_read:
+            events |= selectors.EVENT_READ
+          else:
+            self._throttled = True
+        if conn.pending or (conn.remote_eof and not conn.shut_down_write):
+          events |= selectors.EVENT_WRITE
+        if events == registered:
+          continue
+        if not registered:
+          self._selector.register(conn.sock, events, conn)
+        elif not events:
+          self._selector.unregister(conn.sock)
+        else:
+          self._selector.modify(conn.sock, events, conn)
+        self._registered[conn.id] = events
+
+  def _drain_wakeups(self):
+    try:
+      while self._wake_r.recv(1024):
+        pass
+    except BlockingIOError:
+      pass
+
+  def _local_to_remote(self, conn: _SubConnection):
+    try:
+      size = min(_FRAME_SIZE, conn.send_window, self._budget.available)
+      if size <= 0:
+        return
+      buf = conn.sock.recv(size)
+    except BlockingIOError:
+      return
+    except OSError:
+      logging.exception('Error in recv')
+      self._abort(conn)
+      return
+    if not buf:
+      conn.local_eof = True
+      self._send(conn.id, rx_pb2.HALF_CLOSE)
+      return
+    conn.send_window -= len(buf)
+    if self._traffic is not None:
+      self._traffic.to_worker.inc(len(buf))
+    self._send(conn.id, rx_pb2.DATA, frame=buf)
+
+  def _remote_to_local(self, conn: _SubConnection):
+    with self._lock:
+      try:
+        while conn.pending:
+          buf = conn.pending[0]
+          sent = conn.sock.send(buf)
+          if self._traffic is not None:
+            self._traffic.from_worker.inc(sent)
+          conn.unacked += sent
+          conn.pending_bytes -= sent
+          self._budget.release(sent)
+          if sent < len(buf):
+            conn.pending[0] = buf[sent:]
+            break
+          conn.pending.popleft()
+        if not conn.pending and conn.remote_eof and not conn.shut_down_write:
+          conn.sock.shutdown(socket.SHUT_WR)
+          conn.shut_down_write = True
+      except BlockingIOError:
+        pass
+      except OSError:
+        logging.info('Local connection %s went away', conn.id)
+        conn.closed = True
+      unacked = conn.unacked
+      if conn.unacked >= _INITIAL_WINDOW // 2:
+        conn.unacked = 0
+    if conn.closed:
+      self._send(conn.id, rx_pb2.CLOSE)
+    elif unacked and not conn.unacked:
+      self._send(conn.id, rx_pb2.WINDOW_UPDATE, window=unacked)
+
+  def _abort(self, conn: _SubConnection):
+    with self._lock:
+      conn.closed = True
+    self._send(conn.id, rx_pb2.CLOSE)
+
+
+class TunnelClosedError(worker_client.DisconnectionError):
+  """The tunnel's stream has ended and it can't forward new connections.
+
+  Retrying with a new tunnel may work.
+  """
@@ -1,61 +1,141 @@
 """Port forwarding."""
 import errno
-import queue
 import socket
 import threading
-import time
+from typing import Optional, Set
 
+from absl import flags
 from absl import logging
 
-from rx.client import grpc_helper
 from rx.client import worker_client
-from rx.client.configuration import local
-from rx.client.configuration import remote
+from rx.daemon import worker_channel
+from rx.daemon.port_forwarding import buffers
 from rx.daemon.port_forwarding import client_socket
+from rx.daemon.port_forwarding import http_cache
+from rx.daemon.port_forwarding import http_proxy
+from rx.daemon.port_forwarding import limits
+from rx.daemon.port_forwarding import mux
+from rx.daemon.port_forwarding import stream_pool
+from rx.proto import daemon_pb2
 
 _LOCALHOST = '127.0.0.1'
+# How often a forwarder waiting for a connection slot checks if it was stopped.
+_SLOT_POLL_SECS = 1
+
+_MULTIPLEX = flags.DEFINE_bool(
+  'multiplex_ports', True,
+  'Forward all connections to a port over a single stream. Falls back to a '
+  'stream per connection if the worker does not support it.')
+_CONNECTION_BUFFER_BYTES = flags.DEFINE_integer(
+  'connection_buffer_bytes', 1 << 20,
+  'Most bytes to buffer in each direction of a forwarded connection before '
+  'pausing reads.')
 
 
 class PortForwarder:
   """Forwards a port."""
 
-  def __init__(self, local_port: int, remote_port: int) -> None:
+  def __init__(
+      self,
+      local_port: int,
+      remote_port: int,
+      workspace: str,
+      budget: buffers.MemoryBudget,
+      worker: worker_channel.WorkerChannel,
+      connection_limits: limits.ConnectionLimits,
+      cache: Optional[http_cache.HttpCache] = None) -> None:
+    """Creates a forwarder.
+
+    If cache is given, connections are parsed as HTTP and cacheable responses
+    are served from it. workspace (e.g., the rxroot) keeps its entries apart
+    from other workspaces forwarding the same remote port.
+    """
     self.local_port = local_port
     self._remote_port = remote_port
-    self._local_config = local.get_local_config()
-    self._worker_addr = remote.Remote(self._local_config.cwd).worker_addr
+    self._workspace = workspace
+    self._budget = budget
+    self._worker = worker
+    self._limits = connection_limits
+    self._http_cache = cache
+    self._traffic = buffers.Traffic(local_port)
     self._done = False
+    self._multiplex = _MULTIPLEX.value
+    self._tunnel: Optional[mux.Tunnel] = None
+    self._pool: Optional[stream_pool.StreamPool] = None
+    self._connections: Set[client_socket.Connection] = set()
+    self._connections_lock = threading.Lock()
+    self._high_water = 0
     # This is the socket that the server listens on.
     self._server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
-    self._request_queue = queue.SimpleQueue()
-    self._done_with_requests = threading.Event()
-    self._response_queue = queue.SimpleQueue()
-    self._done_with_responses = threading.Event()
-
   def run_forever(self):
     # Basic flow:
-    # * Create client socket to accept a connection
-    # * Write client request to queue
-    # * Send client request to remote machine
-    # * Receive response from remote machine
-    # * Send response to client socket
+    # * Accept a local connection
+    # * Wait for a connection slot
+    # * Hand it to the port's tunnel (or a stream of its own, or the HTTP
+    #   proxy), which moves bytes both ways until either side closes
+    backoff = worker_channel.Backoff()
+    while not self._done:
+      try:
+        client_sock, _ = self._server_sock.accept()
+      except ConnectionAbortedError:
+        logging.info('Connection to port %s aborted', self.local_port)
+        continue
+      except OSError:
+        # stop() closed the server socket.
+        return
+      # Don't forward more than the daemon can handle. Only this port waits
+      # for a slot, its next connections queue in the listen backlog.
+      slot = self._wait_for_slot()
+      if slot is None:
+        client_sock.close()
+        return
+
+      if self._http_cache is not None:
+        self._limits.submit(self._proxy_http, client_sock, slot)
+        continue
+      if not self._forward_with_retries(client_sock, backoff, slot):
+        return
+
+  def _wait_for_slot(self) -> Optional[limits.Slot]:
+    """Waits for a connection slot, returns None if stopped first."""
+    while not self._done:
+      slot = self._limits.acquire(timeout=_SLOT_POLL_SECS)
+      if slot is not None:
+        return slot
+    return None
+
+  def _forward_with_retries(
+      self,
+      client_sock: socket.socket,
+      backoff: worker_channel.Backoff,
+      slot: Optional[limits.Slot] = None,
+  ) -> bool:
+    """Forwards a connection, returns False if the worker can't take it."""
+    # Hold on to the connection while the worker is unreachable, so that
+    # short blips don't drop it.
     while not self._done:
-      # Outer loop repeatedly creates a new worker stub if it dies.
       try:
-        with grpc_helper.get_channel(self._worker_addr) as ch:
-          client = worker_client.create_authed_client(ch, self._local_config)
-          while not self._done:
-            # Inner loop repeatedly waits for client connections, reusing the
-            # worker stub.
-            self.accept_connection(client)
+        self.forward_connection(client_sock, slot)
+        backoff.reset()
+        return True
       except worker_client.DisconnectionError as e:
         logging.info('Disconnected from worker: %s', e)
-        time.sleep(1)
+        # Retry as soon as the channel is READY again, backing off in case
+        # the worker stays down.
+        if self._worker.wait_for_ready(backoff.next_delay()):
+          backoff.reset()
       except worker_client.WorkerError as e:
         # Unknown error, exit.
+        client_sock.close()
+        if slot is not None:
+          slot.release()
         print(e)
-        return
+        return False
+    client_sock.close()
+    if slot is not None:
+      slot.release()
+    return False
 
   def start(self):
     """Start listening on the port and kick off a thread to listen forever."""
@@ -63,35 +143,159 @@ class PortForwarder:
     th = threading.Thread(target=self.run_forever, daemon=True)
     th.start()
 
-  def accept_connection(self, grpc_client: worker_client.Client):
-    try:
-      client_sock, _ = self._server_sock.accept()
-    except ConnectionAbortedError:
-      print('Connection aborted')
-      return
+  def forward_connection(
+      self, client_sock: socket.socket, slot: Optional[limits.Slot] = None):
+    """Starts forwarding an accepted connection to the worker.
+
+    The slot, if given, is released once the connection is closed.
+    """
+    # Get the client for each connection to pick up reconnects and worker
+    # moves.
+    grpc_client = self._worker.get_client()
+    if self._multiplex:
+      try:
+        self._get_tunnel(grpc_client).add(
+          client_sock, on_close=slot.release if slot else None)
+        return
+      except worker_client.UnimplementedError:
+        logging.info(
+          'Worker does not support multiplexing, using a stream per '
+          'connection for port %s', self._remote_port)
+        self._multiplex = False
+      except mux.TunnelClosedError:
+        # Its stream ended since _get_tunnel checked. The retry opens a new
+        # one, the channel itself may be fine.
+        raise
+      except worker_client.DisconnectionError:
+        self._worker.reconnect(grpc_client)
+        raise
 
-    # Run handler on a separate thread so we can immediately start waiting for
+    warm_stream = self._get_pool().get(grpc_client)
+    # Run handler on the pool so we can immediately start waiting for
     # connections again.
-    th = threading.Thread(
-      target=self._handle_request,
-      args=(client_sock, grpc_client,),
-      daemon=True)
-    th.start()
+    self._limits.submit(
+      self._handle_request, client_sock, grpc_client, warm_stream, slot)
 
   def stop(self):
     self._done = True
     self._server_sock.close()
+    self._close_tunnel()
+    if self._pool is not None:
+      self._pool.close()
+
+  @property
+  def is_http_cached(self) -> bool:
+    return self._http_cache is not None
+
+  def get_stats(self) -> daemon_pb2.PortStats:
+    """Returns how many connections are active and how backed up they are."""
+    stats = daemon_pb2.PortStats()
+    with self._connections_lock:
+      for conn in self._connections:
+        stats.active_connections += 1
+        stats.queued_frames += conn.queued_frames
+        stats.queued_bytes += conn.queued_bytes
+        self._high_water = max(self._high_water, conn.high_water)
+    high_water = self._high_water
+    tunnel = self._tunnel
+    if tunnel is not None:
+      stats.active_connections += tunnel.connection_count
+      stats.queued_frames += tunnel.queued_frames
+      stats.queued_bytes += tunnel.queued_bytes
+      high_water = max(high_water, tunnel.high_water)
+    stats.high_water_bytes = high_water
+    if self._http_cache is not None:
+      hits, misses, revalidations = self._http_cache.stats(
+        self._workspace, self._remote_port)
+      stats.cache_hits = hits
+      stats.cache_misses = misses
+      stats.cache_revalidations = revalidations
+    return stats
+
+  def _proxy_http(self, client_sock: socket.socket, slot: limits.Slot):
+    assert self._http_cache is not None
+    proxy = http_proxy.Proxy(
+      client_sock, self._workspace, self._remote_port, self._http_cache,
+      self._open_upstream)
+    try:
+      proxy.run()
+    finally:
+      slot.release()
+
+  def _open_upstream(self) -> Optional[socket.socket]:
+    """Opens a connection to the remote port for the HTTP proxy.
+
+    This is forwarded like any other local connection, so it gets the same
+    multiplexing and reconnects.
+    """
+    sock, forwarded = socket.socketpair()
+    if not self._forward_with_retries(forwarded, worker_channel.Backoff()):
+      sock.close()
+      return None
+    return sock
+
+  def _get_tunnel(self, grpc_client: worker_client.Client) -> mux.Tunnel:
+    """Returns the tunnel to the remote port, (re)opening it if needed."""
+    if self._tunnel is not None and self._tunnel.client is not grpc_client:
+      # The worker channel was replaced.
+      self._close_tunnel()
+    if self._tunnel is None or self._tunnel.is_closed:
+      tunnel = mux.Tunnel(
+        grpc_client, self._remote_port, self._budget, self._traffic)
+      tunnel.start()
+      self._tunnel = tunnel
+    return self._tunnel
+
+  def _get_pool(self) -> stream_pool.StreamPool:
+    """Returns the warm streams for connections that can't use a tunnel."""
+    if self._pool is None:
+      self._pool = stream_pool.StreamPool(self._worker, self._remote_port)
+      self._pool.start()
+    return self._pool
+
+  def _close_tunnel(self):
+    if self._tunnel is not None:
+      self._tunnel.close()
+      self._tunnel = None
 
   def _handle_request(
-      self, client_sock: socket.socket, wc: worker_client.Client):
-    with client_socket.Connection(client_sock) as conn:
+      self,
+      client_sock: socket.socket,
+      wc: worker_client.Client,
+      warm_stream: Optional[stream_pool.WarmStream] = None,
+      slot: Optional[limits.Slot] = None):
+    try:
+      self._forward_legacy(client_sock, wc, warm_stream)
+    finally:
+      if slot is not None:
+        slot.release()
+
+  def _forward_legacy(
+      self,
+      client_sock: socket.socket,
+      wc: worker_client.Client,
+      warm_stream: Optional[stream_pool.WarmStream]):
+    """Forwards a connection over its own PortForward stream."""
+    with client_socket.Connection(
+        client_sock, self._budget, _CONNECTION_BUFFER_BYTES.value,
+        self._traffic) as conn:
+      with self._connections_lock:
+        self._connections.add(conn)
       try:
-        conn.handle(wc, self._remote_port)
+        conn.handle(wc, self._remote_port, warm_stream)
+      except worker_client.DisconnectionError as e:
+        logging.info('Disconnected from worker: %s', e)
+        self._worker.reconnect(wc)
+        return
       except worker_client.WorkerError:
         # If we don't explicitly log the exception, it seems to get swallowed
         # (probably because it's in a separate thread).
         logging.exception('Error forwarding request')
         return
+      finally:
+        with self._connections_lock:
+          self._connections.discard(conn)
+          self._high_water = max(self._high_water, conn.high_water)
 
   def _listen(self):
     try:
@@ -101,7 +305,7 @@ class PortForwarder:
         raise AlreadyBoundError(
           f'Port {self.local_port} is already in use, cannot bind.')
       raise e
-    self._server_sock.listen()
+    self._server_sock.listen(limits.accept_backlog())
     print(f'Listening on {self.local_port}')
 
 class AlreadyBoundError(RuntimeError):
@@ -1,81 +1,274 @@
-from typing import Dict
+import os
+import pathlib
+import threading
+from typing import Dict, List, Optional
 
+from absl import flags
 from absl import logging
 import grpc
 from google.protobuf import empty_pb2
 
+from rx.client.configuration import config_base
 from rx.client.configuration import local
 from rx.client.configuration import remote
 from rx.proto import rx_pb2
 from rx.proto import daemon_pb2
 from rx.proto import daemon_pb2_grpc
+from rx.daemon import client
+from rx.daemon import worker_channel
+from rx.daemon.port_forwarding import buffers
+from rx.daemon.port_forwarding import http_cache
+from rx.daemon.port_forwarding import limits
 from rx.daemon.port_forwarding import port_forwarder
+from rx.shared import metrics
+
+_MAX_BUFFERED_BYTES = flags.DEFINE_integer(
+  'max_buffered_bytes', 64 << 20,
+  'Most bytes the daemon will buffer across all forwarded connections.')
+_HTTP_CACHE_BYTES = flags.DEFINE_integer(
+  'http_cache_bytes', 128 << 20,
+  'Most bytes of responses to keep for ports forwarded with http_cache.')
+
+
+class _Workspace:
+  """The ports forwarded for one rxroot."""
+
+  def __init__(
+      self,
+      local_cfg: local.LocalConfig,
+      channels: worker_channel.ChannelPool) -> None:
+    self.ports: Dict[int, port_forwarder.PortForwarder] = {}
+    # One connection to the worker, shared by every forwarded port.
+    self.worker = worker_channel.WorkerChannel(local_cfg, channels)
+
+  def close(self):
+    for pf in self.ports.values():
+      pf.stop()
+    self.ports = {}
+    self.worker.close()
 
 
 class PortForwardingService(daemon_pb2_grpc.PortForwardingServiceServicer):
+  """Forwards ports for every rxroot the user has.
 
-  def __init__(self, local_cfg: local.LocalConfig) -> None:
+  Each request says which rxroot it is for (in its metadata). An rxroot is
+  added when its first port is opened and dropped when its last is closed.
+  Buffers, the HTTP cache, connection slots, and connections to workers are
+  shared across all of them.
+  """
+
+  def __init__(
+      self, channels: Optional[worker_channel.ChannelPool] = None) -> None:
     super().__init__()
-    self._local_cfg = local_cfg
-    self._remote_cfg = remote.Remote(self._local_cfg.cwd)
-    self._ports: Dict[int, port_forwarder.PortForwarder] = {}
+    self._workspaces: Dict[pathlib.Path, _Workspace] = {}
+    self._lock = threading.Lock()
+    self._budget = buffers.MemoryBudget(_MAX_BUFFERED_BYTES.value)
+    self._http_cache = http_cache.HttpCache(_HTTP_CACHE_BYTES.value)
+    self._limits = limits.ConnectionLimits()
+    self._channels = (
+      worker_channel.ChannelPool() if channels is None else channels)
+    metrics.REGISTRY.add_collector(self._collect_metrics)
 
   def close_ports(self):
     """Clean up sockets on close."""
-    for pf in self._ports.values():
-      pf.stop()
-    self._ports = {}
+    metrics.REGISTRY.remove_collector(self._collect_metrics)
+    with self._lock:
+      workspaces = list(self._workspaces.values())
+      self._workspaces = {}
+    for ws in workspaces:
+      ws.close()
+
+  def GetMetrics(
+      self, request: empty_pb2.Empty, context: grpc.ServicerContext,
+  ) -> daemon_pb2.GetMetricsResponse:
+    del request
+    del context
+    response = daemon_pb2.GetMetricsResponse(result=rx_pb2.Result())
+    for sample in metrics.REGISTRY.snapshot():
+      response.metrics.append(_metric_to_pb(sample))
+    return response
 
   def GetPorts(
       self, request: empty_pb2.Empty, context: grpc.ServicerContext,
   ) -> daemon_pb2.GetPortsResponse:
     del request
-    del context
-    response = daemon_pb2.GetPortsResponse(result=rx_pb2.Result())
-    for p, pf in self._ports.items():
-      port = response.ports.add()
-      port.port = p
-      if pf.local_port != p:
-        port.local_port = pf.local_port
+    response = daemon_pb2.GetPortsResponse(
+      result=rx_pb2.Result(),
+      buffers=daemon_pb2.BufferStats(
+        buffered_bytes=self._budget.used,
+        high_water_bytes=self._budget.high_water,
+        limit_bytes=self._budget.limit,
+        http_cache_bytes=self._http_cache.size,
+        http_cache_limit_bytes=self._http_cache.limit,
+      ),
+      connections=daemon_pb2.ConnectionStats(
+        active=self._limits.active,
+        limit=self._limits.limit,
+        saturated=self._limits.saturated,
+      ),
+    )
+    with self._lock:
+      response.workspaces = len(self._workspaces)
+      ws = self._workspaces.get(get_rxroot(context))
+      if ws is None:
+        return response
+      for p, pf in ws.ports.items():
+        port = response.ports.add()
+        port.port = p
+        if pf.local_port != p:
+          port.local_port = pf.local_port
+        port.stats.CopyFrom(pf.get_stats())
+        port.http_cache = pf.is_http_cached
     return response
 
   def OpenPort(
       self, request: daemon_pb2.OpenPortRequest, context: grpc.ServicerContext,
   ) -> rx_pb2.GenericResponse:
-    del context
+    rxroot = get_rxroot(context)
     local_port = request.local_port if request.local_port else request.port
-    if local_port in self._ports:
-      return rx_pb2.GenericResponse(
-        result=rx_pb2.Result(
-          code=rx_pb2.EADDRINUSE,
-          message=f'Already forwarding port {local_port}',
+    with self._lock:
+      ws = self._workspaces.get(rxroot)
+      if ws is not None and local_port in ws.ports:
+        return rx_pb2.GenericResponse(
+          result=rx_pb2.Result(
+            code=rx_pb2.EADDRINUSE,
+            message=f'Already forwarding port {local_port}',
+          )
         )
-      )
-    pf = port_forwarder.PortForwarder(local_port, request.port)
-    try:
-      pf.start()
-    except port_forwarder.AlreadyBoundError as e:
-      return rx_pb2.GenericResponse(
-        result=rx_pb2.Result(
-          code=rx_pb2.EADDRINUSE, message=str(e),
+      if ws is None:
+        ws = self._add_workspace(rxroot, context)
+      pf = port_forwarder.PortForwarder(
+        local_port, request.port, str(rxroot), self._budget, ws.worker,
+        self._limits, self._http_cache if request.http_cache else None)
+      try:
+        pf.start()
+      except port_forwarder.AlreadyBoundError as e:
+        # Maybe another rxroot is forwarding it.
+        self._maybe_drop(rxroot)
+        return rx_pb2.GenericResponse(
+          result=rx_pb2.Result(
+            code=rx_pb2.EADDRINUSE, message=str(e),
+          )
         )
-      )
-    self._ports[local_port] = pf
-    logging.info('Opened port %s', local_port)
+      ws.ports[local_port] = pf
+    logging.info('Opened port %s for %s', local_port, rxroot)
     return rx_pb2.GenericResponse(result=rx_pb2.Result())
 
   def ClosePort(
       self, request: daemon_pb2.ClosePortRequest, context: grpc.ServicerContext,
   ) -> rx_pb2.GenericResponse:
-    del context
+    rxroot = get_rxroot(context)
     port = request.port
-    if port not in self._ports:
-      return rx_pb2.GenericResponse(
-        result=rx_pb2.Result(
-          code=rx_pb2.NOT_FOUND,
-          message=f'Port {port} not forwarded',
-        ),
-      )
-    self._ports[port].stop()
-    logging.info('Closed port %s', port)
+    with self._lock:
+      ws = self._workspaces.get(rxroot)
+      if ws is None or port not in ws.ports:
+        return rx_pb2.GenericResponse(
+          result=rx_pb2.Result(
+            code=rx_pb2.NOT_FOUND,
+            message=f'Port {port} not forwarded',
+          ),
+        )
+      ws.ports.pop(port).stop()
+      self._maybe_drop(rxroot)
+    logging.info('Closed port %s for %s', port, rxroot)
     return rx_pb2.GenericResponse(result=rx_pb2.Result())
+
+  def _collect_metrics(self) -> List[metrics.Sample]:
+    """Gauges for how much the daemon is holding on to right now."""
+    samples = [
+      _gauge('daemon.buffered_bytes', self._budget.used),
+      _gauge('daemon.active_connections', self._limits.active),
+      _gauge('daemon.http_cache_bytes', self._http_cache.size),
+    ]
+    with self._lock:
+      samples.append(_gauge('daemon.workspaces', len(self._workspaces)))
+      forwarders = [
+        pf for ws in self._workspaces.values() for pf in ws.ports.values()]
+    for pf in forwarders:
+      stats = pf.get_stats()
+      port = str(pf.local_port)
+      samples += [
+        _gauge(
+          'port_forward.active_connections', stats.active_connections,
+          port=port),
+        _gauge('port_forward.queued_frames', stats.queued_frames, port=port),
+        _gauge('port_forward.queued_bytes', stats.queued_bytes, port=port),
+      ]
+    return samples
+
+  def _add_workspace(
+      self, rxroot: pathlib.Path, context: grpc.ServicerContext) -> _Workspace:
+    """Starts serving rxroot. Call with self._lock held."""
+    try:
+      local_cfg = local.load_config(rxroot)
+      # Make sure there's a worker to forward to.
+      remote.Remote(rxroot)
+    except (config_base.ConfigNotFoundError, local.ConfigError) as e:
+      context.abort(
+        grpc.StatusCode.INVALID_ARGUMENT,
+        f'Could not load the config for {rxroot}: {e}')
+    logging.info('Adding rxroot %s', rxroot)
+    ws = _Workspace(local_cfg, self._channels)
+    self._workspaces[rxroot] = ws
+    return ws
+
+  def _maybe_drop(self, rxroot: pathlib.Path):
+    """Stops serving rxroot if it has no ports. Call with self._lock held."""
+    ws = self._workspaces.get(rxroot)
+    if ws is None or ws.ports:
+      return
+    logging.info('Removing rxroot %s', rxroot)
+    del self._workspaces[rxroot]
+    ws.close()
+
+
+def _gauge(name: str, value: float, **labels: str) -> metrics.Sample:
+  return metrics.Sample(
+    name=name, kind=metrics.GAUGE, labels=labels, value=value)
+
+
+def _metric_to_pb(sample: metrics.Sample) -> daemon_pb2.Metric:
+  return daemon_pb2.Metric(
+    name=sample.name,
+    kind=client.METRIC_KINDS[sample.kind],
+    labels=sample.labels,
+    value=sample.value,
+    count=sample.count,
+    sum=sample.sum,
+    min=sample.min,
+    max=sample.max,
+    percentiles=sample.percentiles,
+  )
+
+
+def get_rxroot(context: grpc.ServicerContext) -> pathlib.Path:
+  """Returns the rxroot the request is for.
+
+  The daemon runs the rxroot's config (its rsync_path, its worker and
+  credentials), and any local process can connect over TCP. So it only serves
+  rxroots that belong to the daemon's user.
+  """
+  for key, value in context.invocation_metadata():
+    if key == 'rxroot':
+      rxroot = pathlib.Path(value)
+      if not is_owned(rxroot):
+        context.abort(
+          grpc.StatusCode.PERMISSION_DENIED,
+          f'{rxroot} does not belong to the daemon\'s user')
+      return rxroot
+  context.abort(grpc.StatusCode.INVALID_ARGUMENT, 'Request has no rxroot')
+  raise AssertionError('abort() raises')
+
+
+def is_owned(rxroot: pathlib.Path) -> bool:
+  """Returns if rxroot and its .rx dir belong to this user.
+
+  A symlink is judged by its own owner, so another user's link to one of this
+  user's directories isn't accepted.
+  """
+  uid = os.getuid()
+  try:
+    return all(
+      p.lstat().st_uid == uid for p in (rxroot, rxroot / config_base.RX_DIR))
+  except OSError:
+    return False
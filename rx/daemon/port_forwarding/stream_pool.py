@@ -0,0 +1,209 @@
+"""Opens PortForward streams ahead of the connections that will use them.
+
+When the worker can't multiplex, each local connection gets its own
+PortForward stream. Starting that stream once the connection's first bytes
+arrive puts stream setup and auth in front of every request, so a StreamPool
+keeps a few streams open and hands one to each connection as it is accepted.
+
+The pool is sized from how quickly connections have been arriving: enough to
+cover _LOOKAHEAD_SECS of arrivals, up to --warm_streams.
+"""
+import collections
+import math
+import queue
+import threading
+import time
+from typing import Deque, Iterator, List, Optional
+
+from absl import flags
+from absl import logging
+
+from rx.client import worker_client
+from rx.daemon import worker_channel
+
+_WARM_STREAMS = flags.DEFINE_integer(
+  'warm_streams', 4,
+  'Most PortForward streams to keep open per port for connections that '
+  'have not arrived yet (only used when the worker cannot multiplex). 0 '
+  'disables.')
+
+# Keep enough streams open for this many seconds of connections.
+_LOOKAHEAD_SECS = 1.0
+# Weight of the newest gap between connections in the arrival rate estimate.
+_RATE_ALPHA = 0.3
+# Replace warm streams after this long in case something on the way (or the
+# server on the worker) gives up on idle connections.
+_MAX_IDLE_SECS = 30
+# How often the pool checks for dead, expired, or surplus streams.
+_CHECK_SECS = 1
+
+
+class WarmStream:
+  """A PortForward call that has been started but isn't carrying bytes yet."""
+
+  def __init__(
+      self, grpc_client: worker_client.Client, remote_port: int) -> None:
+    self.client = grpc_client
+    self.opened = time.monotonic()
+    self._source: queue.SimpleQueue = queue.SimpleQueue()
+    self._call = grpc_client.start_port_forward(remote_port, self._requests())
+
+  @property
+  def is_active(self) -> bool:
+    return self._call.is_active
+
+  def bind(self, requests: Iterator[bytes]) -> Iterator[bytes]:
+    """Sends requests over this stream and returns the responses."""
+    self._source.put(requests)
+    return self._call.responses()
+
+  def cancel(self):
+    self._source.put(None)
+    self._call.cancel()
+
+  def _requests(self) -> Iterator[bytes]:
+    requests = self._source.get()
+    if requests is None:
+      return
+    yield from requests
+
+
+class StreamPool:
+  """Warm streams to one remote port."""
+
+  def __init__(
+      self,
+      worker: worker_channel.WorkerChannel,
+      remote_port: int,
+      max_size: Optional[int] = None) -> None:
+    self._worker = worker
+    self._remote_port = remote_port
+    self._max_size = _WARM_STREAMS.value if max_size is None else max_size
+    self._streams: Deque[WarmStream] = collections.deque()
+    # Estimated seconds between connections.
+    self._interval: Optional[float] = None
+    self._last_arrival: Optional[float] = None
+    self._closed = False
+    self._cv = threading.Condition()
+
+  @property
+  def size(self) -> int:
+    with self._cv:
+      return len(self._streams)
+
+  def start(self):
+    if self._max_size <= 0:
+      return
+    threading.Thread(target=self._refill_forever, daemon=True).start()
+
+  def get(self, grpc_client: worker_client.Client) -> Optional[WarmStream]:
+    """Takes a warm stream for a new connection, if there is one."""
+    now = time.monotonic()
+    stale: List[WarmStream] = []
+    stream = None
+    with self._cv:
+      self._record_arrival(now)
+      while self._streams:
+        candidate = self._streams.popleft()
+        if (candidate.client is grpc_client and candidate.is_active and
+            now - candidate.opened < _MAX_IDLE_SECS):
+          stream = candidate
+          break
+        stale.append(candidate)
+      self._cv.notify_all()
+    for s in stale:
+      s.cancel()
+    return stream
+
+  def target_size(self, now: float) -> int:
+    """How many streams to keep open, given the recent arrival rate."""
+    if self._max_size <= 0:
+      return 0
+    if self._interval is None or self._last_arrival is None:
+      # Nothing has connected yet, be ready for the first one.
+      return 1
+    # If it's been quiet for longer than usual, let the estimate decay.
+    interval = max(self._interval, now - self._last_arrival, 1e-3)
+    wanted = math.ceil(_LOOKAHEAD_SECS / interval)
+    return max(1, min(self._max_size, wanted))
+
+  def close(self):
+    with self._cv:
+      self._closed = True
+      streams = list(self._streams)
+      self._streams.clear()
+      self._cv.notify_all()
+    for s in streams:
+      s.cancel()
+
+  def _record_arrival(self, now: float):
+    if self._last_arrival is not None:
+      gap = now - self._last_arrival
+      if self._interval is None:
+        self._interval = gap
+      else:
+        self._interval = _RATE_ALPHA * gap + (1 - _RATE_ALPHA) * self._interval
+    self._last_arrival = now
+
+  def _refill_forever(self):
+    backoff = worker_channel.Backoff()
+    while True:
+      with self._cv:
+        self._cv.wait_for(
+          lambda: (
+            self._closed or
+            len(self._streams) < self.target_size(time.monotonic())),
+          timeout=_CHECK_SECS)
+        if self._closed:
+          return
+        now = time.monotonic()
+        dropped, failed = self._prune(now)
+        needed = self.target_size(now) - len(self._streams)
+      for s in dropped:
+        s.cancel()
+      if failed:
+        # The worker is probably unreachable, don't spin opening streams that
+        # fail straight away.
+        with self._cv:
+          self._cv.wait_for(lambda: self._closed, backoff.next_delay())
+        continue
+      backoff.reset()
+      if needed <= 0:
+        continue
+      grpc_client = self._worker.get_client()
+      opened = [
+        WarmStream(grpc_client, self._remote_port) for _ in range(needed)]
+      with self._cv:
+        if self._closed:
+          dropped = opened
+        else:
+          self._streams.extend(opened)
+          dropped = []
+      for s in dropped:
+        s.cancel()
+
+  def _prune(self, now: float):
+    """Removes streams that died, expired, or aren't needed anymore.
+
+    Returns the removed streams and if any of them died.
+    """
+    keep: Deque[WarmStream] = collections.deque()
+    dropped = []
+    failed = False
+    for s in self._streams:
+      if not s.is_active:
+        failed = True
+        dropped.append(s)
+      elif now - s.opened >= _MAX_IDLE_SECS:
+        dropped.append(s)
+      else:
+        keep.append(s)
+    target = self.target_size(now)
+    while len(keep) > target:
+      # Drop the oldest, they'll expire first anyway.
+      dropped.append(keep.popleft())
+    self._streams = keep
+    if failed:
+      logging.info(
+        'Warm stream to port %s failed, backing off', self._remote_port)
+    return dropped, failed
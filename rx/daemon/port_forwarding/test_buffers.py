@@ -0,0 +1,74 @@
+import threading
+import unittest
+
+from rx.daemon.port_forwarding import buffers
+
+
+class MemoryBudgetTests(unittest.TestCase):
+
+  def test_acquire_times_out_when_full(self):
+    budget = buffers.MemoryBudget(10)
+    self.assertTrue(budget.acquire(8))
+
+    self.assertFalse(budget.acquire(5, timeout=0.01))
+    budget.release(8)
+    self.assertTrue(budget.acquire(5, timeout=0.01))
+
+  def test_oversized_request_allowed_when_empty(self):
+    budget = buffers.MemoryBudget(10)
+
+    self.assertTrue(budget.acquire(100, timeout=0.01))
+    self.assertEqual(budget.high_water, 100)
+    self.assertEqual(budget.available, 0)
+
+
+class FrameBufferTests(unittest.TestCase):
+
+  def test_put_blocks_until_there_is_room(self):
+    buf = buffers.FrameBuffer(4, buffers.MemoryBudget(100))
+    buf.put(b'abc')
+    done = threading.Event()
+    def put():
+      buf.put(b'de')
+      done.set()
+    th = threading.Thread(target=put)
+    th.start()
+
+    self.assertFalse(done.wait(0.05))
+    self.assertEqual(buf.get(), b'abc')
+    th.join()
+    self.assertEqual(buf.get(), b'de')
+    self.assertEqual(buf.high_water, 3)
+
+  def test_shared_budget_limits_all_buffers(self):
+    budget = buffers.MemoryBudget(4)
+    buf1 = buffers.FrameBuffer(100, budget)
+    buf2 = buffers.FrameBuffer(100, budget)
+    buf1.put(b'abcd')
+    th = threading.Thread(target=buf2.put, args=(b'e',))
+    th.start()
+
+    th.join(0.05)
+    self.assertTrue(th.is_alive())
+    buf1.get()
+    th.join()
+    self.assertEqual(budget.used, 1)
+
+  def test_close_drains_then_returns_none(self):
+    buf = buffers.FrameBuffer(100, buffers.MemoryBudget(100))
+    buf.put(b'abc')
+    buf.close()
+
+    self.assertFalse(buf.put(b'def'))
+    self.assertEqual(buf.get(), b'abc')
+    self.assertIsNone(buf.get())
+
+  def test_clear_releases_budget(self):
+    budget = buffers.MemoryBudget(100)
+    buf = buffers.FrameBuffer(100, budget)
+    buf.put(b'abc')
+
+    buf.clear()
+
+    self.assertEqual(budget.used, 0)
+    self.assertIsNone(buf.get())
@@ -0,0 +1,184 @@
+import socket
+import unittest
+
+from absl.testing import absltest
+
+from rx.daemon.port_forwarding import http_cache
+
+
+def _request(headers=(), method='GET', target='/app.js') -> http_cache.Request:
+  return http_cache.Request(
+    method, target, 'HTTP/1.1', http_cache.Headers(list(headers)))
+
+
+def _response(headers=(), status=200) -> http_cache.Response:
+  return http_cache.Response(
+    'HTTP/1.1', status, 'OK', http_cache.Headers(list(headers)))
+
+
+class ParsingTests(unittest.TestCase):
+
+  def _reader(self, data: bytes) -> http_cache.Reader:
+    a, b = socket.socketpair()
+    a.sendall(data)
+    a.close()
+    self.addCleanup(b.close)
+    return http_cache.Reader(b)
+
+  def test_read_request(self):
+    reader = self._reader(
+      b'GET /index.html HTTP/1.1\r\nHost: localhost\r\nAccept: */*\r\n\r\n')
+
+    req = http_cache.read_request(reader)
+
+    self.assertIsNotNone(req)
+    self.assertEqual(req.method, 'GET')
+    self.assertEqual(req.target, '/index.html')
+    self.assertEqual(req.headers.get('host'), 'localhost')
+    self.assertTrue(req.keep_alive)
+    self.assertIsNone(http_cache.read_request(reader))
+
+  def test_read_chunked_body(self):
+    reader = self._reader(b'5\r\nhello\r\n6\r\n world\r\n0\r\n\r\n')
+
+    chunks = list(http_cache.read_body(
+      reader, http_cache.BodyFraming(chunked=True)))
+
+    self.assertEqual(b''.join(d for _, d in chunks), b'hello world')
+    self.assertEqual(
+      b''.join(r for r, _ in chunks),
+      b'5\r\nhello\r\n6\r\n world\r\n0\r\n\r\n')
+
+  def test_response_framing(self):
+    self.assertEqual(
+      http_cache.response_framing(
+        'GET', _response([('Content-Length', '10')])).length, 10)
+    self.assertEqual(
+      http_cache.response_framing(
+        'HEAD', _response([('Content-Length', '10')])).length, 0)
+    self.assertTrue(
+      http_cache.response_framing('GET', _response()).until_close)
+
+  def test_bad_request_line(self):
+    with self.assertRaises(http_cache.ParseError):
+      http_cache.read_request(self._reader(b'hello there\r\n\r\n'))
+
+  def test_looks_like_http(self):
+    self.assertTrue(http_cache.looks_like_http(b'GET / HTTP/1.1\r\n'))
+    self.assertFalse(http_cache.looks_like_http(b'\x16\x03\x01'))
+    self.assertFalse(http_cache.looks_like_http(b'PRI * HTTP/2.0\r\n'))
+
+
+class PolicyTests(unittest.TestCase):
+
+  def test_storable(self):
+    req = _request()
+    self.assertTrue(http_cache.is_storable(
+      req, _response([('Cache-Control', 'max-age=60')])))
+    self.assertTrue(http_cache.is_storable(req, _response([('ETag', '"a"')])))
+    self.assertFalse(http_cache.is_storable(req, _response()))
+    self.assertFalse(http_cache.is_storable(
+      req, _response([('Cache-Control', 'no-store, max-age=60')])))
+    self.assertFalse(http_cache.is_storable(
+      req, _response([('Cache-Control', 'max-age=60'), ('Vary', '*')])))
+    self.assertFalse(http_cache.is_storable(
+      _request(method='POST'), _response([('Cache-Control', 'max-age=60')])))
+
+  def test_freshness(self):
+    fresh = http_cache.Entry(
+      _request(), _response([('Cache-Control', 'max-age=60')]), b'x')
+    stale = http_cache.Entry(
+      _request(), _response([('Cache-Control', 'no-cache'), ('ETag', '"a"')]),
+      b'x')
+
+    self.assertTrue(fresh.is_fresh())
+    self.assertFalse(stale.is_fresh())
+
+  def test_refresh_from_not_modified(self):
+    entry = http_cache.Entry(
+      _request(), _response([('Cache-Control', 'max-age=0'), ('ETag', '"a"')]),
+      b'x')
+
+    entry.refresh(_response([('Cache-Control', 'max-age=60')], status=304))
+
+    self.assertTrue(entry.is_fresh())
+    self.assertEqual(entry.etag, '"a"')
+
+  def test_needs_revalidation(self):
+    self.assertTrue(http_cache.needs_revalidation(
+      _request([('Cache-Control', 'max-age=0')])))
+    self.assertTrue(http_cache.needs_revalidation(
+      _request([('Pragma', 'no-cache')])))
+    self.assertFalse(http_cache.needs_revalidation(_request()))
+
+  def test_cached_response_honors_if_none_match(self):
+    entry = http_cache.Entry(
+      _request(), _response([('ETag', 'W/"a"'), ('Content-Length', '5')]),
+      b'hello')
+
+    resp, body = http_cache.cached_response(
+      _request([('If-None-Match', '"a"')]), entry)
+
+    self.assertEqual(resp.status, 304)
+    self.assertEqual(body, b'')
+
+
+class HttpCacheTests(unittest.TestCase):
+
+  def test_vary(self):
+    cache = http_cache.HttpCache(1 << 20)
+    gzip = _request([('Accept-Encoding', 'gzip')])
+    cache.store(
+      '/ws', 80, gzip,
+      _response([('Cache-Control', 'max-age=60'),
+                 ('Vary', 'Accept-Encoding')]),
+      b'x')
+
+    self.assertIsNotNone(cache.lookup('/ws', 80, gzip))
+    self.assertIsNone(cache.lookup('/ws', 80, _request()))
+    self.assertIsNone(cache.lookup('/ws', 81, gzip))
+
+  def test_evicts_least_recently_used(self):
+    cache = http_cache.HttpCache(4000)
+    resp = _response([('Cache-Control', 'max-age=60')])
+    for target in ('/a', '/b', '/c', '/d'):
+      cache.store('/ws', 80, _request(target=target), resp, b'x' * 900)
+    cache.lookup('/ws', 80, _request(target='/a'))
+
+    cache.store('/ws', 80, _request(target='/e'), resp, b'x' * 900)
+
+    self.assertIsNotNone(cache.lookup('/ws', 80, _request(target='/a')))
+    self.assertIsNone(cache.lookup('/ws', 80, _request(target='/b')))
+    self.assertLessEqual(cache.size, cache.limit)
+
+  def test_skips_large_bodies(self):
+    cache = http_cache.HttpCache(4000)
+
+    cache.store(
+      '/ws', 80, _request(), _response([('Cache-Control', 'max-age=60')]),
+      b'x' * 2000)
+
+    self.assertIsNone(cache.lookup('/ws', 80, _request()))
+
+  def test_workspaces_are_kept_apart(self):
+    cache = http_cache.HttpCache(1 << 20)
+    resp = _response([('Cache-Control', 'max-age=60')])
+    cache.store('/proj-a', 3000, _request(), resp, b'a')
+    cache.store('/proj-b', 3000, _request(), resp, b'b')
+    cache.record_hit('/proj-a', 3000)
+
+    a = cache.lookup('/proj-a', 3000, _request())
+    b = cache.lookup('/proj-b', 3000, _request())
+    cache.invalidate('/proj-a', 3000, '/app.js')
+
+    assert a is not None and b is not None
+    self.assertEqual(a.body, b'a')
+    self.assertEqual(b.body, b'b')
+    self.assertIsNone(cache.lookup('/proj-a', 3000, _request()))
+    self.assertIsNotNone(cache.lookup('/proj-b', 3000, _request()))
+    self.assertEqual(cache.stats('/proj-a', 3000), (1, 0, 0))
+    self.assertEqual(cache.stats('/proj-b', 3000), (0, 0, 0))
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,163 @@
+import http.server
+import socket
+import threading
+from typing import List, Optional
+import unittest
+
+from absl.testing import absltest
+
+from rx.daemon.port_forwarding import http_cache
+from rx.daemon.port_forwarding import http_proxy
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+  requests: List[str] = []
+
+  def do_GET(self):
+    self.requests.append(self.path)
+    if self.path == '/bundle.js':
+      if self.headers.get('If-None-Match') == '"v1"':
+        self.send_response(304)
+        self.send_header('ETag', '"v1"')
+        self.end_headers()
+        return
+      self._send(b'console.log(1);', [('ETag', '"v1"')])
+    elif self.path == '/font.woff':
+      self._send(b'font', [('Cache-Control', 'max-age=3600')])
+    else:
+      self._send(b'dynamic', [('Cache-Control', 'no-store')])
+
+  def do_POST(self):
+    self.requests.append(f'POST {self.path}')
+    body = self.rfile.read(int(self.headers['Content-Length']))
+    self._send(body, [])
+
+  def _send(self, body: bytes, headers):
+    self.send_response(200)
+    for k, v in headers:
+      self.send_header(k, v)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    del args
+
+
+class ProxyTests(unittest.TestCase):
+
+  def setUp(self) -> None:
+    super().setUp()
+    _Handler.requests = []
+    self._server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    threading.Thread(target=self._server.serve_forever, daemon=True).start()
+    self._cache = http_cache.HttpCache(1 << 20)
+    self._upstreams = 0
+
+  def tearDown(self) -> None:
+    self._server.shutdown()
+    self._server.server_close()
+    super().tearDown()
+
+  def _connect(self) -> Optional[socket.socket]:
+    self._upstreams += 1
+    return socket.create_connection(self._server.server_address)
+
+  def _start_proxy(self) -> socket.socket:
+    local_end, proxy_end = socket.socketpair()
+    proxy = http_proxy.Proxy(
+      proxy_end, '/ws', 8080, self._cache, self._connect)
+    threading.Thread(target=proxy.run, daemon=True).start()
+    self.addCleanup(local_end.close)
+    return local_end
+
+  def _get(self, sock: socket.socket, path: str, headers: str = '') -> bytes:
+    sock.sendall(
+      f'GET {path} HTTP/1.1\r\nHost: localhost\r\n{headers}\r\n'.encode())
+    reader = http_cache.Reader(sock)
+    resp = http_cache.read_response(reader)
+    assert resp is not None
+    self._last = resp
+    return b''.join(d for _, d in http_cache.read_body(
+      reader, http_cache.response_framing('GET', resp)))
+
+  def test_serves_fresh_response_from_cache(self):
+    sock = self._start_proxy()
+
+    self.assertEqual(self._get(sock, '/font.woff'), b'font')
+    self.assertEqual(self._get(sock, '/font.woff'), b'font')
+
+    self.assertEqual(_Handler.requests, ['/font.woff'])
+    self.assertEqual(self._cache.stats('/ws', 8080), (1, 1, 0))
+
+  def test_revalidates_with_etag(self):
+    sock = self._start_proxy()
+
+    self.assertEqual(self._get(sock, '/bundle.js'), b'console.log(1);')
+    self.assertEqual(self._get(sock, '/bundle.js'), b'console.log(1);')
+
+    self.assertEqual(self._last.status, 200)
+    self.assertEqual(_Handler.requests, ['/bundle.js', '/bundle.js'])
+    self.assertEqual(self._cache.stats('/ws', 8080), (0, 1, 1))
+
+  def test_does_not_cache_no_store(self):
+    sock = self._start_proxy()
+
+    self._get(sock, '/api')
+    self._get(sock, '/api')
+
+    self.assertEqual(_Handler.requests, ['/api', '/api'])
+
+  def test_reload_bypasses_fresh_entry(self):
+    sock = self._start_proxy()
+
+    self._get(sock, '/font.woff')
+    self._get(sock, '/font.woff', 'Cache-Control: no-cache\r\n')
+
+    self.assertEqual(_Handler.requests, ['/font.woff', '/font.woff'])
+
+  def test_post_passes_through_and_invalidates(self):
+    sock = self._start_proxy()
+    self._get(sock, '/font.woff')
+
+    sock.sendall(
+      b'POST /font.woff HTTP/1.1\r\nHost: localhost\r\n'
+      b'Content-Length: 4\r\n\r\nbody')
+    reader = http_cache.Reader(sock)
+    resp = http_cache.read_response(reader)
+    body = b''.join(d for _, d in http_cache.read_body(
+      reader, http_cache.response_framing('POST', resp)))
+    self._get(sock, '/font.woff')
+
+    self.assertEqual(body, b'body')
+    self.assertEqual(
+      _Handler.requests, ['/font.woff', 'POST /font.woff', '/font.woff'])
+    # All on one upstream connection.
+    self.assertEqual(self._upstreams, 1)
+
+  def test_passes_through_non_http(self):
+    echo = socket.socket()
+    echo.bind(('127.0.0.1', 0))
+    echo.listen()
+    def serve():
+      conn, _ = echo.accept()
+      with conn:
+        conn.sendall(conn.recv(1024))
+    threading.Thread(target=serve, daemon=True).start()
+    local_end, proxy_end = socket.socketpair()
+    proxy = http_proxy.Proxy(
+      proxy_end, '/ws', 8080, self._cache,
+      lambda: socket.create_connection(echo.getsockname()))
+    threading.Thread(target=proxy.run, daemon=True).start()
+
+    local_end.sendall(b'\x16\x03\x01binary')
+    got = local_end.recv(1024)
+
+    self.assertEqual(got, b'\x16\x03\x01binary')
+    local_end.close()
+    echo.close()
+
+
+if __name__ == '__main__':
+  absltest.main()
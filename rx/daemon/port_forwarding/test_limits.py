@@ -0,0 +1,66 @@
+import threading
+import unittest
+
+from absl.testing import absltest
+
+from rx.daemon.port_forwarding import limits
+
+
+class ConnectionLimitsTests(unittest.TestCase):
+
+  def test_waits_for_free_slot(self):
+    cl = limits.ConnectionLimits(max_connections=2)
+    first = cl.acquire()
+    cl.acquire()
+
+    self.assertIsNone(cl.acquire(timeout=0.01))
+    self.assertEqual(cl.saturated, 1)
+
+    first.release()
+    self.assertIsNotNone(cl.acquire(timeout=1))
+    self.assertEqual(cl.active, 2)
+
+  def test_release_is_idempotent(self):
+    cl = limits.ConnectionLimits(max_connections=2)
+    slot = cl.acquire()
+
+    slot.release()
+    slot.release()
+
+    self.assertEqual(cl.active, 0)
+
+  def test_pool_threads_are_bounded(self):
+    cl = limits.ConnectionLimits(max_connections=1)
+    release = threading.Event()
+    done = threading.Semaphore(0)
+    running = []
+    lock = threading.Lock()
+    def task():
+      with lock:
+        running.append(threading.current_thread())
+      release.wait()
+      done.release()
+
+    for _ in range(5):
+      cl.submit(task)
+    release.set()
+    for _ in range(5):
+      self.assertTrue(done.acquire(timeout=5))
+
+    # Two threads per slot.
+    self.assertLessEqual(len(set(running)), 2)
+
+  def test_pool_survives_exceptions(self):
+    cl = limits.ConnectionLimits(max_connections=1)
+    ran = threading.Event()
+    def fail():
+      raise ValueError('oops')
+
+    with self.assertLogs(level='ERROR'):
+      cl.submit(fail)
+      cl.submit(ran.set)
+      self.assertTrue(ran.wait(timeout=5))
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,192 @@
+import pathlib
+import socket
+import tempfile
+import threading
+import time
+from typing import Callable
+import unittest
+from unittest import mock
+
+from absl import flags
+from absl.testing import absltest
+import grpc
+
+from rx.client import login
+from rx.client import worker_client
+from rx.client.configuration import local
+from rx.client.configuration import remote
+from rx.daemon.port_forwarding import buffers
+from rx.daemon.port_forwarding import mux
+from rx.testing import fake_worker
+
+FLAGS = flags.FLAGS
+
+
+def _send_and_receive(sock: socket.socket, payload: bytes) -> bytes:
+  """Sends payload, half-closes, and reads until the other side closes."""
+  def send():
+    sock.sendall(payload)
+    sock.shutdown(socket.SHUT_WR)
+  th = threading.Thread(target=send)
+  th.start()
+  chunks = []
+  while True:
+    buf = sock.recv(65536)
+    if not buf:
+      break
+    chunks.append(buf)
+  th.join()
+  sock.close()
+  return b''.join(chunks)
+
+
+def _wait_for(cond: Callable[[], bool]):
+  deadline = time.monotonic() + 5
+  while not cond():
+    if time.monotonic() > deadline:
+      raise AssertionError('Timed out')
+    time.sleep(0.01)
+
+
+class TunnelTests(unittest.TestCase):
+
+  def setUp(self) -> None:
+    super().setUp()
+    if not FLAGS.is_parsed():
+      FLAGS.mark_as_parsed()
+    self._tmpdir = tempfile.TemporaryDirectory()
+    rxroot = pathlib.Path(self._tmpdir.name)
+    local.get_local_config_path(rxroot).parent.mkdir(parents=True)
+    self._echo = fake_worker.EchoServer()
+    self._servicer = fake_worker.FakeExecutionService()
+    self._server, addr = fake_worker.start_server(self._servicer)
+    with remote.WritableRemote(rxroot) as r:
+      r['workspace_id'] = 'ws123'
+      r['worker_addr'] = addr
+      r['daemon_module'] = 'ws123'
+    self._channel = grpc.insecure_channel(addr)
+    lm = mock.create_autospec(login.LoginManager, instance=True)
+    lm.grpc_metadata = (('id-token', 'abc123'),)
+    local_cfg = local.LocalConfig(
+      cwd=rxroot, project_name='test', rsync_path='/usr/bin/rsync')
+    self._client = worker_client.Client(self._channel, local_cfg, lm)
+    self._budget = buffers.MemoryBudget(64 << 20)
+
+  def tearDown(self) -> None:
+    self._channel.close()
+    self._server.stop(grace=None)
+    self._echo.close()
+    self._tmpdir.cleanup()
+    super().tearDown()
+
+  def test_round_trip(self):
+    tunnel = mux.Tunnel(self._client, self._echo.port, self._budget)
+    tunnel.start()
+    local_end, tunnel_end = socket.socketpair()
+    tunnel.add(tunnel_end)
+
+    got = _send_and_receive(local_end, b'hello')
+
+    self.assertEqual(got, b'hello')
+    tunnel.close()
+
+  def test_on_close_called_when_connection_finishes(self):
+    tunnel = mux.Tunnel(self._client, self._echo.port, self._budget)
+    tunnel.start()
+    local_end, tunnel_end = socket.socketpair()
+    closed = threading.Event()
+    tunnel.add(tunnel_end, on_close=closed.set)
+
+    _send_and_receive(local_end, b'hello')
+
+    self.assertTrue(closed.wait(timeout=5))
+    tunnel.close()
+
+  def test_concurrent_connections_share_stream(self):
+    tunnel = mux.Tunnel(self._client, self._echo.port, self._budget)
+    tunnel.start()
+    results = {}
+    def run(i: int):
+      local_end, tunnel_end = socket.socketpair()
+      tunnel.add(tunnel_end)
+      results[i] = _send_and_receive(local_end, f'request {i}'.encode())
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(20)]
+    for th in threads:
+      th.start()
+    for th in threads:
+      th.join()
+
+    self.assertEqual(
+      results, {i: f'request {i}'.encode() for i in range(20)})
+    tunnel.close()
+
+  def test_payload_larger_than_window(self):
+    tunnel = mux.Tunnel(self._client, self._echo.port, self._budget)
+    tunnel.start()
+    local_end, tunnel_end = socket.socketpair()
+    tunnel.add(tunnel_end)
+    payload = bytes(range(256)) * (4 * mux._INITIAL_WINDOW // 256)
+
+    got = _send_and_receive(local_end, payload)
+
+    self.assertEqual(got, payload)
+    tunnel.close()
+
+  def test_payload_larger_than_memory_budget(self):
+    budget = buffers.MemoryBudget(mux._FRAME_SIZE)
+    tunnel = mux.Tunnel(self._client, self._echo.port, budget)
+    tunnel.start()
+    local_end, tunnel_end = socket.socketpair()
+    tunnel.add(tunnel_end)
+    payload = b'x' * (2 * mux._INITIAL_WINDOW)
+
+    got = _send_and_receive(local_end, payload)
+
+    self.assertEqual(got, payload)
+    self.assertLessEqual(budget.high_water, 2 * mux._FRAME_SIZE)
+    tunnel.close()
+
+  def test_add_after_close(self):
+    tunnel = mux.Tunnel(self._client, self._echo.port, self._budget)
+    tunnel.start()
+    tunnel.close()
+    local_end, tunnel_end = socket.socketpair()
+    self.addCleanup(local_end.close)
+    self.addCleanup(tunnel_end.close)
+
+    # Handled like any other disconnection.
+    with self.assertRaises(worker_client.DisconnectionError):
+      tunnel.add(tunnel_end)
+
+  def test_close_releases_unsent_frames(self):
+    stop = threading.Event()
+    self.addCleanup(stop.set)
+    def responses():
+      # Never reads the requests, like a stream that's stuck.
+      stop.wait()
+      yield from ()
+    stuck = mock.create_autospec(worker_client.Client, instance=True)
+    stuck.forward_mux.return_value = responses()
+    tunnel = mux.Tunnel(stuck, self._echo.port, self._budget)
+    tunnel.start()
+    local_end, tunnel_end = socket.socketpair()
+    self.addCleanup(local_end.close)
+    tunnel.add(tunnel_end)
+    local_end.sendall(b'x' * 100)
+    _wait_for(lambda: self._budget.used == 100)
+
+    tunnel.close()
+
+    _wait_for(lambda: self._budget.used == 0)
+
+  def test_worker_without_multiplexing(self):
+    self._servicer._multiplex = False
+    tunnel = mux.Tunnel(self._client, self._echo.port, self._budget)
+
+    with self.assertRaises(worker_client.UnimplementedError):
+      tunnel.start()
+
+
+if __name__ == '__main__':
+  absltest.main()
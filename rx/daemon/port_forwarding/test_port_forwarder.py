@@ -0,0 +1,105 @@
+import queue
+import socket
+import unittest
+from unittest import mock
+
+from absl import flags
+from absl.testing import absltest
+
+from rx.daemon import worker_channel
+from rx.daemon.port_forwarding import buffers
+from rx.daemon.port_forwarding import limits
+from rx.daemon.port_forwarding import mux
+from rx.daemon.port_forwarding import port_forwarder
+
+FLAGS = flags.FLAGS
+
+
+class RunForeverTests(unittest.TestCase):
+
+  def setUp(self) -> None:
+    super().setUp()
+    if not FLAGS.is_parsed():
+      FLAGS.mark_as_parsed()
+    self._limits = limits.ConnectionLimits(max_connections=1)
+    # (port, slot) for each connection forwarded.
+    self._forwarded = queue.SimpleQueue()
+    self._forwarders = []
+
+  def tearDown(self) -> None:
+    for pf in self._forwarders:
+      pf.stop()
+    super().tearDown()
+
+  def _start(self) -> port_forwarder.PortForwarder:
+    worker = mock.create_autospec(worker_channel.WorkerChannel, instance=True)
+    pf = port_forwarder.PortForwarder(
+      _free_port(), 8080, 'ws', buffers.MemoryBudget(1 << 20), worker,
+      self._limits)
+    def forward(client_sock, slot):
+      client_sock.close()
+      self._forwarded.put((pf.local_port, slot))
+    pf.forward_connection = forward
+    pf.start()
+    self._forwarders.append(pf)
+    return pf
+
+  def test_idle_ports_do_not_hold_slots(self):
+    first = self._start()
+    second = self._start()
+    self.assertEqual(self._limits.active, 0)
+
+    with socket.create_connection(('127.0.0.1', second.local_port)):
+      port, slot = self._forwarded.get(timeout=5)
+    self.assertEqual(port, second.local_port)
+    with socket.create_connection(('127.0.0.1', first.local_port)):
+      # Waits for the second port's connection to finish.
+      with self.assertRaises(queue.Empty):
+        self._forwarded.get(timeout=0.1)
+      slot.release()
+      port, slot = self._forwarded.get(timeout=5)
+    self.assertEqual(port, first.local_port)
+    slot.release()
+    self.assertEqual(self._limits.active, 0)
+
+
+class ForwardTests(unittest.TestCase):
+
+  def setUp(self) -> None:
+    super().setUp()
+    if not FLAGS.is_parsed():
+      FLAGS.mark_as_parsed()
+    self._worker = mock.create_autospec(
+      worker_channel.WorkerChannel, instance=True)
+    self._worker.wait_for_ready.return_value = True
+    self._pf = port_forwarder.PortForwarder(
+      _free_port(), 8080, 'ws', buffers.MemoryBudget(1 << 20), self._worker,
+      limits.ConnectionLimits(max_connections=1))
+    self.addCleanup(self._pf.stop)
+
+  def test_closed_tunnel_is_replaced(self):
+    closed = mock.create_autospec(mux.Tunnel, instance=True)
+    closed.add.side_effect = mux.TunnelClosedError()
+    fresh = mock.create_autospec(mux.Tunnel, instance=True)
+    local_end, forwarded = socket.socketpair()
+    self.addCleanup(local_end.close)
+    self.addCleanup(forwarded.close)
+
+    with mock.patch.object(
+        self._pf, '_get_tunnel', side_effect=[closed, fresh]):
+      ok = self._pf._forward_with_retries(
+        forwarded, worker_channel.Backoff())
+
+    self.assertTrue(ok)
+    fresh.add.assert_called_once()
+    self._worker.reconnect.assert_not_called()
+
+
+def _free_port() -> int:
+  with socket.socket() as s:
+    s.bind(('127.0.0.1', 0))
+    return s.getsockname()[1]
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,123 @@
+import pathlib
+import socket
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from absl import flags
+from absl.testing import absltest
+
+from rx.client import login
+from rx.client.configuration import local
+from rx.client.configuration import remote
+from rx.daemon import worker_channel
+from rx.daemon.port_forwarding import buffers
+from rx.daemon.port_forwarding import client_socket
+from rx.daemon.port_forwarding import stream_pool
+from rx.testing import fake_worker
+
+FLAGS = flags.FLAGS
+
+
+def _wait_for(predicate, timeout: float = 5) -> bool:
+  deadline = time.monotonic() + timeout
+  while time.monotonic() < deadline:
+    if predicate():
+      return True
+    time.sleep(0.01)
+  return False
+
+
+class StreamPoolTests(unittest.TestCase):
+
+  def setUp(self) -> None:
+    super().setUp()
+    if not FLAGS.is_parsed():
+      FLAGS.mark_as_parsed()
+    self._tmpdir = tempfile.TemporaryDirectory()
+    rxroot = pathlib.Path(self._tmpdir.name)
+    local.get_local_config_path(rxroot).parent.mkdir(parents=True)
+    self._echo = fake_worker.EchoServer()
+    self._servicer = fake_worker.FakeExecutionService(multiplex=False)
+    self._server, addr = fake_worker.start_server(self._servicer)
+    with remote.WritableRemote(rxroot) as r:
+      r['workspace_id'] = 'ws123'
+      r['worker_addr'] = addr
+      r['daemon_module'] = 'ws123'
+    local_cfg = local.LocalConfig(
+      cwd=rxroot, project_name='test', rsync_path='/usr/bin/rsync')
+    lm = mock.create_autospec(login.LoginManager, instance=True)
+    lm.grpc_metadata = (('id-token', 'abc123'),)
+    patcher = mock.patch.object(login, 'LoginManager', return_value=lm)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    self._worker = worker_channel.WorkerChannel(local_cfg)
+
+  def tearDown(self) -> None:
+    self._worker.close()
+    self._server.stop(grace=None)
+    self._echo.close()
+    self._tmpdir.cleanup()
+    super().tearDown()
+
+  def test_opens_stream_before_connection(self):
+    pool = stream_pool.StreamPool(self._worker, self._echo.port, max_size=4)
+    pool.start()
+
+    self.assertTrue(_wait_for(lambda: self._servicer.port_forward_calls >= 1))
+    self.assertTrue(_wait_for(lambda: pool.size >= 1))
+    pool.close()
+
+  def test_connection_uses_warm_stream(self):
+    pool = stream_pool.StreamPool(self._worker, self._echo.port, max_size=4)
+    pool.start()
+    self.assertTrue(_wait_for(lambda: pool.size >= 1))
+    grpc_client = self._worker.get_client()
+    warm = pool.get(grpc_client)
+    self.assertIsNotNone(warm)
+    local_end, daemon_end = socket.socketpair()
+
+    with client_socket.Connection(
+        daemon_end, buffers.MemoryBudget(1 << 20), 1 << 16) as conn:
+      local_end.sendall(b'hello')
+      local_end.shutdown(socket.SHUT_WR)
+      conn.handle(grpc_client, self._echo.port, warm)
+    got = local_end.recv(1024)
+    local_end.close()
+
+    self.assertEqual(got, b'hello')
+    pool.close()
+
+  def test_drops_streams_from_old_client(self):
+    pool = stream_pool.StreamPool(self._worker, self._echo.port, max_size=4)
+    pool.start()
+    self.assertTrue(_wait_for(lambda: pool.size >= 1))
+    old_client = self._worker.get_client()
+    self._worker.reconnect(old_client)
+
+    self.assertIsNone(pool.get(self._worker.get_client()))
+    pool.close()
+
+  def test_target_size_follows_arrival_rate(self):
+    pool = stream_pool.StreamPool(self._worker, self._echo.port, max_size=4)
+    self.assertEqual(pool.target_size(0), 1)
+
+    # Connections every 10ms want as many streams as allowed.
+    for i in range(10):
+      pool._record_arrival(i * 0.01)
+    self.assertEqual(pool.target_size(0.1), 4)
+
+    # After a quiet spell, only one is kept.
+    self.assertEqual(pool.target_size(10), 1)
+
+  def test_disabled(self):
+    pool = stream_pool.StreamPool(self._worker, self._echo.port, max_size=0)
+    pool.start()
+
+    self.assertEqual(pool.target_size(0), 0)
+    self.assertIsNone(pool.get(self._worker.get_client()))
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,76 @@
+"""Lets the daemon tell the process that started it when it is ready.
+
+The CLI passes the write end of a pipe to rx-daemon (see --ready_fd). Once the
+daemon is serving, or has failed to, it writes one line of JSON to the pipe and
+closes it. The CLI waits on the read end, so it knows as soon as the daemon
+does. If the daemon dies first, the CLI sees the pipe close without a status.
+"""
+import dataclasses
+import json
+import os
+import select
+import time
+from typing import List, Optional
+
+from absl import logging
+
+
+@dataclasses.dataclass
+class Status:
+  ready: bool
+  # Addresses the daemon is listening on.
+  addrs: List[str] = dataclasses.field(default_factory=list)
+  error: Optional[str] = None
+
+
+class Notifier:
+  """Daemon side: reports the startup status once."""
+
+  def __init__(self, fd: Optional[int]) -> None:
+    self._fd = fd
+
+  def ready(self, addrs: List[str]):
+    self._send(Status(ready=True, addrs=addrs))
+
+  def failed(self, error: str):
+    self._send(Status(ready=False, error=error))
+
+  def _send(self, status: Status):
+    if self._fd is None:
+      return
+    fd, self._fd = self._fd, None
+    try:
+      os.write(fd, json.dumps(dataclasses.asdict(status)).encode() + b'\n')
+    except OSError:
+      # The CLI gave up waiting.
+      logging.info('Could not report startup status', exc_info=True)
+    finally:
+      os.close(fd)
+
+
+def wait(fd: int, timeout: float) -> Optional[Status]:
+  """CLI side: waits for the daemon's status and closes fd.
+
+  Returns None if the daemon didn't report a status within timeout secs.
+  """
+  deadline = time.monotonic() + timeout
+  buf = b''
+  try:
+    while b'\n' not in buf:
+      remaining = deadline - time.monotonic()
+      if remaining <= 0:
+        return None
+      readable, _, _ = select.select([fd], [], [], remaining)
+      if not readable:
+        return None
+      data = os.read(fd, 4096)
+      if not data:
+        # The daemon exited without saying anything.
+        return Status(ready=False)
+      buf += data
+  finally:
+    os.close(fd)
+  try:
+    return Status(**json.loads(buf.split(b'\n', 1)[0]))
+  except (ValueError, TypeError) as e:
+    return Status(ready=False, error=f'Bad status from daemon: {e}')
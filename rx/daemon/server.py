@@ -1,8 +1,10 @@
+import atexit
 from concurrent import futures
 import os
+import pathlib
 import signal
 import tempfile
-from typing import Sequence
+from typing import Optional, Sequence
 
 from absl import app
 from absl import flags
@@ -11,14 +13,26 @@ import grpc
 
 from rx.client.configuration import local
 from rx.daemon import daemon
+from rx.daemon import deps
 from rx.daemon import interceptors
+from rx.daemon import readiness
+from rx.daemon import worker_channel
 from rx.daemon.port_forwarding import service
 from rx.proto import daemon_pb2_grpc
+from rx.shared import metrics
 
 # Only allow local connections.
 _BIND_ADDR = '127.0.0.1'
 _PORT = flags.DEFINE_integer(
   'port', local.DEFAULT_DAEMON_PORT, 'The port to listen on.')
+_RPC_WORKERS = flags.DEFINE_integer(
+  'rpc_workers', 10, 'Threads handling requests from the rx CLI.')
+_METRICS_PORT = flags.DEFINE_integer(
+  'metrics_port', None,
+  'If set, serve metrics for Prometheus at localhost:<port>/metrics.')
+_READY_FD = flags.DEFINE_integer(
+  'ready_fd', None,
+  'Inherited pipe to report startup status on, set by the rx CLI.')
 
 
 def _configure_logging():
@@ -29,15 +43,72 @@ def _configure_logging():
   logging.info('Starting rx daemon with pid %s', os.getpid())
 
 
-def _start_server(port: int, local_cfg: local.LocalConfig):
-  addr = f'{_BIND_ADDR}:{port}'
+def _start_server(port: int, notifier: readiness.Notifier):
+  # Workspaces on the same worker share a connection to it.
+  channels = worker_channel.ChannelPool()
+  handler = service.PortForwardingService(channels)
+  deps_handler = deps.DepsService(channels)
+  servers = []
+  addrs = []
+  # The CLI prefers the Unix socket: only this user can connect to it, so it
+  # doesn't need the pid check, and it's cheaper per call than TCP.
+  unix_addr = local.get_daemon_unix_addr()
+  if unix_addr is not None:
+    unix_server = _start_unix_server(
+      local.get_daemon_socket_file(), unix_addr, handler, deps_handler)
+    if unix_server is not None:
+      servers.append(unix_server)
+      addrs.append(unix_addr)
+  # TCP is still served for older clients and home directories whose path is
+  # too long for a Unix socket. Dependency installs run the rxroot's rsync,
+  # so they're only served to this user, on the socket.
+  tcp_server = _start_tcp_server(port, handler)
+  if tcp_server is None:
+    for server in servers:
+      server.stop(grace=None)
+    deps_handler.close()
+    notifier.failed(
+      f'Could not bind to localhost:{port}, is something already running on '
+      'that port?')
+    return
+  servers.append(tcp_server)
+  addrs.append(f'localhost:{port}')
+  if _METRICS_PORT.value is not None:
+    try:
+      metrics.serve_prometheus(_METRICS_PORT.value)
+    except OSError:
+      logging.exception(
+        'Could not serve metrics on localhost:%s', _METRICS_PORT.value)
+  notifier.ready(addrs)
+  signal.signal(
+    signal.SIGINT, get_signal_handler(handler, servers, deps_handler))
+  for server in servers:
+    server.wait_for_termination()
+
+
+def _new_server(
+    interceptors_: Sequence[grpc.ServerInterceptor],
+    handler: service.PortForwardingService,
+    deps_handler: Optional[deps.DepsService] = None) -> grpc.Server:
   server = grpc.server(
-    futures.ThreadPoolExecutor(max_workers=10),
-    interceptors=(interceptors.PidCheck(), interceptors.VersionCheck()),
+    futures.ThreadPoolExecutor(max_workers=_RPC_WORKERS.value),
+    interceptors=interceptors_,
     # By default grpc allows multiple servers to listen on the same port. Turn
     # off that behavior.
     options=(('grpc.so_reuseport', 0),),
   )
+  daemon_pb2_grpc.add_PortForwardingServiceServicer_to_server(handler, server)
+  if deps_handler is not None:
+    daemon_pb2_grpc.add_DepsServiceServicer_to_server(deps_handler, server)
+  return server
+
+
+def _start_tcp_server(
+    port: int, handler: service.PortForwardingService,
+) -> Optional[grpc.Server]:
+  addr = f'{_BIND_ADDR}:{port}'
+  server = _new_server(
+    (interceptors.PidCheck(), interceptors.VersionCheck()), handler)
   try:
     server.add_insecure_port(addr)
   except RuntimeError as e:
@@ -47,30 +118,65 @@ def _start_server(port: int, local_cfg: local.LocalConfig):
         'on that port?')
     else:
       logging.exception('Unknown error')
-    return
-  handler = service.PortForwardingService(local_cfg)
-  daemon_pb2_grpc.add_PortForwardingServiceServicer_to_server(handler, server)
-  signal.signal(signal.SIGINT, get_signal_handler(handler, server))
+    return None
+  server.start()
+  logging.info(f'Listening on {addr}')
+  return server
+
+
+def _start_unix_server(
+    sock_file: pathlib.Path,
+    addr: str,
+    handler: service.PortForwardingService,
+    deps_handler: Optional[deps.DepsService] = None,
+) -> Optional[grpc.Server]:
+  # Left over from a daemon that didn't shut down cleanly.
+  _remove_socket(sock_file)
+  server = _new_server((interceptors.VersionCheck(),), handler, deps_handler)
+  # Only this user may connect.
+  old_umask = os.umask(0o077)
+  try:
+    server.add_insecure_port(addr)
+  except RuntimeError:
+    logging.exception('Could not listen on %s, only using TCP', addr)
+    return None
+  finally:
+    os.umask(old_umask)
+  os.chmod(sock_file, 0o600)
+  atexit.register(_remove_socket, sock_file)
   server.start()
   logging.info(f'Listening on {addr}')
-  server.wait_for_termination()
+  return server
+
+
+def _remove_socket(sock_file: pathlib.Path):
+  try:
+    # missing_ok added in 3.8.
+    sock_file.unlink()
+  except FileNotFoundError:
+    pass
 
 
-def get_signal_handler(pf: service.PortForwardingService, server: grpc.Server):
+def get_signal_handler(
+    pf: service.PortForwardingService,
+    servers: Sequence[grpc.Server],
+    deps_handler: Optional[deps.DepsService] = None):
   def cleanup(signum: int, frame):
     del signum
     del frame
     pf.close_ports()
-    server.stop(grace=None)
+    if deps_handler is not None:
+      deps_handler.close()
+    for server in servers:
+      server.stop(grace=None)
   return cleanup
 
 
 def start_daemon():
-  local_cfg = local.get_local_config()
   # TODO: add a signal handler to stop the daemon.
-  with daemon.Daemonizer(local_cfg.cwd):
+  with daemon.Daemonizer(local.get_daemon_dir()):
     _configure_logging()
-    _start_server(_PORT.value, local_cfg)
+    _start_server(_PORT.value, readiness.Notifier(_READY_FD.value))
   logging.info('Exiting.')
 
 
@@ -0,0 +1,269 @@
+from concurrent import futures
+import os
+import pathlib
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from absl import flags
+from absl.testing import absltest
+import grpc
+
+from rx.client import worker_client
+from rx.client.configuration import local
+from rx.daemon import client
+from rx.daemon import deps
+from rx.daemon import worker_channel
+from rx.proto import daemon_pb2
+from rx.proto import daemon_pb2_grpc
+from rx.testing import fake_worker
+from rx.trex.toolchain import lang_detector
+from rx.trex.toolchain import local_fs
+
+FLAGS = flags.FLAGS
+
+
+class _DepsTest(unittest.TestCase):
+
+  def setUp(self) -> None:
+    super().setUp()
+    if not FLAGS.is_parsed():
+      FLAGS.mark_as_parsed()
+    self._tmpdir = tempfile.TemporaryDirectory()
+    self.addCleanup(self._tmpdir.cleanup)
+    self._rxroot = pathlib.Path(self._tmpdir.name)
+    self._local_cfg = fake_worker.setup_rxroot(self._rxroot, 'localhost:1')
+    (self._rxroot / 'web').mkdir()
+    self._write('requirements.txt', 'absl-py\n')
+    self._write('web/package.json', '{}')
+    patcher = mock.patch.object(
+      local_fs, 'scan', return_value=local_fs.Scan(
+        paths=['requirements.txt', 'web/', 'web/package.json', 'x.py']))
+    self._scan = patcher.start()
+    self.addCleanup(patcher.stop)
+    self._worker_client = mock.create_autospec(
+      worker_client.Client, instance=True)
+    self._worker_client.sync_files.return_value = 0
+    self._worker_client.install_deps.return_value = False
+    self._worker_client.pull_changes.return_value = 0
+    # As if `rx init` installed them.
+    self._mark_installed()
+
+  def _mark_installed(self):
+    fingerprint = lang_detector.fingerprint_files(
+      ['requirements.txt', 'web/package.json'], self._rxroot)
+    deps.get_fingerprint_file(self._rxroot).write_text(f'{fingerprint}\n')
+
+  def _write(self, path: str, content: str):
+    p = self._rxroot / path
+    p.write_text(content)
+    # Make sure the change is visible even on coarse-grained filesystems.
+    st = p.stat()
+    os.utime(p, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+
+class DepsWatcherTests(_DepsTest):
+
+  def setUp(self) -> None:
+    super().setUp()
+    worker = mock.create_autospec(worker_channel.WorkerChannel, instance=True)
+    worker.get_client.return_value = self._worker_client
+    self._watcher = deps.DepsWatcher(self._local_cfg, worker)
+
+  def test_first_check_is_baseline(self):
+    self.assertFalse(self._watcher.check())
+    self.assertFalse(self._watcher.check())
+
+    self._worker_client.install_deps.assert_not_called()
+
+  def test_change_while_not_watching_installs(self):
+    self._write('requirements.txt', 'absl-py\ngrpcio\n')
+
+    started = self._watcher.check()
+    status = self._watcher.wait()
+
+    self.assertTrue(started)
+    self.assertEqual(status.state, daemon_pb2.DepsStatus.IDLE)
+    self._worker_client.install_deps.assert_called_once()
+    self._assert_next_watcher_is_up_to_date()
+
+  def test_unknown_install_is_checked(self):
+    deps.get_fingerprint_file(self._rxroot).unlink()
+
+    self.assertTrue(self._watcher.check())
+    self._watcher.wait()
+
+    self._worker_client.install_deps.assert_called_once()
+    self._assert_next_watcher_is_up_to_date()
+
+  def _assert_next_watcher_is_up_to_date(self):
+    watcher = deps.DepsWatcher(self._local_cfg, mock.Mock())
+    self.assertFalse(watcher.check())
+
+  def test_change_installs(self):
+    self._watcher.check()
+    self._write('requirements.txt', 'absl-py\ngrpcio\n')
+
+    started = self._watcher.check()
+    status = self._watcher.wait()
+
+    self.assertTrue(started)
+    self.assertEqual(status.state, daemon_pb2.DepsStatus.IDLE)
+    self._worker_client.sync_files.assert_called_once_with(
+      ['requirements.txt', 'web/package.json'])
+    self._worker_client.install_deps.assert_called_once()
+    log = deps.get_log_file(self._rxroot).read_text()
+    self.assertIn('dependencies changed, reinstalling', log)
+
+  def test_install(self):
+    self._watcher.check()
+
+    started = self._watcher.install()
+    status = self._watcher.wait()
+
+    self.assertTrue(started)
+    self.assertEqual(status.state, daemon_pb2.DepsStatus.IDLE)
+    self._worker_client.install_deps.assert_called_once()
+    self._worker_client.pull_changes.assert_called_once()
+    log = deps.get_log_file(self._rxroot).read_text()
+    self.assertIn('installing dependencies', log)
+    # The installed dependencies are the new baseline.
+    self.assertFalse(self._watcher.check())
+
+  def test_up_to_date_deps_are_not_pulled(self):
+    self._worker_client.install_deps.return_value = True
+
+    self._watcher.install()
+    self._watcher.wait()
+
+    self._worker_client.pull_changes.assert_not_called()
+
+  def test_starts_from_init_scan(self):
+    local_fs.save_scan(self._rxroot, local_fs.Scan(paths=['requirements.txt']))
+
+    self._watcher.install()
+    self._watcher.wait()
+
+    self._scan.assert_not_called()
+    self._worker_client.sync_files.assert_called_once_with(['requirements.txt'])
+
+  def test_touch_does_not_install(self):
+    self._watcher.check()
+    self._write('requirements.txt', 'absl-py\n')
+
+    self.assertFalse(self._watcher.check())
+
+  def test_failed_install(self):
+    self._worker_client.install_deps.side_effect = worker_client.WorkerError(
+      'pip exploded')
+    self._watcher.check()
+    self._write('web/package.json', '{"x": 1}')
+
+    self._watcher.check()
+    status = self._watcher.wait()
+
+    self.assertEqual(status.state, daemon_pb2.DepsStatus.FAILED)
+    self.assertEqual(status.result.message, 'pip exploded')
+
+  def test_change_during_install_is_installed_after(self):
+    installing = threading.Event()
+    finish = threading.Event()
+    def install(out, fingerprint):
+      del out
+      del fingerprint
+      installing.set()
+      finish.wait()
+      return False
+    self._worker_client.install_deps.side_effect = install
+    self._watcher.check()
+    self._write('requirements.txt', 'absl-py\ngrpcio\n')
+    self._watcher.check()
+    installing.wait()
+
+    self._write('requirements.txt', 'absl-py\ngrpcio\nyaml\n')
+    self.assertFalse(self._watcher.check())
+    finish.set()
+    status = self._watcher.wait()
+
+    self.assertEqual(status.state, daemon_pb2.DepsStatus.IDLE)
+    self.assertEqual(self._worker_client.install_deps.call_count, 2)
+
+
+class DepsServiceTests(_DepsTest):
+
+  def setUp(self) -> None:
+    super().setUp()
+    patcher = mock.patch.object(
+      worker_channel.WorkerChannel, 'get_client',
+      return_value=self._worker_client)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    self._service = deps.DepsService()
+    self.addCleanup(self._service.close)
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+    daemon_pb2_grpc.add_DepsServiceServicer_to_server(self._service, server)
+    port = server.add_insecure_port('localhost:0')
+    server.start()
+    self.addCleanup(server.stop, None)
+    channel = grpc.insecure_channel(f'localhost:{port}')
+    self.addCleanup(channel.close)
+    self._client = client.Client(channel, self._local_cfg, check_pid=False)
+
+  def test_wait_for_changed_deps(self):
+    # The install runs until the client is told to wait.
+    finish = threading.Event()
+    self._worker_client.install_deps.side_effect = (
+      lambda out, fingerprint: finish.wait())
+    self._client.watch_deps()
+    self._write('requirements.txt', 'absl-py\ngrpcio\n')
+    waited = []
+    def on_wait(status: daemon_pb2.DepsStatus):
+      waited.append(status)
+      finish.set()
+
+    status = self._client.wait_for_deps(on_wait)
+
+    self.assertEqual(status.state, daemon_pb2.DepsStatus.IDLE)
+    self.assertEqual(len(waited), 1)
+    self.assertEqual(
+      waited[0].log_file, str(deps.get_log_file(self._rxroot)))
+    self._worker_client.install_deps.assert_called_once()
+
+  def test_watch_and_install(self):
+    self._client.watch_deps(install=True)
+
+    status = self._client.wait_for_deps()
+
+    self.assertEqual(status.state, daemon_pb2.DepsStatus.IDLE)
+    self._worker_client.install_deps.assert_called_once()
+
+  def test_nothing_to_wait_for(self):
+    waited = []
+
+    status = self._client.wait_for_deps(waited.append)
+
+    self.assertEqual(status.state, daemon_pb2.DepsStatus.IDLE)
+    self.assertEqual(waited, [])
+    self._worker_client.install_deps.assert_not_called()
+
+  def test_wait_does_not_start_watching(self):
+    deps.get_fingerprint_file(self._rxroot).unlink()
+
+    status = self._client.wait_for_deps()
+
+    self.assertEqual(status.state, daemon_pb2.DepsStatus.IDLE)
+    self.assertEqual(self._service._watchers, {})
+
+  def test_deleted_rxroot_is_dropped(self):
+    self._client.watch_deps()
+    local.get_local_config_path(self._rxroot).unlink()
+
+    self._service._check_all()
+
+    self.assertEqual(self._service._watchers, {})
+    self.assertEqual(self._service._workers, {})
+
+
+if __name__ == '__main__':
+  absltest.main()
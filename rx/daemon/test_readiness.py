@@ -0,0 +1,58 @@
+import os
+import unittest
+
+from absl.testing import absltest
+
+from rx.daemon import readiness
+
+
+class ReadinessTests(unittest.TestCase):
+
+  def setUp(self) -> None:
+    super().setUp()
+    self._read_fd, self._write_fd = os.pipe()
+    self._notifier = readiness.Notifier(self._write_fd)
+
+  def test_ready(self):
+    self._notifier.ready(['unix:/tmp/daemon.sock', 'localhost:50050'])
+
+    status = readiness.wait(self._read_fd, timeout=1)
+
+    self.assertEqual(
+      status,
+      readiness.Status(
+        ready=True, addrs=['unix:/tmp/daemon.sock', 'localhost:50050']))
+
+  def test_failed(self):
+    self._notifier.failed('Could not bind')
+
+    status = readiness.wait(self._read_fd, timeout=1)
+
+    self.assertIsNotNone(status)
+    self.assertFalse(status.ready)
+    self.assertEqual(status.error, 'Could not bind')
+
+  def test_only_reports_once(self):
+    self._notifier.ready(['localhost:50050'])
+
+    # The fd is already closed, so this would raise if it wrote.
+    self._notifier.failed('Too late')
+
+    self.assertTrue(readiness.wait(self._read_fd, timeout=1).ready)
+
+  def test_exited_without_status(self):
+    # Like the daemon dying.
+    os.close(self._write_fd)
+
+    status = readiness.wait(self._read_fd, timeout=1)
+
+    self.assertEqual(status, readiness.Status(ready=False))
+
+  def test_timeout(self):
+    self.addCleanup(self._notifier.ready, [])
+
+    self.assertIsNone(readiness.wait(self._read_fd, timeout=0.01))
+
+
+if __name__ == '__main__':
+  absltest.main()
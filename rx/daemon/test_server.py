@@ -0,0 +1,209 @@
+import os
+import pathlib
+import socket
+import stat
+import tempfile
+import unittest
+from unittest import mock
+
+from absl import flags
+from absl.testing import absltest
+from absl.testing import flagsaver
+import grpc
+
+from rx.client.configuration import local
+from rx.daemon import client
+from rx.daemon import manager
+from rx.daemon import readiness
+from rx.daemon import server
+from rx.daemon.port_forwarding import service
+from rx.testing import fake_worker
+
+FLAGS = flags.FLAGS
+
+
+class _DaemonTest(unittest.TestCase):
+  """Keeps the daemon's files and the rxroot in a temp dir."""
+
+  def setUp(self) -> None:
+    super().setUp()
+    if not FLAGS.is_parsed():
+      FLAGS.mark_as_parsed()
+    self._tmpdir = tempfile.TemporaryDirectory()
+    self.addCleanup(self._tmpdir.cleanup)
+    self._root = pathlib.Path(self._tmpdir.name)
+    saved = flagsaver.save_flag_values()
+    self.addCleanup(flagsaver.restore_flag_values, saved)
+    FLAGS.daemon_dir = str(self._root / 'daemon')
+    local.get_daemon_dir().mkdir()
+    self._local_cfg = self._setup_rxroot('project')
+
+  def _setup_rxroot(self, name: str) -> local.LocalConfig:
+    rxroot = self._root / name
+    rxroot.mkdir()
+    return fake_worker.setup_rxroot(rxroot, 'localhost:1')
+
+
+class UnixSocketTests(_DaemonTest):
+
+  def setUp(self) -> None:
+    super().setUp()
+    self._handler = service.PortForwardingService()
+    self.addCleanup(self._handler.close_ports)
+    self._sock_file = local.get_daemon_socket_file()
+    self._addr = local.get_daemon_unix_addr()
+    assert self._addr is not None
+
+  def _start(self) -> grpc.Server:
+    srv = server._start_unix_server(self._sock_file, self._addr, self._handler)
+    assert srv is not None
+    self.addCleanup(srv.stop, None)
+    return srv
+
+  def test_socket_is_private(self):
+    self._start()
+
+    mode = stat.S_IMODE(self._sock_file.stat().st_mode)
+    self.assertEqual(mode, 0o600)
+
+  def test_replaces_stale_socket(self):
+    self._sock_file.touch()
+
+    self._start()
+
+    self.assertTrue(stat.S_ISSOCK(self._sock_file.stat().st_mode))
+
+  def test_client_does_not_need_pid(self):
+    self._start()
+    mgr = manager.DaemonManager(self._local_cfg)
+
+    self.assertEqual(mgr.daemon_addr, self._addr)
+    self.assertTrue(mgr.serves_deps)
+    with mgr.get_daemon_client() as cli:
+      # There's no pid file, so this would fail over TCP.
+      self.assertEqual(cli.info(), {})
+
+  def test_falls_back_to_tcp_without_socket(self):
+    mgr = manager.DaemonManager(self._local_cfg)
+
+    self.assertEqual(
+      mgr.daemon_addr, f'localhost:{local.DEFAULT_DAEMON_PORT}')
+    # Anyone local can connect over TCP.
+    self.assertFalse(mgr.serves_deps)
+
+  def test_long_paths_use_tcp(self):
+    FLAGS.daemon_dir = '/' + 'x' * 100
+
+    self.assertIsNone(local.get_daemon_unix_addr())
+
+  def test_version_is_still_checked(self):
+    self._start()
+    with grpc.insecure_channel(self._addr) as ch:
+      cli = client.Client(ch, self._local_cfg, check_pid=False)
+      cli._metadata = (('cv', '0.0.0'),)
+
+      with self.assertRaises(client.RetryError):
+        # Pretend the daemon is a process that can be killed.
+        with mock.patch('os.kill'):
+          cli.info()
+
+
+class MultipleRxrootsTests(_DaemonTest):
+
+  def setUp(self) -> None:
+    super().setUp()
+    self._handler = service.PortForwardingService()
+    self.addCleanup(self._handler.close_ports)
+    srv = server._start_unix_server(
+      local.get_daemon_socket_file(), local.get_daemon_unix_addr(),
+      self._handler)
+    self.addCleanup(srv.stop, None)
+
+  def _client(self, local_cfg: local.LocalConfig) -> client.Client:
+    mgr = manager.DaemonManager(local_cfg)
+    ctx = mgr.get_daemon_client()
+    cli = ctx.__enter__()
+    self.addCleanup(ctx.__exit__, None, None, None)
+    return cli
+
+  def test_ports_are_kept_per_rxroot(self):
+    first = self._client(self._local_cfg)
+    second = self._client(self._setup_rxroot('other'))
+    first_port = _free_port()
+    second_port = _free_port()
+
+    first.open_port(8080, local_port=first_port)
+    second.open_port(8080, local_port=second_port)
+
+    self.assertEqual(list(first.info()), [first_port])
+    self.assertEqual(list(second.info()), [second_port])
+    self.assertEqual(first.get_ports().workspaces, 2)
+
+  def test_rxroot_is_dropped_with_its_last_port(self):
+    cli = self._client(self._local_cfg)
+    port = _free_port()
+    cli.open_port(8080, local_port=port)
+
+    cli.close_port(port)
+
+    self.assertEqual(cli.info(), {})
+    self.assertEqual(cli.get_ports().workspaces, 0)
+
+  def test_metrics(self):
+    cli = self._client(self._local_cfg)
+    port = _free_port()
+    cli.open_port(8080, local_port=port)
+
+    got = {
+      (s.name, tuple(s.labels.items())): s for s in cli.get_metrics()}
+
+    self.assertEqual(got[('daemon.workspaces', ())].value, 1)
+    sample = got[('port_forward.active_connections', (('port', str(port)),))]
+    self.assertEqual(sample.kind, 'gauge')
+    self.assertEqual(sample.value, 0)
+
+  def test_unknown_rxroot(self):
+    cli = self._client(local.LocalConfig(
+      cwd=self._root / 'missing', project_name='test',
+      rsync_path='/usr/bin/rsync'))
+
+    with self.assertRaises(client.DaemonUnavailable):
+      cli.open_port(8080, local_port=_free_port())
+
+  def test_other_users_rxroot_is_refused(self):
+    cli = self._client(self._local_cfg)
+
+    with mock.patch.object(
+        service.os, 'getuid', return_value=os.getuid() + 1):
+      with self.assertRaisesRegex(
+          client.DaemonUnavailable, 'does not belong'):
+        cli.open_port(8080, local_port=_free_port())
+    self.assertEqual(cli.get_ports().workspaces, 0)
+
+
+class StartServerTests(_DaemonTest):
+
+  def test_reports_bind_failure(self):
+    taken = socket.socket()
+    self.addCleanup(taken.close)
+    taken.bind(('127.0.0.1', 0))
+    taken.listen()
+    read_fd, write_fd = os.pipe()
+
+    server._start_server(
+      taken.getsockname()[1], readiness.Notifier(write_fd))
+
+    status = readiness.wait(read_fd, timeout=1)
+    self.assertIsNotNone(status)
+    self.assertFalse(status.ready)
+    self.assertIn('Could not bind', status.error)
+
+
+def _free_port() -> int:
+  with socket.socket() as s:
+    s.bind(('127.0.0.1', 0))
+    return s.getsockname()[1]
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,189 @@
+import pathlib
+import tempfile
+import unittest
+from unittest import mock
+
+from absl import flags
+from absl.testing import absltest
+
+from rx.client import login
+from rx.client.configuration import local
+from rx.client.configuration import remote
+from rx.daemon import worker_channel
+from rx.testing import fake_worker
+
+FLAGS = flags.FLAGS
+
+
+class WorkerChannelTests(unittest.TestCase):
+
+  def setUp(self) -> None:
+    super().setUp()
+    if not FLAGS.is_parsed():
+      FLAGS.mark_as_parsed()
+    self._tmpdir = tempfile.TemporaryDirectory()
+    self._rxroot = pathlib.Path(self._tmpdir.name)
+    local.get_local_config_path(self._rxroot).parent.mkdir(parents=True)
+    self._set_worker_addr('localhost:50051')
+    self._local_cfg = local.LocalConfig(
+      cwd=self._rxroot, project_name='test', rsync_path='/usr/bin/rsync')
+    patcher = mock.patch.object(login, 'LoginManager', autospec=True)
+    self._login_manager = patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def tearDown(self) -> None:
+    self._tmpdir.cleanup()
+    super().tearDown()
+
+  def test_client_is_shared(self):
+    worker = worker_channel.WorkerChannel(self._local_cfg)
+
+    first = worker.get_client()
+    second = worker.get_client()
+
+    self.assertIs(first, second)
+    self._login_manager.assert_called_once()
+    worker.close()
+
+  def test_reconnect_once_per_disconnect(self):
+    worker = worker_channel.WorkerChannel(self._local_cfg)
+    stale = worker.get_client()
+
+    # Every forwarder reports the same disconnect.
+    worker.reconnect(stale)
+    fresh = worker.get_client()
+    worker.reconnect(stale)
+
+    self.assertIsNot(fresh, stale)
+    self.assertIs(worker.get_client(), fresh)
+    # Credentials are reused across reconnects.
+    self._login_manager.assert_called_once()
+    worker.close()
+
+  def test_worker_move_is_picked_up(self):
+    worker = worker_channel.WorkerChannel(self._local_cfg)
+    old = worker.get_client()
+
+    self._set_worker_addr('127.0.0.1:50052')
+    new = worker.get_client()
+
+    self.assertIsNot(new, old)
+    self.assertEqual(worker.worker_addr, '127.0.0.1:50052')
+    worker.close()
+
+  def test_new_workspace_is_picked_up(self):
+    worker = worker_channel.WorkerChannel(self._local_cfg)
+    old = worker.get_client()
+
+    # E.g., `rx init` was run again and got the same worker.
+    self._set_worker_addr('localhost:50051', workspace_id='ws4567')
+    new = worker.get_client()
+
+    self.assertIsNot(new, old)
+    self.assertIs(worker.get_client(), new)
+    worker.close()
+
+  def test_wait_for_ready(self):
+    server, addr = fake_worker.start_server(
+      fake_worker.FakeExecutionService())
+    self.addCleanup(server.stop, None)
+    self._set_worker_addr(addr)
+    worker = worker_channel.WorkerChannel(self._local_cfg)
+
+    self.assertTrue(worker.wait_for_ready(timeout=5))
+    worker.close()
+
+  def test_wait_for_ready_times_out(self):
+    # Nothing is listening on 50051.
+    worker = worker_channel.WorkerChannel(self._local_cfg)
+
+    self.assertFalse(worker.wait_for_ready(timeout=0.1))
+    worker.close()
+
+  def test_rxroots_on_one_worker_share_a_channel(self):
+    channels = worker_channel.ChannelPool()
+    other_root = self._rxroot / 'other'
+    local.get_local_config_path(other_root).parent.mkdir(parents=True)
+    with remote.WritableRemote(other_root) as r:
+      r['workspace_id'] = 'ws456'
+      r['worker_addr'] = 'localhost:50051'
+      r['daemon_module'] = 'ws456'
+    first = worker_channel.WorkerChannel(self._local_cfg, channels)
+    second = worker_channel.WorkerChannel(
+      local.LocalConfig(
+        cwd=other_root, project_name='other', rsync_path='/usr/bin/rsync'),
+      channels)
+
+    first.get_client()
+    second.get_client()
+
+    self.assertEqual(channels.size, 1)
+    # Each rxroot still has its own credentials.
+    self.assertEqual(self._login_manager.call_count, 2)
+    first.close()
+    self.assertEqual(channels.size, 1)
+    second.close()
+    self.assertEqual(channels.size, 0)
+
+  def _set_worker_addr(self, addr: str, workspace_id: str = 'ws123'):
+    with remote.WritableRemote(self._rxroot) as r:
+      r['workspace_id'] = workspace_id
+      r['worker_addr'] = addr
+      r['daemon_module'] = workspace_id
+
+
+class ChannelPoolTests(unittest.TestCase):
+
+  def test_channel_is_shared_until_released(self):
+    channels = worker_channel.ChannelPool()
+
+    first = channels.acquire('localhost:50051')
+    second = channels.acquire('localhost:50051')
+    other = channels.acquire('localhost:50052')
+
+    self.assertIs(first, second)
+    self.assertIsNot(first, other)
+    channels.release('localhost:50051', first)
+    channels.release('localhost:50051', second)
+    channels.release('localhost:50052', other)
+    self.assertEqual(channels.size, 0)
+
+  def test_broken_channel_is_replaced(self):
+    channels = worker_channel.ChannelPool()
+    broken = channels.acquire('localhost:50051')
+    still_using = channels.acquire('localhost:50051')
+
+    channels.release('localhost:50051', broken, broken=True)
+    fresh = channels.acquire('localhost:50051')
+
+    self.assertIsNot(fresh, broken)
+    self.assertEqual(channels.size, 2)
+    channels.release('localhost:50051', still_using)
+    channels.release('localhost:50051', fresh)
+    self.assertEqual(channels.size, 0)
+
+
+class BackoffTests(unittest.TestCase):
+
+  def test_delay_grows_to_max(self):
+    backoff = worker_channel.Backoff(
+      initial_secs=1, max_secs=4, multiplier=2, jitter=0)
+
+    got = [backoff.next_delay() for _ in range(4)]
+
+    self.assertEqual(got, [1, 2, 4, 4])
+
+  def test_jitter_and_reset(self):
+    backoff = worker_channel.Backoff(initial_secs=1, jitter=0.5)
+    backoff.next_delay()
+    backoff.next_delay()
+
+    backoff.reset()
+    got = backoff.next_delay()
+
+    self.assertGreaterEqual(got, 0.5)
+    self.assertLessEqual(got, 1.5)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,234 @@
+"""Connections to workers, shared across the daemon."""
+import functools
+import os
+import random
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+from absl import logging
+import grpc
+
+from rx.client import grpc_helper
+from rx.client import login
+from rx.client import worker_client
+from rx.client.configuration import local
+from rx.client.configuration import remote
+
+# gRPC's default reconnect backoff goes up to two minutes, which is far too
+# long to leave a forwarded port dead after a blip.
+_CHANNEL_OPTIONS = (
+  ('grpc.initial_reconnect_backoff_ms', 100),
+  ('grpc.min_reconnect_backoff_ms', 100),
+  ('grpc.max_reconnect_backoff_ms', 5000),
+)
+# gRPC's connectivity polling thread raises if its channel is closed out from
+# under it. It notices an unsubscribe within 200ms, so wait that long before
+# closing.
+_CLOSE_DELAY_SECS = 0.5
+
+
+class Backoff:
+  """Jittered exponential backoff."""
+
+  def __init__(
+      self,
+      initial_secs: float = 0.1,
+      max_secs: float = 10,
+      multiplier: float = 2,
+      jitter: float = 0.2) -> None:
+    self._initial = initial_secs
+    self._max = max_secs
+    self._multiplier = multiplier
+    self._jitter = jitter
+    self._current = initial_secs
+
+  def next_delay(self) -> float:
+    """Returns how long to wait before the next attempt."""
+    delay = self._current
+    self._current = min(self._current * self._multiplier, self._max)
+    return delay * random.uniform(1 - self._jitter, 1 + self._jitter)
+
+  def reset(self):
+    self._current = self._initial
+
+
+class ChannelPool:
+  """Channels to workers, shared by every rxroot on the same worker.
+
+  Each rxroot's client authenticates its own calls, so the calls can share one
+  HTTP/2 connection.
+  """
+
+  def __init__(self) -> None:
+    self._lock = threading.Lock()
+    # The channel new users of each worker get.
+    self._channels: Dict[str, grpc.Channel] = {}
+    # How many users each open channel has.
+    self._users: Dict[grpc.Channel, int] = {}
+
+  def acquire(self, addr: str) -> grpc.Channel:
+    with self._lock:
+      channel = self._channels.get(addr)
+      if channel is None:
+        channel = grpc_helper.get_channel(addr, _CHANNEL_OPTIONS)
+        self._channels[addr] = channel
+        self._users[channel] = 0
+      self._users[channel] += 1
+      return channel
+
+  def release(self, addr: str, channel: grpc.Channel, broken: bool = False):
+    """Gives up a channel, closing it once nothing else is using it.
+
+    If it's broken, later acquires get a new channel, even while other users
+    still have this one.
+    """
+    with self._lock:
+      if broken and self._channels.get(addr) is channel:
+        del self._channels[addr]
+      self._users[channel] -= 1
+      if self._users[channel] > 0:
+        return
+      del self._users[channel]
+      if self._channels.get(addr) is channel:
+        del self._channels[addr]
+    closer = threading.Timer(_CLOSE_DELAY_SECS, channel.close)
+    closer.daemon = True
+    closer.start()
+
+  @property
+  def size(self) -> int:
+    """How many channels are open."""
+    with self._lock:
+      return len(self._users)
+
+
+class WorkerChannel:
+  """Owns the authed client that every forwarder in an rxroot uses.
+
+  gRPC multiplexes all calls over one HTTP/2 connection, so there's no need for
+  each forwarded port to have its own. Sharing it also means that when the
+  worker goes away, it is reconnected (and re-authed) once rather than once per
+  port.
+
+  The remote config is re-read whenever it changes, so if the workspace is
+  moved to a new worker (e.g., by `rx` unfreezing it) the next connection goes
+  to the new address. Likewise, if `rx init` replaces the workspace, the next
+  client is for the new one.
+
+  The channel itself comes from a ChannelPool, so rxroots on the same worker
+  share it.
+  """
+
+  def __init__(
+      self,
+      local_cfg: local.LocalConfig,
+      channels: Optional[ChannelPool] = None) -> None:
+    self._local_cfg = local_cfg
+    self._channels = ChannelPool() if channels is None else channels
+    self._remote_file = remote.get_remote_config_file(local_cfg.cwd)
+    self._remote_stat: Optional[Tuple[int, int]] = None
+    self._worker_addr: Optional[str] = None
+    self._workspace_id: Optional[str] = None
+    self._lock = threading.Lock()
+    self._login_manager: Optional[login.LoginManager] = None
+    self._channel: Optional[grpc.Channel] = None
+    self._channel_addr: Optional[str] = None
+    self._state_callback: Optional[Callable[[grpc.ChannelConnectivity], None]] = None
+    self._client: Optional[worker_client.Client] = None
+    self._client_workspace_id: Optional[str] = None
+    self._state: Optional[grpc.ChannelConnectivity] = None
+    self._state_cv = threading.Condition()
+
+  @property
+  def worker_addr(self) -> str:
+    with self._lock:
+      return self._get_worker_addr()
+
+  def get_client(self) -> worker_client.Client:
+    """Returns the shared client, connecting if necessary."""
+    with self._lock:
+      addr = self._get_worker_addr()
+      if self._client is not None and addr != self._channel_addr:
+        logging.info(
+          'Worker moved from %s to %s, reconnecting', self._channel_addr, addr)
+        self._close(broken=False)
+      elif (self._client is not None and
+            self._workspace_id != self._client_workspace_id):
+        logging.info(
+          'Workspace changed to %s, reconnecting', self._workspace_id)
+        self._close(broken=False)
+      if self._client is None:
+        if self._login_manager is None:
+          self._login_manager = login.LoginManager(self._local_cfg.cwd)
+          self._login_manager.login()
+        logging.info('Connecting to worker %s', addr)
+        self._channel = self._channels.acquire(addr)
+        self._channel_addr = addr
+        self._state_callback = functools.partial(
+          self._on_state_change, self._channel)
+        self._channel.subscribe(self._state_callback, try_to_connect=True)
+        self._client = worker_client.Client(
+          self._channel, self._local_cfg, self._login_manager)
+        self._client_workspace_id = self._workspace_id
+      return self._client
+
+  def reconnect(self, stale: worker_client.Client):
+    """Drops the connection that `stale` was using.
+
+    Every forwarder notices a disconnect, but only the first report for a given
+    client closes the channel; the rest find it has already been replaced.
+    """
+    with self._lock:
+      if self._client is not stale:
+        return
+      self._close(broken=True)
+
+  def wait_for_ready(self, timeout: float) -> bool:
+    """Waits up to timeout secs for the worker to be reachable.
+
+    This returns as soon as the channel reports it is READY, so callers can
+    retry immediately rather than sleeping out their whole backoff.
+    """
+    self.get_client()
+    with self._state_cv:
+      return self._state_cv.wait_for(
+        lambda: self._state == grpc.ChannelConnectivity.READY, timeout)
+
+  def close(self):
+    with self._lock:
+      self._close(broken=False)
+
+  def _get_worker_addr(self) -> str:
+    """Re-reads the remote config if it has changed on disk."""
+    try:
+      st = os.stat(self._remote_file)
+      stat = (st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+      stat = None
+    if self._worker_addr is None or stat != self._remote_stat:
+      r = remote.Remote(self._local_cfg.cwd)
+      self._worker_addr = r.worker_addr
+      self._workspace_id = r.workspace_id
+      self._remote_stat = stat
+    assert self._worker_addr
+    return self._worker_addr
+
+  def _on_state_change(
+      self, channel: grpc.Channel, state: grpc.ChannelConnectivity):
+    if channel is not self._channel:
+      # Stale notification from a channel we've closed.
+      return
+    logging.info('Worker channel is %s', state)
+    with self._state_cv:
+      self._state = state
+      self._state_cv.notify_all()
+
+  def _close(self, broken: bool):
+    if self._channel is not None:
+      self._channel.unsubscribe(self._state_callback)
+      assert self._channel_addr
+      self._channels.release(self._channel_addr, self._channel, broken)
+    self._channel = None
+    self._client = None
+    with self._state_cv:
+      self._state = None
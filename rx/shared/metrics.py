@@ -0,0 +1,354 @@
+"""Counters, gauges and latency histograms that are cheap enough for hot paths.
+
+Metrics are looked up by name (and optional labels) in the process's registry:
+
+  _SENT = metrics.counter('rsync.bytes_sent')
+  ...
+  _SENT.inc(len(buf))
+
+  with metrics.timer('rsync.duration_secs', op='to_remote'):
+    ...
+
+The same name and labels always return the same metric, so hot paths should
+look theirs up once and hold on to it. snapshot() returns everything recorded
+so far: the daemon serves it over GetMetrics (and, optionally, Prometheus) and
+the CLI writes it to --metrics_out.
+"""
+import contextlib
+import dataclasses
+import http.server
+import json
+import math
+import threading
+import time
+from typing import (
+  Any, Callable, Dict, Generator, Iterable, List, Tuple, Type, TypeVar)
+
+from absl import logging
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+# Each power of two is split into this many buckets, so a percentile is within
+# 1/_SUB_BUCKETS (~3%) of the true value at any scale.
+_SUB_BUCKETS = 32
+PERCENTILES = (50, 90, 99)
+
+_Labels = Tuple[Tuple[str, str], ...]
+
+
+@dataclasses.dataclass
+class Sample:
+  """One metric's value at snapshot time."""
+  name: str
+  kind: str
+  labels: Dict[str, str] = dataclasses.field(default_factory=dict)
+  # Counters and gauges.
+  value: float = 0
+  # Histograms.
+  count: int = 0
+  sum: float = 0
+  min: float = 0
+  max: float = 0
+  percentiles: Dict[int, float] = dataclasses.field(default_factory=dict)
+
+  def to_dict(self) -> Dict[str, Any]:
+    d: Dict[str, Any] = {'name': self.name, 'kind': self.kind}
+    if self.labels:
+      d['labels'] = self.labels
+    if self.kind == HISTOGRAM:
+      d.update(count=self.count, sum=self.sum, min=self.min, max=self.max)
+      for pct, value in self.percentiles.items():
+        d[f'p{pct}'] = value
+    else:
+      d['value'] = self.value
+    return d
+
+
+class Counter:
+  """A count that only goes up."""
+  kind = COUNTER
+
+  def __init__(self) -> None:
+    self._value = 0
+    self._lock = threading.Lock()
+
+  def inc(self, n: float = 1):
+    with self._lock:
+      self._value += n
+
+  @property
+  def value(self) -> float:
+    return self._value
+
+  def _fill(self, sample: Sample):
+    sample.value = self._value
+
+
+class Gauge:
+  """A value that is set, e.g., how many connections are open."""
+  kind = GAUGE
+
+  def __init__(self) -> None:
+    self._value = 0
+    self._lock = threading.Lock()
+
+  def set(self, value: float):
+    self._value = value
+
+  def inc(self, n: float = 1):
+    with self._lock:
+      self._value += n
+
+  def dec(self, n: float = 1):
+    self.inc(-n)
+
+  @property
+  def value(self) -> float:
+    return self._value
+
+  def _fill(self, sample: Sample):
+    sample.value = self._value
+
+
+class Histogram:
+  """Distribution of recorded values, in log-linear buckets.
+
+  Like HdrHistogram, each power of two gets the same number of linear
+  buckets, so it takes little memory whether values are microseconds or
+  minutes, and percentiles have the same relative error at any scale.
+  """
+  kind = HISTOGRAM
+
+  def __init__(self) -> None:
+    self._buckets: Dict[int, int] = {}
+    # Values <= 0 don't have a log bucket.
+    self._zeros = 0
+    self._count = 0
+    self._sum = 0.0
+    self._min = math.inf
+    self._max = -math.inf
+    self._lock = threading.Lock()
+
+  def record(self, value: float):
+    with self._lock:
+      self._count += 1
+      self._sum += value
+      self._min = min(self._min, value)
+      self._max = max(self._max, value)
+      if value <= 0:
+        self._zeros += 1
+        return
+      key = _bucket(value)
+      self._buckets[key] = self._buckets.get(key, 0) + 1
+
+  @property
+  def count(self) -> int:
+    return self._count
+
+  def percentile(self, pct: float) -> float:
+    """Returns the value pct% of recorded values are at or below."""
+    with self._lock:
+      return self._percentile(pct)
+
+  def _percentile(self, pct: float) -> float:
+    if not self._count:
+      return 0
+    rank = max(1, math.ceil(pct / 100 * self._count))
+    seen = self._zeros
+    if seen >= rank:
+      return max(self._min, 0)
+    for key in sorted(self._buckets):
+      seen += self._buckets[key]
+      if seen >= rank:
+        # The bucket's upper bound, but never past what was recorded.
+        return min(_upper_bound(key), self._max)
+    return self._max
+
+  def _fill(self, sample: Sample):
+    with self._lock:
+      sample.count = self._count
+      sample.sum = self._sum
+      if self._count:
+        sample.min = self._min
+        sample.max = self._max
+      sample.percentiles = {p: self._percentile(p) for p in PERCENTILES}
+
+
+def _bucket(value: float) -> int:
+  mantissa, exponent = math.frexp(value)
+  # mantissa is in [0.5, 1).
+  return exponent * _SUB_BUCKETS + int((mantissa - 0.5) * 2 * _SUB_BUCKETS)
+
+
+def _upper_bound(key: int) -> float:
+  exponent, sub = divmod(key, _SUB_BUCKETS)
+  return math.ldexp(0.5 + (sub + 1) / (2 * _SUB_BUCKETS), exponent)
+
+
+_Metric = TypeVar('_Metric', Counter, Gauge, Histogram)
+# Returns samples computed at snapshot time, e.g., from a service's state.
+Collector = Callable[[], Iterable[Sample]]
+
+
+class Registry:
+  """All of the metrics in a process."""
+
+  def __init__(self) -> None:
+    self._metrics: Dict[Tuple[str, _Labels], Any] = {}
+    self._collectors: List[Collector] = []
+    self._lock = threading.Lock()
+
+  def counter(self, name: str, **labels: str) -> Counter:
+    return self._get(Counter, name, labels)
+
+  def gauge(self, name: str, **labels: str) -> Gauge:
+    return self._get(Gauge, name, labels)
+
+  def histogram(self, name: str, **labels: str) -> Histogram:
+    return self._get(Histogram, name, labels)
+
+  def add_collector(self, collector: Collector):
+    with self._lock:
+      self._collectors.append(collector)
+
+  def remove_collector(self, collector: Collector):
+    with self._lock:
+      if collector in self._collectors:
+        self._collectors.remove(collector)
+
+  def snapshot(self) -> List[Sample]:
+    with self._lock:
+      metrics = list(self._metrics.items())
+      collectors = list(self._collectors)
+    samples = []
+    for (name, labels), metric in metrics:
+      sample = Sample(name=name, kind=metric.kind, labels=dict(labels))
+      metric._fill(sample)
+      samples.append(sample)
+    for collector in collectors:
+      try:
+        samples.extend(collector())
+      except Exception:  # pylint: disable=broad-except
+        # Don't lose every other metric because of one.
+        logging.exception('Error collecting metrics')
+    samples.sort(key=lambda s: (s.name, sorted(s.labels.items())))
+    return samples
+
+  def _get(
+      self, cls: Type[_Metric], name: str, labels: Dict[str, str]) -> _Metric:
+    key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+    with self._lock:
+      metric = self._metrics.get(key)
+      if metric is None:
+        metric = cls()
+        self._metrics[key] = metric
+    if not isinstance(metric, cls):
+      raise ValueError(f'{name} is a {metric.kind}, not a {cls.kind}')
+    return metric
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, **labels: str) -> Counter:
+  return REGISTRY.counter(name, **labels)
+
+
+def gauge(name: str, **labels: str) -> Gauge:
+  return REGISTRY.gauge(name, **labels)
+
+
+def histogram(name: str, **labels: str) -> Histogram:
+  return REGISTRY.histogram(name, **labels)
+
+
+@contextlib.contextmanager
+def timer(name: str, **labels: str) -> Generator[None, None, None]:
+  """Records how long the block took, in seconds, even if it raises."""
+  hist = histogram(name, **labels)
+  start = time.monotonic()
+  try:
+    yield
+  finally:
+    hist.record(time.monotonic() - start)
+
+
+def to_json(samples: Iterable[Sample]) -> str:
+  return json.dumps([s.to_dict() for s in samples], indent=2)
+
+
+def write_json(path: str, registry: Registry = REGISTRY):
+  with open(path, mode='wt', encoding='utf-8') as fh:
+    fh.write(to_json(registry.snapshot()))
+    fh.write('\n')
+
+
+def to_prometheus(samples: Iterable[Sample]) -> str:
+  """Formats samples in Prometheus's text exposition format.
+
+  Histograms are exposed as summaries, since their buckets don't line up with
+  Prometheus's.
+  """
+  lines = []
+  typed = set()
+  for s in samples:
+    name = 'rx_' + s.name.replace('.', '_').replace('-', '_')
+    if name not in typed:
+      typed.add(name)
+      prom_type = 'summary' if s.kind == HISTOGRAM else s.kind
+      lines.append(f'# TYPE {name} {prom_type}')
+    if s.kind == HISTOGRAM:
+      for pct, value in s.percentiles.items():
+        labels = _prometheus_labels(s.labels, quantile=str(pct / 100))
+        lines.append(f'{name}{labels} {value!r}')
+      labels = _prometheus_labels(s.labels)
+      lines.append(f'{name}_sum{labels} {s.sum!r}')
+      lines.append(f'{name}_count{labels} {s.count}')
+    else:
+      lines.append(f'{name}{_prometheus_labels(s.labels)} {s.value!r}')
+  return '\n'.join(lines) + '\n'
+
+
+def _prometheus_labels(labels: Dict[str, str], **extra: str) -> str:
+  labels = dict(labels, **extra)
+  if not labels:
+    return ''
+  escaped = (
+    v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    for v in labels.values())
+  return '{' + ','.join(
+    f'{k}="{v}"' for k, v in zip(labels.keys(), escaped)) + '}'
+
+
+class _PrometheusHandler(http.server.BaseHTTPRequestHandler):
+  registry = REGISTRY
+
+  def do_GET(self):
+    if self.path.split('?')[0] != '/metrics':
+      self.send_error(404)
+      return
+    body = to_prometheus(self.registry.snapshot()).encode('utf-8')
+    self.send_response(200)
+    self.send_header('Content-Type', 'text/plain; version=0.0.4')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format: str, *args: Any) -> None:
+    del format
+    del args
+
+
+def serve_prometheus(
+    port: int, registry: Registry = REGISTRY,
+) -> http.server.ThreadingHTTPServer:
+  """Serves /metrics on localhost:port from a background thread."""
+  handler = type(
+    '_Handler', (_PrometheusHandler,), {'registry': registry})
+  server = http.server.ThreadingHTTPServer(('127.0.0.1', port), handler)
+  server.daemon_threads = True
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  logging.info('Serving metrics on localhost:%s', server.server_address[1])
+  return server
@@ -1,53 +1,174 @@
-from typing import Iterable, Optional, cast
+"""Shows the progress of docker image pulls and pushes.
 
+Images can have dozens of layers, each sending progress many times a second.
+Rather than a bar per layer redrawn on every message, this shows one bar for
+the whole image (bytes, throughput and ETA) plus the few layers with the most
+left to go, redrawn at most _MAX_FPS times a second. If the output isn't a
+terminal, it prints a one-line summary every _SUMMARY_SECS instead.
+"""
+import dataclasses
+import sys
+import time
+from typing import Callable, Dict, Iterable, List, Optional, TextIO, cast
+
+from absl import logging
 import grpc
 import tqdm
 
 from rx.proto import rx_pb2
+from rx.shared import metrics
+
+_MAX_FPS = 10
+# How many of the unfinished layers to show under the total.
+_TOP_LAYERS = 3
+_SUMMARY_SECS = 10
+# Docker sends these (without a total) once a layer's bytes are all there.
+_DONE_STATUSES = frozenset([
+  'Already exists',
+  'Download complete',
+  'Layer already exists',
+  'Pull complete',
+  'Pushed',
+])
+
+_BYTES = metrics.counter('image.bytes')
+_THROUGHPUT = metrics.histogram('image.bytes_per_sec')
 
 
 def show_progress_bars(
     it: Iterable[rx_pb2.DockerImageProgress]) -> Optional[rx_pb2.Result]:
-  progress_bars = {}
+  renderer = Renderer()
   try:
     for pp in it:
-      if pp.id not in progress_bars:
-        # First item must have a total.
-        if pp.total == 0:
-          continue
-        progress_bars[pp.id] = ProgressBar(pp)
-      progress_bars[pp.id].update(pp)
+      renderer.update(pp)
   except grpc.RpcError as e:
     e = cast(grpc.Call, e)
     return rx_pb2.Result(code=rx_pb2.UNKNOWN, message=e.details())
   finally:
-    for p in progress_bars.values():
-      p.close()
+    renderer.close()
 
 
-class ProgressBar:
+def write(msg: str):
+  """Prints a line above any progress bars, without garbling them."""
+  tqdm.tqdm.write(msg)
 
-  def __init__(self, pp: rx_pb2.DockerImageProgress) -> None:
-    assert pp.total > 0
-    self._bar = tqdm.tqdm(
-      desc=f'{pp.status} layer {pp.id}',
-      total=pp.total,
-      unit=' bytes',
-      unit_scale=True,
-      bar_format='{l_bar}{bar:10}{r_bar}{bar:-10b}')
-    self._is_done = False
 
-  def close(self):
-    self._bar.close()
+@dataclasses.dataclass
+class _Layer:
+  status: str = ''
+  # The first total docker sent. Extracting a layer restarts its progress at
+  # 0, but those bytes were already counted.
+  total: int = 0
+  current: int = 0
+  done: bool = False
+
+
+class Renderer:
+  """Adds up every layer's progress and draws it at a limited rate."""
+
+  def __init__(
+      self,
+      out: Optional[TextIO] = None,
+      is_tty: Optional[bool] = None,
+      clock: Callable[[], float] = time.monotonic) -> None:
+    self._out = sys.stderr if out is None else out
+    self._is_tty = self._out.isatty() if is_tty is None else is_tty
+    self._clock = clock
+    self._layers: Dict[str, _Layer] = {}
+    self._total = 0
+    self._current = 0
+    self._done = 0
+    self._start = clock()
+    self._interval = 1 / _MAX_FPS if self._is_tty else _SUMMARY_SECS
+    self._next_draw = self._start + self._interval
+    self._bar: Optional[tqdm.tqdm] = None
+    self._layer_bars: List[tqdm.tqdm] = []
+
+  @property
+  def throughput(self) -> float:
+    """Bytes per second since the renderer was created."""
+    elapsed = self._clock() - self._start
+    return self._current / elapsed if elapsed > 0 else 0
 
   def update(self, pp: rx_pb2.DockerImageProgress):
-    if pp.total == 0:
-      self._bar.set_description(f'{pp.status} layer {pp.id}')
-      return
-    if self._is_done:
+    layer = self._layers.get(pp.id)
+    if layer is None:
+      layer = _Layer()
+      self._layers[pp.id] = layer
+    layer.status = pp.status
+    if pp.total > 0:
+      if not layer.total:
+        layer.total = pp.total
+        self._total += pp.total
+      self._set_current(layer, max(layer.current, min(pp.current, layer.total)))
+    if not layer.done and pp.status in _DONE_STATUSES:
+      layer.done = True
+      self._done += 1
+      self._set_current(layer, layer.total)
+    now = self._clock()
+    if now >= self._next_draw:
+      self._draw()
+      self._next_draw = now + self._interval
+
+  def close(self):
+    if self._layers:
+      self._draw()
+    for bar in self._layer_bars:
+      bar.close()
+    if self._bar:
+      self._bar.close()
+    if self._current:
+      _BYTES.inc(self._current)
+      _THROUGHPUT.record(self.throughput)
+      logging.info(
+        'Transferred %s of %d layers at %s/s', _format_bytes(self._current),
+        len(self._layers), _format_bytes(self.throughput))
+
+  def summary(self) -> str:
+    """E.g., '12.3MB/45.6MB (27%) at 2.10MB/s, 3/12 layers done'."""
+    pct = 100 * self._current // self._total if self._total else 0
+    return (
+      f'{_format_bytes(self._current)}/{_format_bytes(self._total)} ({pct}%) '
+      f'at {_format_bytes(self.throughput)}/s, '
+      f'{self._done}/{len(self._layers)} layers done')
+
+  def _set_current(self, layer: _Layer, current: int):
+    self._current += current - layer.current
+    layer.current = current
+
+  def _draw(self):
+    if not self._is_tty:
+      self._out.write(f'{self.summary()}\n')
+      self._out.flush()
       return
+    if self._bar is None:
+      self._bar = tqdm.tqdm(
+        file=self._out,
+        unit='B',
+        unit_scale=True,
+        bar_format='{l_bar}{bar:10}{r_bar}{bar:-10b}')
+      self._layer_bars = [
+        tqdm.tqdm(file=self._out, bar_format='{desc}', leave=False)
+        for _ in range(_TOP_LAYERS)]
+    self._bar.total = self._total
+    self._bar.n = self._current
+    self._bar.set_description_str(
+      f'{self._done}/{len(self._layers)} layers', refresh=False)
+    self._bar.refresh()
+    top = sorted(
+      ((lid, layer) for lid, layer in self._layers.items()
+       if not layer.done and layer.total),
+      key=lambda x: x[1].current - x[1].total)[:_TOP_LAYERS]
+    for i, bar in enumerate(self._layer_bars):
+      desc = ''
+      if i < len(top):
+        lid, layer = top[i]
+        desc = (
+          f'  {layer.status} layer {lid}: {_format_bytes(layer.current)}/'
+          f'{_format_bytes(layer.total)}')
+      bar.set_description_str(desc, refresh=False)
+      bar.refresh()
+
 
-    # Note: this jumps back to 0 for download -> extract, which is good?
-    self._bar.update(pp.current - self._bar.n)
-    if self._bar.n == pp.total:
-      self._is_done = True
+def _format_bytes(n: float) -> str:
+  return tqdm.tqdm.format_sizeof(n, suffix='B')
@@ -0,0 +1,134 @@
+import json
+import random
+import unittest
+from urllib import request
+
+from absl.testing import absltest
+
+from rx.shared import metrics
+
+
+class HistogramTests(unittest.TestCase):
+
+  def test_percentiles_are_close(self):
+    hist = metrics.Histogram()
+    values = [random.uniform(0.001, 10) for _ in range(10000)]
+    for v in values:
+      hist.record(v)
+    values.sort()
+
+    for pct in (50, 90, 99):
+      want = values[int(pct / 100 * len(values)) - 1]
+      got = hist.percentile(pct)
+      self.assertAlmostEqual(got, want, delta=want * 0.05)
+
+  def test_extremes(self):
+    hist = metrics.Histogram()
+    for v in (0, 0.000001, 3600):
+      hist.record(v)
+
+    self.assertEqual(hist.percentile(0), 0)
+    self.assertEqual(hist.percentile(100), 3600)
+    self.assertEqual(hist.count, 3)
+
+  def test_empty(self):
+    self.assertEqual(metrics.Histogram().percentile(99), 0)
+
+
+class RegistryTests(unittest.TestCase):
+
+  def test_same_name_and_labels_are_one_metric(self):
+    registry = metrics.Registry()
+
+    first = registry.counter('bytes', port='80')
+    second = registry.counter('bytes', port='80')
+    other = registry.counter('bytes', port='81')
+
+    self.assertIs(first, second)
+    self.assertIsNot(first, other)
+
+  def test_kind_mismatch(self):
+    registry = metrics.Registry()
+    registry.counter('bytes')
+
+    with self.assertRaises(ValueError):
+      registry.gauge('bytes')
+
+  def test_snapshot_includes_collectors(self):
+    registry = metrics.Registry()
+    registry.counter('requests').inc(3)
+    registry.histogram('latency_secs').record(0.5)
+    registry.add_collector(lambda: [
+      metrics.Sample(name='queued', kind=metrics.GAUGE, value=7)])
+
+    got = [s.to_dict() for s in registry.snapshot()]
+
+    self.assertEqual(got, [
+      {
+        'name': 'latency_secs', 'kind': 'histogram', 'count': 1, 'sum': 0.5,
+        'min': 0.5, 'max': 0.5, 'p50': 0.5, 'p90': 0.5, 'p99': 0.5,
+      },
+      {'name': 'queued', 'kind': 'gauge', 'value': 7},
+      {'name': 'requests', 'kind': 'counter', 'value': 3},
+    ])
+
+  def test_broken_collector_is_skipped(self):
+    registry = metrics.Registry()
+    registry.counter('requests').inc()
+    registry.add_collector(lambda: 1 / 0)
+
+    self.assertEqual([s.name for s in registry.snapshot()], ['requests'])
+
+  def test_timer(self):
+    with metrics.timer('test.timer_secs', op='sleep'):
+      pass
+
+    self.assertEqual(metrics.histogram('test.timer_secs', op='sleep').count, 1)
+
+
+class PrometheusTests(unittest.TestCase):
+
+  def test_format(self):
+    registry = metrics.Registry()
+    registry.counter('port_forward.bytes', port='80').inc(10)
+    registry.histogram('exec.first_byte_secs').record(0.25)
+
+    got = metrics.to_prometheus(registry.snapshot())
+
+    self.assertEqual(got, '\n'.join([
+      '# TYPE rx_exec_first_byte_secs summary',
+      'rx_exec_first_byte_secs{quantile="0.5"} 0.25',
+      'rx_exec_first_byte_secs{quantile="0.9"} 0.25',
+      'rx_exec_first_byte_secs{quantile="0.99"} 0.25',
+      'rx_exec_first_byte_secs_sum 0.25',
+      'rx_exec_first_byte_secs_count 1',
+      '# TYPE rx_port_forward_bytes counter',
+      'rx_port_forward_bytes{port="80"} 10',
+    ]) + '\n')
+
+  def test_serve(self):
+    registry = metrics.Registry()
+    registry.gauge('workspaces').set(2)
+    server = metrics.serve_prometheus(0, registry)
+    self.addCleanup(server.server_close)
+    self.addCleanup(server.shutdown)
+
+    url = f'http://127.0.0.1:{server.server_address[1]}/metrics'
+    with request.urlopen(url, timeout=5) as resp:
+      body = resp.read().decode()
+
+    self.assertIn('rx_workspaces 2\n', body)
+
+
+class JsonTests(unittest.TestCase):
+
+  def test_round_trips(self):
+    samples = [metrics.Sample(name='requests', kind=metrics.COUNTER, value=1)]
+
+    self.assertEqual(
+      json.loads(metrics.to_json(samples)),
+      [{'name': 'requests', 'kind': 'counter', 'value': 1}])
+
+
+if __name__ == '__main__':
+  absltest.main()
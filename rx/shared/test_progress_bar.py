@@ -0,0 +1,90 @@
+import io
+import unittest
+
+from absl.testing import absltest
+
+from rx.proto import rx_pb2
+from rx.shared import progress_bar
+
+P = rx_pb2.DockerImageProgress
+
+
+class FakeClock:
+
+  def __init__(self) -> None:
+    self.now = 100.0
+
+  def __call__(self) -> float:
+    return self.now
+
+
+class RendererTests(unittest.TestCase):
+
+  def setUp(self) -> None:
+    super().setUp()
+    self._out = io.StringIO()
+    self._clock = FakeClock()
+
+  def _renderer(self, is_tty: bool = False) -> progress_bar.Renderer:
+    return progress_bar.Renderer(
+      out=self._out, is_tty=is_tty, clock=self._clock)
+
+  def test_layers_are_added_up(self):
+    r = self._renderer()
+
+    r.update(P(id='a', status='Pulling fs layer'))
+    r.update(P(id='a', status='Downloading', total=1000, current=500))
+    r.update(P(id='b', status='Already exists'))
+    r.update(P(id='c', status='Downloading', total=3000, current=1000))
+    self._clock.now += 1
+
+    self.assertEqual(
+      r.summary(), '1.50kB/4.00kB (37%) at 1.50kB/s, 1/3 layers done')
+
+  def test_extracting_does_not_go_backwards(self):
+    r = self._renderer()
+
+    r.update(P(id='a', status='Downloading', total=1000, current=1000))
+    r.update(P(id='a', status='Download complete'))
+    r.update(P(id='a', status='Extracting', total=1000, current=10))
+    r.update(P(id='a', status='Pull complete'))
+    self._clock.now += 1
+
+    self.assertEqual(
+      r.summary(), '1.00kB/1.00kB (100%) at 1.00kB/s, 1/1 layers done')
+
+  def test_summaries_are_rate_limited(self):
+    r = self._renderer()
+
+    for i in range(100):
+      r.update(P(id='a', status='Downloading', total=100, current=i))
+    self.assertEqual(self._out.getvalue(), '')
+    self._clock.now += 10
+    r.update(P(id='a', status='Downloading', total=100, current=100))
+    r.update(P(id='a', status='Pull complete'))
+    r.close()
+
+    lines = self._out.getvalue().splitlines()
+    self.assertEqual(len(lines), 2)
+    self.assertIn('0/1 layers done', lines[0])
+    self.assertIn('1/1 layers done', lines[1])
+
+  def test_tty_shows_unfinished_layers(self):
+    r = self._renderer(is_tty=True)
+
+    r.update(P(id='small', status='Downloading', total=10, current=1))
+    r.update(P(id='big', status='Downloading', total=10000, current=1))
+    r.update(P(id='done', status='Pushed'))
+    self._clock.now += 1
+    r.update(P(id='big', status='Downloading', total=10000, current=2))
+    r.close()
+
+    got = self._out.getvalue()
+    self.assertIn('Downloading layer big', got)
+    self.assertIn('Downloading layer small', got)
+    self.assertNotIn('layer done', got)
+    self.assertIn('1/3 layers', got)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,81 @@
+import json
+import pathlib
+import tempfile
+import threading
+import unittest
+
+from absl.testing import absltest
+
+from rx.shared import trace
+
+
+class TracerTests(unittest.TestCase):
+
+  def test_disabled_records_nothing(self):
+    tracer = trace.Tracer()
+
+    with tracer.span('rsync'):
+      pass
+    tracer.instant('exit')
+
+    self.assertEqual(tracer.to_json()['traceEvents'], [])
+
+  def test_span(self):
+    tracer = trace.Tracer()
+    tracer.enable()
+
+    with tracer.span('rsync', op='to_remote'):
+      pass
+
+    events = [
+      e for e in tracer.to_json()['traceEvents'] if e['ph'] != 'M']
+    self.assertEqual(len(events), 1)
+    self.assertEqual(events[0]['name'], 'rsync')
+    self.assertEqual(events[0]['ph'], 'X')
+    self.assertEqual(events[0]['args'], {'op': 'to_remote'})
+    self.assertGreaterEqual(events[0]['dur'], 0)
+
+  def test_span_records_error(self):
+    tracer = trace.Tracer()
+    tracer.enable()
+
+    with self.assertRaises(ValueError):
+      with tracer.span('login'):
+        raise ValueError()
+
+    (event,) = [
+      e for e in tracer.to_json()['traceEvents'] if e['ph'] == 'X']
+    self.assertEqual(event['args'], {'error': 'ValueError'})
+
+  def test_threads_are_named(self):
+    tracer = trace.Tracer()
+    tracer.enable()
+
+    th = threading.Thread(
+      target=lambda: tracer.instant('first_byte'), name='reader')
+    th.start()
+    th.join()
+
+    events = tracer.to_json()['traceEvents']
+    self.assertEqual(
+      [e['args']['name'] for e in events if e['ph'] == 'M'], ['reader'])
+    self.assertEqual(events[1]['tid'], events[0]['tid'])
+
+  def test_write(self):
+    tracer = trace.Tracer()
+    tracer.enable()
+    tracer.add_span('parse_flags', 10, 25)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+      path = pathlib.Path(tmpdir) / 'trace.json'
+      tracer.write(str(path))
+      got = json.loads(path.read_text())
+
+    self.assertEqual(got['displayTimeUnit'], 'ms')
+    (event,) = [e for e in got['traceEvents'] if e['ph'] == 'X']
+    self.assertEqual(event['ts'], 10)
+    self.assertEqual(event['dur'], 15)
+
+
+if __name__ == '__main__':
+  absltest.main()
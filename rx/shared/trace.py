@@ -0,0 +1,151 @@
+"""Records a timeline of what an rx invocation spent its time on.
+
+Tracing is off unless the CLI is run with --trace, so spans cost next to
+nothing otherwise (the daemon never turns it on). The timeline is written in
+Chrome's trace event format, which https://ui.perfetto.dev and
+chrome://tracing can open:
+
+  with trace.span('rsync.to_remote'):
+    ...
+  trace.instant('first_output')
+"""
+import json
+import os
+import threading
+import time
+from types import TracebackType
+from typing import Any, Dict, List, Optional, Type
+
+
+def _now_us() -> float:
+  return time.perf_counter() * 1e6
+
+
+class Tracer:
+  """Collects trace events once enabled."""
+
+  def __init__(self) -> None:
+    self._enabled = False
+    self._events: List[Dict[str, Any]] = []
+    self._threads: Dict[int, str] = {}
+    self._lock = threading.Lock()
+
+  @property
+  def enabled(self) -> bool:
+    return self._enabled
+
+  def enable(self):
+    self._enabled = True
+
+  def span(self, name: str, **args: Any) -> '_Span':
+    """Returns a context manager that records how long its block takes."""
+    if not self._enabled:
+      return _NOOP_SPAN
+    return _Span(self, name, args)
+
+  def add_span(self, name: str, start_us: float, end_us: float, **args: Any):
+    """Records a span that has already happened."""
+    if self._enabled:
+      self._add(name, 'X', start_us, args, dur=end_us - start_us)
+
+  def instant(self, name: str, **args: Any):
+    """Records a point in time, e.g., the first byte of output."""
+    if self._enabled:
+      # Drawn across the whole process, rather than just this thread.
+      self._add(name, 'i', _now_us(), args, s='p')
+
+  def to_json(self) -> Dict[str, Any]:
+    pid = os.getpid()
+    with self._lock:
+      events = list(self._events)
+      threads = dict(self._threads)
+    metadata = [
+      {
+        'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+        'args': {'name': thread_name},
+      } for tid, thread_name in threads.items()
+    ]
+    return {'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}
+
+  def write(self, path: str):
+    with open(path, mode='wt', encoding='utf-8') as fh:
+      json.dump(self.to_json(), fh)
+
+  def _add(
+      self,
+      name: str,
+      phase: str,
+      ts_us: float,
+      args: Dict[str, Any],
+      **extra: Any):
+    thread = threading.current_thread()
+    event = {
+      'name': name, 'ph': phase, 'ts': ts_us, 'pid': os.getpid(),
+      'tid': thread.ident, **extra}
+    if args:
+      event['args'] = args
+    with self._lock:
+      self._events.append(event)
+      self._threads[thread.ident or 0] = thread.name
+
+
+class _Span:
+
+  def __init__(
+      self,
+      tracer: Optional[Tracer],
+      name: str,
+      args: Dict[str, Any]) -> None:
+    self._tracer = tracer
+    self._name = name
+    self._args = args
+    self._start = 0.0
+
+  def __enter__(self) -> '_Span':
+    if self._tracer is not None:
+      self._start = _now_us()
+    return self
+
+  def __exit__(self, exctype: Optional[Type[BaseException]],
+             excinst: Optional[BaseException],
+             exctb: Optional[TracebackType]):
+    del excinst
+    del exctb
+    if self._tracer is not None:
+      if exctype is not None:
+        self._args['error'] = exctype.__name__
+      self._tracer.add_span(self._name, self._start, _now_us(), **self._args)
+    return False
+
+
+_NOOP_SPAN = _Span(None, '', {})
+TRACER = Tracer()
+
+
+def now_us() -> float:
+  """Returns the current time on the trace's clock, for add_span."""
+  return _now_us()
+
+
+def enable():
+  TRACER.enable()
+
+
+def enabled() -> bool:
+  return TRACER.enabled
+
+
+def span(name: str, **args: Any) -> _Span:
+  return TRACER.span(name, **args)
+
+
+def add_span(name: str, start_us: float, end_us: float, **args: Any):
+  TRACER.add_span(name, start_us, end_us, **args)
+
+
+def instant(name: str, **args: Any):
+  TRACER.instant(name, **args)
+
+
+def write(path: str):
+  TRACER.write(path)
@@ -23,6 +23,7 @@ IGNORE = [
   '^.venv',
   '^.vscode',
   '^README.md$',
+  '^benchmarks',
   '^build',
   '^dist',
   '^integration_test.sh$',
@@ -30,6 +31,7 @@ IGNORE = [
   '^requirements.txt$',
   '^requirements_dev.txt$',
   '^run_tests.py$',
+  '^rx/testing',
   '^wheels',
   '\\btest_.*.py$',
   '\\b__init__.py$',
@@ -0,0 +1,321 @@
+"""An in-process stand-in for the worker's ExecutionService.
+
+This forwards PortForward and PortForwardMux streams to ports on localhost, so
+the daemon's forwarding path can be exercised without a real worker, and runs
+Exec requests as local processes, so the CLI's exec path can be too. Init
+"pulls" an image instantly and InstallDeps skips "installing" when the
+deps_fingerprint is unchanged, like the real worker.
+"""
+from concurrent import futures
+import os
+import pathlib
+import queue
+import selectors
+import socket
+import subprocess
+import threading
+import time
+from typing import Dict, Iterator, Optional, Tuple
+
+import grpc
+import jwt
+import yaml
+
+from rx.client.configuration import config_base
+from rx.client.configuration import local
+from rx.client.configuration import remote
+from rx.proto import rx_pb2
+from rx.proto import rx_pb2_grpc
+
+_FRAME_SIZE = 32 * 1024
+# Must match the client's initial window (see port_forwarding/mux.py).
+_INITIAL_WINDOW = 256 * 1024
+
+
+class FakeExecutionService(rx_pb2_grpc.ExecutionServiceServicer):
+  """Forwards ports to 127.0.0.1 and runs commands in workdir."""
+
+  def __init__(
+      self,
+      multiplex: bool = True,
+      workdir: Optional[pathlib.Path] = None) -> None:
+    super().__init__()
+    self._multiplex = multiplex
+    # Where commands run, e.g., the directory rsync uploads to.
+    self._workdir = workdir
+    # Number of PortForward streams that have been started.
+    self.port_forward_calls = 0
+    self.exec_calls = 0
+    self.init_calls = 0
+    # Number of InstallDeps calls that actually installed something.
+    self.installs = 0
+    # The deps_fingerprint of the last successful install.
+    self._deps_fingerprint = ''
+
+  def Exec(
+      self, request_iterator: Iterator[rx_pb2.ExecRequest],
+      context: grpc.ServicerContext,
+  ) -> Iterator[rx_pb2.ExecResponse]:
+    if self._workdir is None:
+      context.abort(grpc.StatusCode.FAILED_PRECONDITION, 'No workdir set')
+    assert self._workdir
+    self.exec_calls += 1
+    first = next(request_iterator)
+    yield rx_pb2.ExecResponse(execution_id=f'exec{self.exec_calls}')
+    proc = subprocess.Popen(
+      list(first.argv), cwd=self._workdir / first.cwd,
+      stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert proc.stdout and proc.stderr
+    with selectors.DefaultSelector() as sel:
+      sel.register(proc.stdout, selectors.EVENT_READ, 'stdout')
+      sel.register(proc.stderr, selectors.EVENT_READ, 'stderr')
+      while sel.get_map():
+        for key, _ in sel.select():
+          buf = os.read(key.fd, _FRAME_SIZE)
+          if not buf:
+            sel.unregister(key.fileobj)
+            continue
+          yield rx_pb2.ExecResponse(**{key.data: buf})
+    proc.stdout.close()
+    proc.stderr.close()
+    yield rx_pb2.ExecResponse(exit_code=proc.wait())
+
+  def Init(
+      self, request: rx_pb2.GenericRequest, context: grpc.ServicerContext,
+  ) -> Iterator[rx_pb2.WorkerInitResponse]:
+    del request
+    del context
+    self.init_calls += 1
+    yield rx_pb2.WorkerInitResponse(pull_progress=rx_pb2.DockerImageProgress(
+      id='abc123', status='Downloading', total=1024, current=1024))
+    yield rx_pb2.WorkerInitResponse(result=rx_pb2.Result(code=rx_pb2.OK))
+
+  def SetupRsync(
+      self, request: rx_pb2.GenericRequest, context: grpc.ServicerContext,
+  ) -> rx_pb2.GenericResponse:
+    del request
+    del context
+    return rx_pb2.GenericResponse(result=rx_pb2.Result(code=rx_pb2.OK))
+
+  def InstallDeps(
+      self, request: rx_pb2.InstallDepsRequest,
+      context: grpc.ServicerContext,
+  ) -> Iterator[rx_pb2.InstallDepsResponse]:
+    del context
+    if (request.deps_fingerprint and
+        request.deps_fingerprint == self._deps_fingerprint):
+      yield rx_pb2.InstallDepsResponse(up_to_date=True)
+      return
+    self.installs += 1
+    yield rx_pb2.InstallDepsResponse(stdout=b'Installing dependencies\n')
+    self._deps_fingerprint = request.deps_fingerprint
+    yield rx_pb2.InstallDepsResponse(result=rx_pb2.Result(code=rx_pb2.OK))
+
+  def PortForward(
+      self, request_iterator: Iterator[rx_pb2.PortForwardRequest],
+      context: grpc.ServicerContext,
+  ) -> Iterator[rx_pb2.PortForwardResponse]:
+    self.port_forward_calls += 1
+    first = next(request_iterator, None)
+    if first is None:
+      # The daemon opened the stream ahead of time and never used it.
+      return
+    sock = socket.create_connection(('127.0.0.1', first.port))
+    def send_requests():
+      try:
+        sock.sendall(first.frame)
+        for req in request_iterator:
+          sock.sendall(req.frame)
+        sock.shutdown(socket.SHUT_WR)
+      except OSError:
+        pass
+    threading.Thread(target=send_requests, daemon=True).start()
+    try:
+      while context.is_active():
+        buf = sock.recv(_FRAME_SIZE)
+        if not buf:
+          break
+        yield rx_pb2.PortForwardResponse(frame=buf)
+    finally:
+      sock.close()
+
+  def PortForwardMux(
+      self, request_iterator: Iterator[rx_pb2.PortForwardMuxRequest],
+      context: grpc.ServicerContext,
+  ) -> Iterator[rx_pb2.PortForwardMuxResponse]:
+    if not self._multiplex:
+      context.abort(grpc.StatusCode.UNIMPLEMENTED, 'Method not implemented!')
+    context.send_initial_metadata(())
+    stream = _MuxStream(request_iterator)
+    threading.Thread(target=stream.handle_requests, daemon=True).start()
+    while True:
+      resp = stream.responses.get()
+      if resp is None:
+        return
+      yield resp
+
+
+class _MuxConnection:
+
+  def __init__(self, sock: socket.socket) -> None:
+    self.sock = sock
+    self.window = _INITIAL_WINDOW
+    self.window_cv = threading.Condition()
+    self.closed = False
+
+
+class _MuxStream:
+  """The worker side of one PortForwardMux stream."""
+
+  def __init__(
+      self, request_iterator: Iterator[rx_pb2.PortForwardMuxRequest]) -> None:
+    self._requests = request_iterator
+    self._conns: Dict[int, _MuxConnection] = {}
+    self.responses: queue.SimpleQueue = queue.SimpleQueue()
+
+  def handle_requests(self):
+    try:
+      for req in self._requests:
+        if req.signal == rx_pb2.OPEN:
+          self._open(req)
+          continue
+        conn = self._conns.get(req.connection_id)
+        if conn is None:
+          continue
+        try:
+          if req.signal == rx_pb2.DATA:
+            conn.sock.sendall(req.frame)
+            self._respond(
+              req.connection_id, rx_pb2.WINDOW_UPDATE, window=len(req.frame))
+          elif req.signal == rx_pb2.HALF_CLOSE:
+            conn.sock.shutdown(socket.SHUT_WR)
+          elif req.signal == rx_pb2.WINDOW_UPDATE:
+            with conn.window_cv:
+              conn.window += req.window
+              conn.window_cv.notify()
+          elif req.signal == rx_pb2.CLOSE:
+            self._close(req.connection_id)
+        except OSError:
+          self._close(req.connection_id)
+          self._respond(req.connection_id, rx_pb2.CLOSE)
+    except grpc.RpcError:
+      pass
+    finally:
+      for connection_id in list(self._conns):
+        self._close(connection_id)
+      self.responses.put(None)
+
+  def _open(self, req: rx_pb2.PortForwardMuxRequest):
+    try:
+      sock = socket.create_connection(('127.0.0.1', req.port))
+    except OSError as e:
+      self._respond(
+        req.connection_id, rx_pb2.CLOSE,
+        result=rx_pb2.Result(code=rx_pb2.UNKNOWN, message=str(e)))
+      return
+    conn = _MuxConnection(sock)
+    self._conns[req.connection_id] = conn
+    threading.Thread(
+      target=self._read_target, args=(req.connection_id, conn),
+      daemon=True).start()
+
+  def _read_target(self, connection_id: int, conn: _MuxConnection):
+    try:
+      while True:
+        with conn.window_cv:
+          while conn.window <= 0 and not conn.closed:
+            conn.window_cv.wait()
+          if conn.closed:
+            return
+          size = min(_FRAME_SIZE, conn.window)
+        buf = conn.sock.recv(size)
+        if not buf:
+          self._respond(connection_id, rx_pb2.HALF_CLOSE)
+          return
+        with conn.window_cv:
+          conn.window -= len(buf)
+        self._respond(connection_id, rx_pb2.DATA, frame=buf)
+    except OSError:
+      pass
+
+  def _close(self, connection_id: int):
+    conn = self._conns.pop(connection_id, None)
+    if conn is None:
+      return
+    with conn.window_cv:
+      conn.closed = True
+      conn.window_cv.notify()
+    conn.sock.close()
+
+  def _respond(
+      self, connection_id: int, signal: int, frame: bytes = b'',
+      window: int = 0, result: Optional[rx_pb2.Result] = None):
+    self.responses.put(rx_pb2.PortForwardMuxResponse(
+      connection_id=connection_id, signal=signal, frame=frame, window=window,
+      result=result))
+
+
+class EchoServer:
+  """A TCP server that echos back whatever is sent to it."""
+
+  def __init__(self) -> None:
+    self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    self._sock.bind(('127.0.0.1', 0))
+    self._sock.listen()
+    self.port: int = self._sock.getsockname()[1]
+    threading.Thread(target=self._accept_forever, daemon=True).start()
+
+  def close(self):
+    self._sock.close()
+
+  def _accept_forever(self):
+    while True:
+      try:
+        conn, _ = self._sock.accept()
+      except OSError:
+        return
+      threading.Thread(target=self._echo, args=(conn,), daemon=True).start()
+
+  def _echo(self, conn: socket.socket):
+    with conn:
+      while True:
+        buf = conn.recv(_FRAME_SIZE)
+        if not buf:
+          break
+        conn.sendall(buf)
+      conn.shutdown(socket.SHUT_WR)
+
+
+def start_server(
+    servicer: rx_pb2_grpc.ExecutionServiceServicer,
+) -> Tuple[grpc.Server, str]:
+  """Starts a server on a free port and returns it and its address."""
+  server = grpc.server(futures.ThreadPoolExecutor(max_workers=32))
+  rx_pb2_grpc.add_ExecutionServiceServicer_to_server(servicer, server)
+  port = server.add_insecure_port('localhost:0')
+  server.start()
+  return server, f'localhost:{port}'
+
+
+def setup_rxroot(
+    rxroot: pathlib.Path,
+    worker_addr: str,
+    rsync_path: str = '/usr/bin/rsync',
+    should_sync: bool = True) -> local.LocalConfig:
+  """Writes the config for a workspace on worker_addr, already logged in."""
+  config_dir = config_base.get_config_dir(rxroot)
+  (config_dir / 'user').mkdir(parents=True, exist_ok=True)
+  with remote.WritableRemote(rxroot) as r:
+    r['workspace_id'] = 'ws123'
+    r['worker_addr'] = worker_addr
+    r['daemon_module'] = 'ws123'
+  id_token = jwt.encode(
+    {'email': 'me@example.com', 'exp': int(time.time()) + 24 * 60 * 60},
+    'abc123')
+  with (config_dir / 'user/access-token.yaml').open('wt') as fh:
+    yaml.safe_dump({'id_token': id_token}, fh)
+  local_cfg = local.LocalConfig(
+    cwd=rxroot, project_name='test', rsync_path=rsync_path,
+    should_sync=should_sync)
+  local_cfg.store()
+  return local_cfg
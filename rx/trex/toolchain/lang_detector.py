@@ -1,7 +1,16 @@
 """This detects what languages a project is using."""
+from concurrent import futures
 import dataclasses
-from typing import List
+import hashlib
+import pathlib
+import re
+from typing import Iterable, List, Optional
 
+from absl import logging
+import yaml
+
+from rx.client.configuration import config_base
+from rx.proto import rx_pb2
 from rx.trex.toolchain import manifest
 
 _KNOWN_EXTENSION = {
@@ -18,6 +27,38 @@ _KNOWN_EXTENSION = {
   '.tsx': 'node',
 }
 
+# Files that mean a package manager is in use, anywhere in the tree.
+_PACKAGE_FILES = {
+  'environment.yaml': 'conda',
+  'environment.yml': 'conda',
+  'requirements.txt': 'pip',
+  'pom.xml': 'maven',
+  'package.json': 'node',
+  'Cargo.toml': 'rust',
+  'go.mod': 'golang',
+}
+_LOCKFILES = {
+  'Pipfile.lock': 'pip',
+  'poetry.lock': 'pip',
+  'package-lock.json': 'node',
+  'yarn.lock': 'node',
+  'pnpm-lock.yaml': 'node',
+  'Cargo.lock': 'rust',
+  'go.sum': 'golang',
+}
+# E.g., python3.10 -> python.
+_SHEBANG_INTERPRETERS = {
+  'node': 'node',
+  'php': 'php',
+  'python': 'python',
+}
+_SHEBANG_RE = re.compile(rb'#!\s*(\S+)(?:[ \t]+(\S+))?')
+# Only the start of a file is read to find its shebang, and only this many
+# extensionless files are checked.
+_SHEBANG_BYTES = 128
+_MAX_SHEBANG_FILES = 1000
+_READERS = 16
+
 
 @dataclasses.dataclass(frozen=True)
 class DetectedTool:
@@ -26,26 +67,28 @@ class DetectedTool:
 
 
 class Detector:
-  """Detects which language a repo is likely primarily using."""
-  def __init__(self, m: manifest.Manifest) -> None:
+  """Detects which language a repo is likely primarily using.
+
+  If root is given, extensionless files under it are also checked for
+  shebangs (e.g., #!/usr/bin/env python3).
+  """
+  def __init__(
+      self, m: manifest.Manifest, root: Optional[pathlib.Path] = None) -> None:
     self._manifest = m
+    self._root = root
 
   def get_languages(self) -> List[DetectedTool]:
     """Returns the likely languages/tools for the project."""
     detected = set()
-    why = 'package manager'
-    if (
-      'environment.yaml' in self._manifest or
-      'environment.yml' in self._manifest):
-      detected.add(DetectedTool(name='conda', why=why))
-    if 'requirements.txt' in self._manifest:
-      detected.add(DetectedTool(name='pip', why=why))
-    if 'pom.xml' in self._manifest:
-      detected.add(DetectedTool(name='maven', why=why))
-    if 'package.json' in self._manifest:
-      detected.add(DetectedTool(name='node', why=why))
-    if 'Cargo.toml' in self._manifest:
-      detected.add(DetectedTool(name='rust', why=why))
+    for why, files in (
+        ('package manager', _PACKAGE_FILES), ('lockfile', _LOCKFILES)):
+      for filename, name in files.items():
+        if self._manifest.find_basename(filename):
+          detected.add(DetectedTool(name=name, why=why))
+
+    if self._root:
+      for name in self._get_shebang_languages(self._root):
+        detected.add(DetectedTool(name=name, why='shebang'))
 
     # We could not find a language via package manager options. Look for
     # suffixes.
@@ -55,3 +98,103 @@ class Detector:
         detected.add(DetectedTool(name=_KNOWN_EXTENSION[lang], why=why))
 
     return list(detected)
+
+  def _get_shebang_languages(self, root: pathlib.Path) -> Iterable[str]:
+    candidates = []
+    for path in self._manifest.with_extension(''):
+      # Skip dotfiles and directories.
+      if path.rpartition('/')[2].startswith('.') or path.endswith('/'):
+        continue
+      candidates.append(root / path)
+      if len(candidates) >= _MAX_SHEBANG_FILES:
+        break
+    if not candidates:
+      return set()
+    with futures.ThreadPoolExecutor(max_workers=_READERS) as pool:
+      return set(n for n in pool.map(_read_shebang, candidates) if n)
+
+
+def _read_shebang(path: pathlib.Path) -> Optional[str]:
+  """Returns the language a script's #! line runs it with, if known."""
+  try:
+    with path.open('rb') as fh:
+      head = fh.read(_SHEBANG_BYTES)
+  except OSError:
+    return None
+  m = _SHEBANG_RE.match(head)
+  if not m:
+    return None
+  interpreter = m.group(1).rsplit(b'/', 1)[-1]
+  if interpreter == b'env' and m.group(2):
+    interpreter = m.group(2)
+  # Strip versions, e.g., python3.10.
+  interpreter = interpreter.decode('utf-8', 'replace').rstrip('0123456789.')
+  return _SHEBANG_INTERPRETERS.get(interpreter)
+
+
+def get_cache_file(rxroot: pathlib.Path) -> pathlib.Path:
+  """Returns .rx/<trex-host>/languages.yaml, which .rxignore keeps local."""
+  return config_base.get_config_dir(rxroot).parent / 'languages.yaml'
+
+
+def detect(m: manifest.Manifest, rxroot: pathlib.Path) -> List[DetectedTool]:
+  """Returns rxroot's languages, reusing the last result if m is the same."""
+  cache_file = get_cache_file(rxroot)
+  digest = m.digest()
+  try:
+    with cache_file.open(mode='rt', encoding='utf-8') as fh:
+      cached = yaml.safe_load(fh)
+    if cached and cached.get('manifest') == digest:
+      return [DetectedTool(**t) for t in cached['tools']]
+  except (OSError, yaml.YAMLError, KeyError, TypeError) as e:
+    logging.info('Not using cached languages from %s: %s', cache_file, e)
+
+  tools = sorted(Detector(m, rxroot).get_languages(), key=lambda t: t.name)
+  try:
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    with cache_file.open(mode='wt', encoding='utf-8') as fh:
+      yaml.safe_dump({
+        'manifest': digest,
+        'tools': [dataclasses.asdict(t) for t in tools],
+      }, fh)
+  except OSError as e:
+    logging.warning('Could not cache languages to %s: %s', cache_file, e)
+  return tools
+
+
+def get_deps_files(m: manifest.Manifest) -> List[str]:
+  """Returns every package file and lockfile in the project, sorted."""
+  paths = []
+  for filename in list(_PACKAGE_FILES) + list(_LOCKFILES):
+    paths.extend(m.find_basename(filename))
+  return sorted(paths)
+
+
+def get_deps_fingerprint(m: manifest.Manifest, rxroot: pathlib.Path) -> str:
+  """Returns a hash of every package file and lockfile in the project.
+
+  This changes whenever the project's dependencies might have, so the worker
+  can skip reinstalling them if it hasn't. Returns '' if there are none.
+  """
+  return fingerprint_files(get_deps_files(m), rxroot)
+
+
+def fingerprint_files(paths: Iterable[str], rxroot: pathlib.Path) -> str:
+  """Returns a hash of the paths and contents of files, or '' if none."""
+  h = hashlib.sha256()
+  empty = True
+  for path in paths:
+    empty = False
+    h.update(path.encode('utf-8', 'surrogateescape') + b'\0')
+    try:
+      h.update((rxroot / path).read_bytes())
+    except OSError as e:
+      # E.g., it was deleted since the manifest was made.
+      logging.info('Could not read %s: %s', path, e)
+    h.update(b'\0')
+  return '' if empty else h.hexdigest()
+
+
+def to_toolchain(tools: Iterable[DetectedTool]) -> List[rx_pb2.Tool]:
+  """Converts detected tools to a Remote.toolchain."""
+  return [rx_pb2.Tool(name=t.name) for t in sorted(tools, key=lambda t: t.name)]
@@ -1,12 +1,50 @@
+import dataclasses
 import pathlib
 import subprocess
 import tempfile
-from typing import List
+import time
+from typing import List, Optional
 
+import tqdm
+
+from rx.client.configuration import config_base
 from rx.client.configuration import local
+from rx.trex.toolchain import manifest
 
 
-def get_manifest(local_cfg: local.LocalConfig) -> List[str]:
+@dataclasses.dataclass
+class Scan:
+  """What rsync would upload, from a single pass over the tree.
+
+  `rx init` scans once and uses it to detect languages, report what's being
+  uploaded and tell rsync exactly what to send, rather than each of those
+  walking the tree again.
+  """
+  # Relative to the rxroot, e.g., 'src/main.py', or 'src/' for a directory.
+  paths: List[str]
+  # Total size of the files, not counting directories.
+  total_bytes: int = 0
+  _manifest: Optional[manifest.Manifest] = dataclasses.field(
+    default=None, init=False, repr=False, compare=False)
+
+  @property
+  def file_count(self) -> int:
+    return sum(1 for p in self.paths if not p.endswith('/'))
+
+  def get_manifest(self) -> manifest.Manifest:
+    """Returns the paths indexed for lookups, building it the first time."""
+    if self._manifest is None:
+      self._manifest = manifest.Manifest(self.paths)
+    return self._manifest
+
+  def summary(self) -> str:
+    """E.g., '1,234 files (56.7MB)'."""
+    size = tqdm.tqdm.format_sizeof(self.total_bytes, suffix='B')
+    return f'{self.file_count:,} files ({size})'
+
+
+def scan(local_cfg: local.LocalConfig) -> Scan:
+  """Lists the files rsync would upload, with their total size."""
   dest = tempfile.mkdtemp()
   cmd = [
       local_cfg.rsync_path,
@@ -14,7 +52,8 @@ def get_manifest(local_cfg: local.LocalConfig) -> List[str]:
       '--compress',
       '--delete',
       '--dry-run',
-      '--itemize-changes',
+      # Like --itemize-changes, plus the file's size.
+      '--out-format=%i %l %n',
   ]
   # Only add the rxignore option if the file exists.
   rxignore = local_cfg.cwd / local.IGNORE
@@ -28,19 +67,67 @@ def get_manifest(local_cfg: local.LocalConfig) -> List[str]:
     result = subprocess.run(cmd, check=True, capture_output=True)
   except subprocess.CalledProcessError as e:
     raise ManifestError(e.stderr.decode('utf-8'))
-  stdout = result.stdout.decode('utf-8')
-  manifest = []
+  return parse_scan(result.stdout.decode('utf-8'))
+
+
+def parse_scan(stdout: str) -> Scan:
+  """Parses the output of scan's rsync command."""
+  paths = []
+  total_bytes = 0
   for ln in stdout.split('\n'):
-    delta = ln.split(' ')
-    if len(delta) < 2 or delta[1] == './':
+    # Filenames can have spaces, so only split off the first two fields.
+    delta = ln.split(' ', 2)
+    if len(delta) < 3 or delta[2] == './':
       continue
-    filename = delta[1]
-    manifest.append(filename)
-  return manifest
+    filename = delta[2]
+    paths.append(filename)
+    if not filename.endswith('/') and delta[1].isdigit():
+      total_bytes += int(delta[1])
+  return Scan(paths=paths, total_bytes=total_bytes)
+
+
+def get_manifest(local_cfg: local.LocalConfig) -> List[str]:
+  return scan(local_cfg).paths
+
+
+def get_scan_file(rxroot: pathlib.Path) -> pathlib.Path:
+  """Returns .rx/<trex-host>/manifest.txt, which .rxignore keeps local."""
+  return config_base.get_config_dir(rxroot).parent / 'manifest.txt'
+
+
+def save_scan(rxroot: pathlib.Path, s: Scan):
+  """Saves s, so the next listing of rxroot can start from it.
+
+  This is only for finding files (e.g., dependency files), not for syncing.
+  The sync before each command still lets rsync walk the tree: a saved list
+  misses files added or deleted since, and rsync has to stat every file to
+  find what changed anyway.
+  """
+  path = get_scan_file(rxroot)
+  path.parent.mkdir(parents=True, exist_ok=True)
+  with path.open(mode='wt', encoding='utf-8', errors='surrogateescape') as fh:
+    fh.write(f'{s.total_bytes}\n')
+    for p in s.paths:
+      fh.write(f'{p}\n')
+
+
+def load_scan(rxroot: pathlib.Path, max_age_secs: float) -> Optional[Scan]:
+  """Returns the last saved scan, if it's less than max_age_secs old."""
+  path = get_scan_file(rxroot)
+  try:
+    if time.time() - path.stat().st_mtime > max_age_secs:
+      return None
+    with path.open(mode='rt', encoding='utf-8', errors='surrogateescape') as fh:
+      lines = fh.read().split('\n')
+    return Scan(paths=[p for p in lines[1:] if p], total_bytes=int(lines[0]))
+  except (OSError, ValueError):
+    return None
 
 
-def dry_run(local_cfg: local.LocalConfig):
-  manifest = get_manifest(local_cfg)
+def dry_run(
+    local_cfg: local.LocalConfig, manifest: Optional[List[str]] = None):
+  if manifest is None:
+    manifest = get_manifest(local_cfg)
   print('Uploading:')
   for filename in manifest:
     tab_count = 1 + filename.count('/')
@@ -1,34 +1,164 @@
 """Tools for processing the project's file list."""
+import array
+import bisect
 import collections
-import os
-from typing import Iterator, List
+import hashlib
+import sys
+from typing import Counter, Dict, Iterable, Iterator, List, Union
+
+# A directory's ID in the trie. The root (the rxroot itself) is 0.
+_ROOT = 0
+
+
+def _splitext(basename: str) -> str:
+  """Like os.path.splitext(basename)[1], without the overhead."""
+  i = basename.rfind('.')
+  if i <= 0 or not basename[:i].lstrip('.'):
+    # No extension, or a dotfile like .bashrc.
+    return ''
+  return basename[i:]
 
 
 class Manifest:
-  """Represents files in a user's project."""
+  """Represents files in a user's project.
+
+  Monorepos can have millions of files, so files' full paths aren't stored.
+  Each file is just its directory's ID, filed under its interned basename.
+  Directories form a trie (each one is its parent's ID plus a name) and have
+  one entry each, mapping their path to their ID. There are far fewer
+  directories than files. Looking a path up is two hash lookups, and "every
+  package.json anywhere" is one.
 
-  def __init__(self, manifest: List[str]) -> None:
-    self._manifest = manifest
-    self._counts = collections.defaultdict(lambda: 0)
-    self._processed = False
+  Paths are relative to the rxroot, like rsync lists them: 'src/main.py', or
+  'src/' for a directory.
+  """
 
-  def _process(self):
-    """Initially populate _counts."""
-    self._processed = True
-    for f in self._manifest:
-      _, ext = os.path.splitext(f)
-      # E.g., {'.go': 4}
-      self._counts[ext] += 1
+  def __init__(self, manifest: Iterable[str] = ()) -> None:
+    # Directory path -> ID. The rxroot is '' (_ROOT).
+    self._dir_ids: Dict[str, int] = {'': _ROOT}
+    self._dir_parent = array.array('l', [_ROOT])
+    self._dir_names: List[str] = ['']
+    # Directories that were listed themselves (e.g., 'src/').
+    self._listed_dirs = bytearray(1)
+    # Basename -> ID(s) of the directories holding a file with that name,
+    # sorted. Most basenames are only in one directory, so that's an int.
+    self._files: Dict[str, Union[int, array.array]] = {}
+    self._by_extension: Dict[str, List[str]] = collections.defaultdict(list)
+    # Every path that was added, including duplicates.
+    self._counts: Counter[str] = collections.Counter()
+    self._len = 0
+    # Hash of every path added, in order, so callers can cache results.
+    self._hash = hashlib.sha256()
+    for path in manifest:
+      self.add(path)
+
+  def add(self, fullpath: str):
+    """Adds a path, keeping the indexes and counts up to date."""
+    self._hash.update(fullpath.encode('utf-8', 'surrogateescape') + b'\n')
+    dirname, _, basename = fullpath.rpartition('/')
+    ext = _splitext(basename)
+    # E.g., {'.go': 4}
+    self._counts[ext] += 1
+    dir_id = self._dir_ids.get(dirname)
+    if dir_id is None:
+      dir_id = self._add_dir(dirname)
+    if not basename:
+      if not self._listed_dirs[dir_id]:
+        self._listed_dirs[dir_id] = 1
+        self._len += 1
+      return
+    dirs = self._files.get(basename)
+    if dirs is None:
+      basename = sys.intern(basename)
+      self._files[basename] = dir_id
+      self._by_extension[ext].append(basename)
+    elif isinstance(dirs, int):
+      if dirs == dir_id:
+        return
+      self._files[basename] = array.array('l', sorted((dirs, dir_id)))
+    elif dir_id > dirs[-1]:
+      # Directories get IDs in the order they're listed, so this is common.
+      dirs.append(dir_id)
+    else:
+      i = bisect.bisect_left(dirs, dir_id)
+      if i < len(dirs) and dirs[i] == dir_id:
+        return
+      dirs.insert(i, dir_id)
+    self._len += 1
+
+  def digest(self) -> str:
+    """Returns a hex hash of the paths added so far."""
+    return self._hash.hexdigest()
 
   def most_popular_extensions(self) -> Iterator[str]:
     """Returns the extension on the most files."""
-    if not self._processed:
-      self._process()
     for k, _ in sorted(self._counts.items(), key=lambda x: x[1], reverse=True):
       yield k
 
+  def extension_count(self, ext: str) -> int:
+    """Returns how many paths with this extension (e.g., '.py') were added."""
+    return self._counts[ext]
+
+  def find_basename(self, basename: str) -> List[str]:
+    """Returns every file with this name, e.g., each package.json."""
+    if basename not in self._files:
+      return []
+    return [self._path(d, basename) for d in self._dirs_for(basename)]
+
+  def with_extension(self, ext: str) -> Iterator[str]:
+    """Yields every file with this extension, e.g., '.py'."""
+    for basename in self._by_extension.get(ext, ()):
+      for d in self._dirs_for(basename):
+        yield self._path(d, basename)
+
   def __contains__(self, fullpath: str) -> bool:
     """Returns if the given path is in the manifest."""
-    if not self._processed:
-      self._process()
-    return fullpath in self._manifest
+    dirname, _, basename = fullpath.rpartition('/')
+    dir_id = self._dir_ids.get(dirname)
+    if dir_id is None:
+      return False
+    if not basename:
+      return bool(self._listed_dirs[dir_id])
+    dirs = self._files.get(basename)
+    if dirs is None:
+      return False
+    if isinstance(dirs, int):
+      return dirs == dir_id
+    i = bisect.bisect_left(dirs, dir_id)
+    return i < len(dirs) and dirs[i] == dir_id
+
+  def __len__(self) -> int:
+    return self._len
+
+  def __iter__(self) -> Iterator[str]:
+    """Yields every path, listed directories first."""
+    for dir_id, listed in enumerate(self._listed_dirs):
+      if listed:
+        yield self._path(dir_id, '')
+    for basename in self._files:
+      for d in self._dirs_for(basename):
+        yield self._path(d, basename)
+
+  def _add_dir(self, dirname: str) -> int:
+    """Adds a directory (and its parents) to the trie."""
+    parent, _, name = dirname.rpartition('/')
+    parent_id = self._dir_ids.get(parent)
+    if parent_id is None:
+      parent_id = self._add_dir(parent)
+    dir_id = len(self._dir_parent)
+    self._dir_ids[dirname] = dir_id
+    self._dir_parent.append(parent_id)
+    self._dir_names.append(sys.intern(name))
+    self._listed_dirs.append(0)
+    return dir_id
+
+  def _dirs_for(self, basename: str) -> Iterable[int]:
+    dirs = self._files[basename]
+    return (dirs,) if isinstance(dirs, int) else dirs
+
+  def _path(self, dir_id: int, basename: str) -> str:
+    parts = [basename]
+    while dir_id != _ROOT:
+      parts.append(self._dir_names[dir_id])
+      dir_id = self._dir_parent[dir_id]
+    return '/'.join(reversed(parts))
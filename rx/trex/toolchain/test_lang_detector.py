@@ -1,9 +1,16 @@
+import pathlib
+import tempfile
 import unittest
+from unittest import mock
 
+from absl import flags
+
+from rx.proto import rx_pb2
 from rx.trex.toolchain import lang_detector
 from rx.trex.toolchain import manifest
 
 D = lang_detector.DetectedTool
+FLAGS = flags.FLAGS
 
 
 class LanguageTest(unittest.TestCase):
@@ -45,3 +52,95 @@ class LanguageTest(unittest.TestCase):
     got = d.get_languages()
 
     self.assertListEqual(got, [D(name='node', why='package manager')])
+
+  def test_nested_package_files_and_lockfiles(self):
+    m = manifest.Manifest(['web/package.json', 'svc/Cargo.lock', 'README'])
+    d = lang_detector.Detector(m)
+
+    got = d.get_languages()
+
+    want = set([
+      D(name='node', why='package manager'),
+      D(name='rust', why='lockfile'),
+    ])
+    self.assertSetEqual(set(got), want)
+
+  def test_lang_from_shebang(self):
+    m = manifest.Manifest(
+      ['bin/', 'bin/serve', 'bin/deploy', 'bin/missing', '.envrc'])
+    with tempfile.TemporaryDirectory() as tmpdir:
+      root = pathlib.Path(tmpdir)
+      (root / 'bin').mkdir()
+      (root / 'bin/serve').write_bytes(b'#!/usr/bin/env python3.10 -u\n')
+      (root / 'bin/deploy').write_bytes(b'#!/bin/bash\n')
+      (root / '.envrc').write_bytes(b'#!/usr/bin/node\n')
+      d = lang_detector.Detector(m, root)
+
+      got = d.get_languages()
+
+    self.assertListEqual(got, [D(name='python', why='shebang')])
+
+
+class DetectTest(unittest.TestCase):
+
+  def setUp(self) -> None:
+    super().setUp()
+    if not FLAGS.is_parsed():
+      FLAGS.mark_as_parsed()
+    self._tmpdir = tempfile.TemporaryDirectory()
+    self._rxroot = pathlib.Path(self._tmpdir.name)
+
+  def tearDown(self) -> None:
+    super().tearDown()
+    self._tmpdir.cleanup()
+
+  def test_cached_by_manifest(self):
+    m = manifest.Manifest(['requirements.txt', 'main.go'])
+    first = lang_detector.detect(m, self._rxroot)
+
+    with mock.patch.object(lang_detector.Detector, 'get_languages') as mock_get:
+      got = lang_detector.detect(
+        manifest.Manifest(['requirements.txt', 'main.go']), self._rxroot)
+
+    mock_get.assert_not_called()
+    self.assertListEqual(got, first)
+    self.assertListEqual(
+      [(t.name, t.why) for t in got],
+      [('golang', 'file extension'), ('pip', 'package manager')])
+
+  def test_changed_manifest_is_redetected(self):
+    lang_detector.detect(manifest.Manifest(['main.go']), self._rxroot)
+
+    got = lang_detector.detect(manifest.Manifest(['main.rs']), self._rxroot)
+
+    self.assertListEqual(got, [D(name='rust', why='file extension')])
+
+  def test_to_toolchain(self):
+    got = lang_detector.to_toolchain([
+      D(name='pip', why='package manager'),
+      D(name='golang', why='file extension'),
+    ])
+
+    self.assertListEqual(
+      got, [rx_pb2.Tool(name='golang'), rx_pb2.Tool(name='pip')])
+
+  def test_deps_fingerprint(self):
+    m = manifest.Manifest(['web/package.json', 'requirements.txt', 'main.py'])
+    (self._rxroot / 'web').mkdir()
+    (self._rxroot / 'web/package.json').write_text('{}')
+    (self._rxroot / 'requirements.txt').write_text('absl-py\n')
+    (self._rxroot / 'main.py').write_text('print(1)\n')
+    first = lang_detector.get_deps_fingerprint(m, self._rxroot)
+
+    (self._rxroot / 'main.py').write_text('print(2)\n')
+    unchanged = lang_detector.get_deps_fingerprint(m, self._rxroot)
+    (self._rxroot / 'requirements.txt').write_text('absl-py\ngrpcio\n')
+    changed = lang_detector.get_deps_fingerprint(m, self._rxroot)
+
+    self.assertEqual(first, unchanged)
+    self.assertNotEqual(first, changed)
+
+  def test_no_deps_fingerprint(self):
+    m = manifest.Manifest(['main.py'])
+
+    self.assertEqual(lang_detector.get_deps_fingerprint(m, self._rxroot), '')
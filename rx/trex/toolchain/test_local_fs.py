@@ -0,0 +1,64 @@
+import os
+import pathlib
+import tempfile
+import time
+import unittest
+
+from absl import flags
+from absl.testing import absltest
+
+from rx.trex.toolchain import local_fs
+
+FLAGS = flags.FLAGS
+
+
+class ScanTest(unittest.TestCase):
+
+  def setUp(self) -> None:
+    super().setUp()
+    if not FLAGS.is_parsed():
+      FLAGS.mark_as_parsed()
+
+  def test_parse_scan(self):
+    stdout = '\n'.join([
+      'cd+++++++++ 4096 ./',
+      'cd+++++++++ 4096 src/',
+      '>f+++++++++ 1200 src/main.py',
+      '>f+++++++++ 34 my notes.txt',
+      'cL+++++++++ 11 latest',
+      '',
+    ])
+
+    got = local_fs.parse_scan(stdout)
+
+    self.assertEqual(
+      got.paths, ['src/', 'src/main.py', 'my notes.txt', 'latest'])
+    self.assertEqual(got.total_bytes, 1245)
+    self.assertEqual(got.file_count, 3)
+    self.assertIn('src/main.py', got.get_manifest())
+    self.assertEqual(got.summary(), '3 files (1.25kB)')
+
+  def test_save_and_load(self):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      rxroot = pathlib.Path(tmpdir)
+      scan = local_fs.Scan(paths=['src/', 'src/main.py'], total_bytes=1200)
+
+      local_fs.save_scan(rxroot, scan)
+      got = local_fs.load_scan(rxroot, max_age_secs=60)
+
+      self.assertEqual(got, scan)
+
+  def test_old_scan_is_not_loaded(self):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      rxroot = pathlib.Path(tmpdir)
+      local_fs.save_scan(rxroot, local_fs.Scan(paths=['x.py']))
+      hour_ago = time.time() - 60 * 60
+      os.utime(local_fs.get_scan_file(rxroot), (hour_ago, hour_ago))
+
+      self.assertIsNone(local_fs.load_scan(rxroot, max_age_secs=60))
+      self.assertIsNone(
+        local_fs.load_scan(rxroot / 'missing', max_age_secs=60))
+
+
+if __name__ == '__main__':
+  absltest.main()
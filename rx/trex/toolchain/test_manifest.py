@@ -13,3 +13,55 @@ class ManifestTest(unittest.TestCase):
     got = list(m.most_popular_extensions())
 
     self.assertListEqual(got, ['.java', '.go', '.rs', ''])
+
+  def test_contains(self):
+    m = manifest.Manifest(['src/', 'src/main.py', 'README.md', 'a/b/c.txt'])
+
+    self.assertIn('src/main.py', m)
+    self.assertIn('README.md', m)
+    self.assertIn('a/b/c.txt', m)
+    self.assertIn('src/', m)
+    self.assertNotIn('main.py', m)
+    self.assertNotIn('src', m)
+    self.assertNotIn('a/', m)
+    self.assertNotIn('a/b/d.txt', m)
+    self.assertNotIn('x/main.py', m)
+
+  def test_find_basename(self):
+    m = manifest.Manifest(
+      ['package.json', 'web/package.json', 'web/app/package.json', 'web/a.js'])
+
+    self.assertCountEqual(
+      m.find_basename('package.json'),
+      ['package.json', 'web/package.json', 'web/app/package.json'])
+    self.assertEqual(m.find_basename('Cargo.toml'), [])
+
+  def test_with_extension(self):
+    m = manifest.Manifest(['a.go', 'x/b.go', 'x/y/a.go', 'c.rs'])
+
+    self.assertCountEqual(
+      m.with_extension('.go'), ['a.go', 'x/b.go', 'x/y/a.go'])
+    self.assertEqual(list(m.with_extension('.java')), [])
+
+  def test_add_updates_indexes(self):
+    m = manifest.Manifest(['a.go'])
+
+    m.add('b/c.rs')
+    m.add('d/c.rs')
+
+    self.assertIn('d/c.rs', m)
+    self.assertEqual(m.extension_count('.rs'), 2)
+    self.assertEqual(list(m.most_popular_extensions()), ['.rs', '.go'])
+
+  def test_len_and_iter_skip_duplicates(self):
+    files = ['src/', 'src/a.py', 'src/a.py', 'b.py']
+    m = manifest.Manifest(files)
+
+    self.assertEqual(len(m), 3)
+    self.assertCountEqual(m, ['src/', 'src/a.py', 'b.py'])
+
+  def test_digest(self):
+    m = manifest.Manifest(['a.py', 'b/'])
+
+    self.assertEqual(m.digest(), manifest.Manifest(['a.py', 'b/']).digest())
+    self.assertNotEqual(m.digest(), manifest.Manifest(['a.py']).digest())
@@ -5,6 +5,7 @@ import sys
 import selectors
 import termios
 import threading
+import time
 import tty
 from types import TracebackType
 from typing import Any, BinaryIO, Optional, Tuple, Type
@@ -14,6 +15,19 @@ from absl import logging
 from rx.proto import rx_pb2
 from rx.proto import rx_pb2_grpc
 from rx.client import output_handler
+from rx.shared import metrics
+from rx.shared import trace
+
+_FIRST_BYTE = metrics.histogram('exec.first_byte_secs')
+_DURATION = metrics.histogram('exec.duration_secs')
+_OUTPUT_BYTES = {
+  'stdout': metrics.counter('exec.output_bytes', stream='stdout'),
+  'stderr': metrics.counter('exec.output_bytes', stream='stderr'),
+}
+_OUTPUT_CHUNKS = {
+  'stdout': metrics.counter('exec.output_chunks', stream='stdout'),
+  'stderr': metrics.counter('exec.output_chunks', stream='stderr'),
+}
 
 
 class Executor:
@@ -25,6 +39,9 @@ class Executor:
     self._stub = stub
     self._request = req
     self.execution_id = None
+    # How long the worker took to start the command, then to finish it.
+    self.queue_secs = 0.0
+    self.exec_secs = 0.0
 
   def run(
       self,
@@ -32,14 +49,28 @@ class Executor:
       out_handler: output_handler.OutputHandler,
   ) -> rx_pb2.ExecResponse:
     response = None
+    start = time.monotonic()
+    first_byte = False
     with StdinIterator(self._request) as req_it:
       for response in self._stub.Exec(req_it, metadata=metadata):
         if response.execution_id:
+          if not self.execution_id:
+            self.queue_secs = time.monotonic() - start
           self.execution_id = response.execution_id
+        if not first_byte and (response.stdout or response.stderr):
+          first_byte = True
+          _FIRST_BYTE.record(time.monotonic() - start)
+          trace.instant('exec.first_byte')
+        _count_output('stdout', response.stdout)
+        _count_output('stderr', response.stderr)
         self.write(response.stdout, sys.stdout.buffer)
         self.write(response.stderr, sys.stderr.buffer)
         out_handler.handle(response)
+    duration = time.monotonic() - start
+    _DURATION.record(duration)
+    self.exec_secs = duration - self.queue_secs
     assert response
+    trace.instant('exec.remote_exit', exit_code=response.exit_code)
     return response
 
   def write(self, buf: bytes, sink: BinaryIO) -> None:
@@ -59,6 +90,12 @@ class Executor:
         raise e
 
 
+def _count_output(stream: str, buf: bytes):
+  if buf:
+    _OUTPUT_BYTES[stream].inc(len(buf))
+    _OUTPUT_CHUNKS[stream].inc()
+
+
 class StdinIterator:
 
   def __init__(self, request: rx_pb2.ExecRequest) -> None:
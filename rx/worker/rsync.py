@@ -1,12 +1,30 @@
 from collections import abc
 import pathlib
+import re
 import subprocess
-from typing import List
+from typing import List, NamedTuple, Optional, Sequence
 
+from absl import flags
 from absl import logging
 
 from rx.client.configuration import config_base
 from rx.client.configuration import local
+from rx.shared import metrics
+from rx.shared import trace
+
+# From rsync --stats, e.g., "Total bytes sent: 1,234".
+_STATS_RE = re.compile(r'^Total bytes (sent|received): ([\d,]+)', re.MULTILINE)
+
+_RSYNC_PORT = flags.DEFINE_integer(
+  'rsync_port', None,
+  'Port the worker\'s rsync daemon listens on, if not rsync\'s default (e.g., '
+  'for a local test worker).')
+
+
+class _Result(NamedTuple):
+  code: int
+  # From --stats, if it was passed.
+  bytes_sent: int = 0
 
 
 class RsyncClient:
@@ -21,6 +39,8 @@ class RsyncClient:
     if config_base.is_local(self._daemon_addr):
       # Remove the port (rsync isn't listening on 50051).
       self._daemon_addr = self._daemon_addr.split(':')[0]
+    # How much the last to_remote uploaded, according to --stats.
+    self.last_bytes_sent = 0
 
   @property
   def host(self) -> str:
@@ -34,43 +54,72 @@ class RsyncClient:
   def _upload_path(self) -> pathlib.Path:
     return pathlib.Path(self._cfg['daemon_module'])
 
-  def from_remote(self, source: str, dest: pathlib.Path) -> int:
-    """Copies output files from the remote machine to dest."""
+  def from_remote(
+      self, source: str, dest: pathlib.Path, keep_local: bool = False) -> int:
+    """Copies output files from the remote machine to dest.
+
+    If keep_local is set, nothing is deleted and files that are newer locally
+    aren't overwritten, e.g., when the user may have edited them since the last
+    upload.
+    """
     assert dest.is_dir(), f'Destination {dest} must be a directory'
     assert dest.is_absolute(), f'Destination {dest} must be absolute'
     remote_path = self._upload_path / source
     daemon = f'{self._daemon_addr}::{remote_path}/'
 
-    cmd = self._get_cmd_args() + [
+    cmd = self._get_cmd_args(delete=not keep_local)
+    if keep_local:
+      cmd.append('--update')
+    cmd += [
         '--quiet',
         daemon,
         str(dest),
     ]
-    return _run_rsync(cmd)
+    return _run_rsync(cmd, 'from_remote').code
 
-  def to_remote(self) -> int:
-    """Copies files/dirs to remote."""
+  def to_remote(self, files: Optional[Sequence[str]] = None) -> int:
+    """Copies files/dirs to remote.
+
+    If files (paths relative to the rxroot) are given, only those are copied
+    and nothing is deleted.
+    """
     daemon = f'{self._daemon_addr}::{self._upload_path}'
     # TODO: add --progress and provide info about what rsync is copying as it
     # goes. rsync's progress format looks like:
     #
     # some/path/to/file
     #     519 100%    1.12kB/s    0:00:00 (xfer#2709, to-check=2/3377)
-    cmd = self._get_cmd_args() + [
+    cmd = self._get_cmd_args(delete=files is None) + [
         '--inplace',
+        # Only used for metrics, this is all rsync writes to stdout.
+        '--stats',
+    ]
+    if files is not None:
+      cmd.append('--files-from=-')
+    cmd += [
         f'{self._sync_dir}/',
         daemon
     ]
-    return _run_rsync(cmd)
+    if files is None:
+      result = _run_rsync(cmd, 'to_remote')
+    else:
+      result = _run_rsync(
+        cmd, 'to_remote_files',
+        stdin=''.join(f'{f}\n' for f in files).encode('utf-8'))
+    self.last_bytes_sent = result.bytes_sent
+    return result.code
 
-  def _get_cmd_args(self) -> List[str]:
+  def _get_cmd_args(self, delete: bool = True) -> List[str]:
     """Returns the standard args for all rsync commands."""
     cmd = [
       self._rsync_path,
       '--archive',
       '--compress',
-      '--delete',
     ]
+    if delete:
+      cmd.append('--delete')
+    if _RSYNC_PORT.value:
+      cmd.append(f'--port={_RSYNC_PORT.value}')
     # Only add the rxignore option if the file exists.
     rxignore = self._sync_dir / local.IGNORE
     if rxignore.exists():
@@ -78,18 +127,37 @@ class RsyncClient:
     return cmd
 
 
-def _run_rsync(cmd: List[str]) -> int:
+def _run_rsync(
+    cmd: List[str], op: str, stdin: Optional[bytes] = None) -> _Result:
   logging.info('Running %s', cmd)
   try:
-    result = subprocess.run(cmd, check=True, capture_output=True)
+    with trace.span(f'rsync.{op}'):
+      with metrics.timer('rsync.duration_secs', op=op):
+        result = subprocess.run(
+          cmd, check=True, capture_output=True, input=stdin)
   except subprocess.CalledProcessError as e:
+    metrics.counter('rsync.errors', op=op).inc()
     logging.error('Error running `%s` (%s)', ' '.join(e.cmd), e.returncode)
     if e.returncode == 10:
       # Worker was unreachable.
       logging.error('stderr: %s', e.stderr.decode('utf-8'))
     if e.returncode is None:
-      return -1
-    return e.returncode
-  if result.stdout:
-    print(f'stdout: {result.stdout.decode("utf-8")}')
-  return 0
+      return _Result(-1)
+    return _Result(e.returncode)
+  stdout = result.stdout.decode('utf-8')
+  if '--stats' in cmd:
+    return _Result(0, bytes_sent=_record_stats(stdout, op))
+  if stdout:
+    print(f'stdout: {stdout}')
+  return _Result(0)
+
+
+def _record_stats(stdout: str, op: str) -> int:
+  """Records the bytes rsync sent and received, returns the bytes sent."""
+  sent = 0
+  for direction, count in _STATS_RE.findall(stdout):
+    n = int(count.replace(',', ''))
+    metrics.counter(f'rsync.bytes_{direction}', op=op).inc(n)
+    if direction == 'sent':
+      sent = n
+  return sent
@@ -7,6 +7,7 @@ from absl import flags
 from absl.testing import absltest
 
 from rx.client.configuration import local
+from rx.shared import metrics
 from rx.worker import rsync
 
 FLAGS = flags.FLAGS
@@ -38,7 +39,7 @@ class RsyncTests(unittest.TestCase):
 
   def test_from_remote(self):
     client = rsync.RsyncClient(self._local_cfg, self._remote_cfg)
-    rsync._run_rsync = mock.MagicMock(return_value=0)
+    rsync._run_rsync = mock.MagicMock(return_value=rsync._Result(0))
 
     outdir = pathlib.Path(absltest.TEST_TMPDIR.value)
     outdir.mkdir(parents=True, exist_ok=True)
@@ -53,11 +54,30 @@ class RsyncTests(unittest.TestCase):
       '--quiet',
       'abc123.trex.run-rx.com::f1d1df3b-e046-4e88-822e-72596e5020c5/rx-out/',
       str(outdir),
-    ])
+    ], 'from_remote')
+
+  def test_from_remote_keep_local(self):
+    client = rsync.RsyncClient(self._local_cfg, self._remote_cfg)
+    rsync._run_rsync = mock.MagicMock(return_value=rsync._Result(0))
+
+    outdir = pathlib.Path(absltest.TEST_TMPDIR.value)
+    outdir.mkdir(parents=True, exist_ok=True)
+    got = client.from_remote('.', outdir, keep_local=True)
+
+    self.assertEqual(got, 0)
+    rsync._run_rsync.assert_called_once_with([
+      '/usr/bin/rsync',
+      '--archive',
+      '--compress',
+      '--update',
+      '--quiet',
+      'abc123.trex.run-rx.com::f1d1df3b-e046-4e88-822e-72596e5020c5/',
+      str(outdir),
+    ], 'from_remote')
 
   def test_to_remote(self):
     client = rsync.RsyncClient(self._local_cfg, self._remote_cfg)
-    rsync._run_rsync = mock.MagicMock(return_value=0)
+    rsync._run_rsync = mock.MagicMock(return_value=rsync._Result(0))
 
     got = client.to_remote()
 
@@ -68,9 +88,43 @@ class RsyncTests(unittest.TestCase):
       '--compress',
       '--delete',
       '--inplace',
+      '--stats',
+      '/path/to/proj/',
+      'abc123.trex.run-rx.com::f1d1df3b-e046-4e88-822e-72596e5020c5',
+    ], 'to_remote')
+
+  def test_to_remote_files(self):
+    client = rsync.RsyncClient(self._local_cfg, self._remote_cfg)
+    rsync._run_rsync = mock.MagicMock(
+      return_value=rsync._Result(0, bytes_sent=1234))
+
+    got = client.to_remote(files=['requirements.txt', 'web/package.json'])
+
+    self.assertEqual(got, 0)
+    self.assertEqual(client.last_bytes_sent, 1234)
+    rsync._run_rsync.assert_called_once_with([
+      '/usr/bin/rsync',
+      '--archive',
+      '--compress',
+      '--inplace',
+      '--stats',
+      '--files-from=-',
       '/path/to/proj/',
       'abc123.trex.run-rx.com::f1d1df3b-e046-4e88-822e-72596e5020c5',
-    ])
+    ], 'to_remote_files', stdin=b'requirements.txt\nweb/package.json\n')
+
+  def test_record_stats(self):
+    sent = metrics.counter('rsync.bytes_sent', op='test')
+    received = metrics.counter('rsync.bytes_received', op='test')
+
+    got = rsync._record_stats(
+      'Number of files: 3,377\n'
+      'Total bytes sent: 12,345\n'
+      'Total bytes received: 678\n', 'test')
+
+    self.assertEqual(got, 12345)
+    self.assertEqual(sent.value, 12345)
+    self.assertEqual(received.value, 678)
 
   def test_execlude_file(self):
     # TODO: create .rxignore using tmpfile.